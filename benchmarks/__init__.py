@@ -0,0 +1,5 @@
+"""
+Бенчмарки LLM Telegram Bot
+
+Запуск из корня проекта: uv run python -m benchmarks.<имя_модуля>
+"""
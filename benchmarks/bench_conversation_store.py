@@ -0,0 +1,70 @@
+"""
+Бенчмарк памяти: 100k синтетических чатов в ConversationStore и в dict списков
+
+Запуск: uv run python -m benchmarks.bench_conversation_store --chats 100000 --messages 20
+"""
+
+import argparse
+import gc
+import time
+import tracemalloc
+from src.conversation_store import ConversationStore
+
+
+def make_text(chat_index, message_index):
+    """Синтетическая реплика средней длины"""
+    return f"Сообщение {message_index} из чата {chat_index}: сколько стоит интеграция ИИ в CRM?"
+
+
+def fill_dict_of_lists(chats, messages):
+    """Прежнее хранилище: {chat_id: [{"role", "content"}]}"""
+    storage = {}
+    for chat in range(chats):
+        storage[str(chat)] = [
+            {"role": "user" if i % 2 == 0 else "assistant", "content": make_text(chat, i)}
+            for i in range(messages)
+        ]
+    return storage
+
+
+def fill_store(chats, messages):
+    """Новое хранилище с кольцевыми буферами"""
+    store = ConversationStore(max_messages=messages, max_chats=chats, idle_ttl=3600)
+    for chat in range(chats):
+        for i in range(messages):
+            store.append(str(chat), "user" if i % 2 == 0 else "assistant", make_text(chat, i))
+    return store
+
+
+def measure(fill, chats, messages):
+    """Замерить память (tracemalloc) и время заполнения"""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fill(chats, messages)
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк памяти хранилища диалогов")
+    parser.add_argument("--chats", type=int, default=100000, help="Количество чатов")
+    parser.add_argument("--messages", type=int, default=20, help="Реплик в чате")
+    args = parser.parse_args()
+
+    storage, dict_bytes, dict_time = measure(fill_dict_of_lists, args.chats, args.messages)
+    del storage
+    store, store_bytes, store_time = measure(fill_store, args.chats, args.messages)
+
+    mb = 1024 * 1024
+    print(f"Чатов: {args.chats}, реплик в чате: {args.messages}")
+    print(f"dict списков:       {dict_bytes / mb:.1f} MB, заполнение {dict_time:.2f}s")
+    print(f"ConversationStore:  {store_bytes / mb:.1f} MB, заполнение {store_time:.2f}s")
+    print(f"Оценка size_bytes(): {store.size_bytes() / mb:.1f} MB")
+    print(f"Экономия памяти: {(1 - store_bytes / dict_bytes) * 100:.0f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""
+Сквозной нагрузочный тест: настоящий Dispatcher с обработчиками из main
+
+Обновления идут в dp.feed_update (как при polling), бот отвечает в локальный
+сервер Bot API, LLM - локальный mock с задержкой и ошибками. Задержка
+сообщения - от получения обновления до последнего ответа бота.
+
+Результаты сохраняются в JSON (с хешем коммита), чтобы сравнивать коммиты:
+    uv run python -m benchmarks.bench_e2e --chats 200 --messages 5
+    uv run python -m benchmarks.bench_e2e --compare benchmarks/results/e2e_<commit>_<time>.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+import src.config
+from benchmarks.bench_llm_concurrency import measure_loop_lag
+from benchmarks.fake_bot_api import create_fake_bot_api, start_fake_bot_api
+from benchmarks.fake_telegram import make_update
+from benchmarks.mock_llm_server import create_mock_app, start_mock_server
+from src.handlers import register_handlers
+from src.llm_client import init_llm_client, close_llm_client
+from src.logging_config import setup_logging, shutdown_logging
+from src.metrics import LLM_ERRORS_TOTAL, reset_metrics
+from src.resilience import get_resilience_stats, clear_resilience
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+# Показатели для сравнения: (ключ, подпись, больше - лучше)
+COMPARED = (
+    ("throughput", "сообщений/сек", True),
+    ("p50_ms", "p50, ms", False),
+    ("p95_ms", "p95, ms", False),
+    ("p99_ms", "p99, ms", False),
+    ("max_loop_lag_ms", "задержка loop, ms", False),
+    ("peak_rss_mb", "пиковый RSS, MB", False),
+)
+
+
+def get_rss_mb():
+    """Текущий и пиковый RSS процесса в мегабайтах (None, если ОС не сообщает)"""
+    current = peak = None
+    try:
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    except ImportError:
+        pass
+    return current, peak
+
+
+def get_commit():
+    """Короткий хеш текущего коммита"""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+
+def configure(args, log_dir):
+    """Настройки бота для прогона: константы по умолчанию и перезагрузка настроек"""
+    src.config.STREAM_RESPONSES = args.stream
+    src.config.PERSISTENCE_BACKEND = "none"
+    src.config.METRICS_ENABLED = False
+    # Квота OpenRouter к локальному mock серверу не относится
+    src.config.RATE_LIMIT_ENABLED = False
+    src.config.LOG_TO_CONSOLE = False
+    src.config.LOG_FILE_PATH = os.path.join(log_dir, "bench.log")
+    src.config.reload_config()
+
+
+async def run_chat(dp, bot, chat_id, messages, think_time, latencies):
+    """Один пользователь: пишет следующее сообщение после ответа на предыдущее"""
+    for i in range(messages):
+        update = Update.model_validate(make_update(chat_id, f"Вопрос {i} от пользователя {chat_id}"),
+                                       context={"bot": bot})
+        start = time.perf_counter()
+        await dp.feed_update(bot, update)
+        latencies.append(time.perf_counter() - start)
+        if think_time:
+            await asyncio.sleep(think_time)
+
+
+async def run_benchmark(args):
+    setup_logging()
+    reset_metrics()
+    clear_resilience()
+
+    llm_app = create_mock_app(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                              rate_limit_rate=args.rate_limit_rate)
+    llm_runner, base_url = await start_mock_server(llm_app)
+    os.environ.setdefault("OPENROUTER_API_KEY", "benchmark")
+    init_llm_client(base_url=base_url)
+
+    api_app = create_fake_bot_api(latency=args.telegram_latency)
+    api_runner, session = await start_fake_bot_api(api_app)
+    bot = Bot(token="123456:BENCHMARK", session=session)
+    dp = Dispatcher()
+    register_handlers(dp)
+
+    latencies = []
+    stop_event = asyncio.Event()
+    lag_task = asyncio.create_task(measure_loop_lag(stop_event))
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*[
+        run_chat(dp, bot, 500000 + i, args.messages, args.think_time, latencies) for i in range(args.chats)
+    ])
+    elapsed = time.perf_counter() - start_time
+
+    stop_event.set()
+    max_lag = await lag_task
+    rss, peak_rss = get_rss_mb()
+
+    await bot.session.close()
+    await close_llm_client()
+    await api_runner.cleanup()
+    await llm_runner.cleanup()
+    shutdown_logging()
+
+    latencies.sort()
+    return {
+        "messages": len(latencies),
+        "elapsed": round(elapsed, 3),
+        "throughput": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "max_ms": round(latencies[-1] * 1000, 1),
+        "max_loop_lag_ms": round(max_lag * 1000, 1),
+        "rss_mb": round(rss, 1) if rss is not None else None,
+        "peak_rss_mb": round(peak_rss, 1) if peak_rss is not None else None,
+        "llm_requests": llm_app["stats"]["requests"],
+        "llm_max_in_flight": llm_app["stats"]["max_in_flight"],
+        "llm_errors": {labels[0]: value for labels, value in LLM_ERRORS_TOTAL.values.items()},
+        "retries": get_resilience_stats()["retries"],
+        "telegram_requests": api_app["stats"]["methods"]
+    }
+
+
+def save_results(args, results):
+    """Сохранить результаты с параметрами прогона и хешем коммита"""
+    commit = get_commit()
+    report = {
+        "commit": commit,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "params": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "results": results
+    }
+    path = args.output or os.path.join(
+        RESULTS_DIR, f"e2e_{commit}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    return path
+
+
+def print_comparison(previous, results):
+    """Сравнить с прошлым прогоном"""
+    print(f"\nСравнение с {previous['commit']} ({previous['timestamp']}):")
+    if previous["params"] != results["params"]:
+        print("  Внимание: параметры прогонов различаются")
+    for key, title, higher_is_better in COMPARED:
+        old, new = previous["results"].get(key), results["results"].get(key)
+        if not old or new is None:
+            continue
+        change = (new - old) / old * 100
+        better = change > 0 if higher_is_better else change < 0
+        mark = "лучше" if better else "хуже" if change else ""
+        print(f"  {title:20} {old:>10} -> {new:<10} {change:+.1f}% {mark}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сквозной нагрузочный тест бота")
+    parser.add_argument("--chats", type=int, default=100, help="Одновременных пользователей")
+    parser.add_argument("--messages", type=int, default=5, help="Сообщений от каждого пользователя")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Пауза пользователя между сообщениями (сек)")
+    parser.add_argument("--latency", type=float, default=0.3, help="Базовая задержка mock LLM (сек)")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Средний хвост задержки LLM (сек)")
+    parser.add_argument("--error-rate", type=float, default=0.01, help="Доля ответов LLM 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Доля ответов LLM 429")
+    parser.add_argument("--telegram-latency", type=float, default=0.01, help="Задержка Bot API (сек)")
+    parser.add_argument("--stream", action=argparse.BooleanOptionalAction, default=True,
+                        help="Потоковая отправка ответов")
+    parser.add_argument("--output", help="Куда сохранить JSON (по умолчанию benchmarks/results/)")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as log_dir:
+        configure(args, log_dir)
+        results = asyncio.run(run_benchmark(args))
+
+    path = save_results(args, results)
+    print(f"Пользователей: {args.chats}, сообщений: {results['messages']}, поток: {args.stream}")
+    print(f"Пропускная способность: {results['throughput']} сообщений/сек за {results['elapsed']}s")
+    print(f"Задержка: p50={results['p50_ms']}ms p95={results['p95_ms']}ms p99={results['p99_ms']}ms "
+          f"max={results['max_ms']}ms")
+    print(f"Задержка event loop: {results['max_loop_lag_ms']}ms, RSS: {results['rss_mb']}MB "
+          f"(пик {results['peak_rss_mb']}MB)")
+    print(f"Вызовов LLM: {results['llm_requests']}, повторов: {results['retries']}, "
+          f"ошибок: {results['llm_errors']}")
+    print(f"Результаты: {path}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = json.load(f)
+        with open(path, encoding="utf-8") as f:
+            print_comparison(previous, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Бенчмарк: N одновременных чатов против локального mock LLM
+
+Показывает, что вызовы send_to_llm идут параллельно и не блокируют event loop:
+общее время ~ одной задержке LLM, а не N задержек.
+
+Запуск: uv run python -m benchmarks.bench_llm_concurrency --chats 50 --latency 0.5
+"""
+
+import argparse
+import asyncio
+import os
+import time
+import src.config
+from benchmarks.mock_llm_server import create_mock_app, start_mock_server
+from src.llm_client import init_llm_client, warmup_llm_client, close_llm_client, send_to_llm
+
+
+async def measure_loop_lag(stop_event, interval=0.01):
+    """Измерять максимальную задержку event loop пока идет нагрузка"""
+    max_lag = 0.0
+    while not stop_event.is_set():
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        max_lag = max(max_lag, time.perf_counter() - expected)
+    return max_lag
+
+
+async def run_benchmark(chats, latency):
+    """Запустить N чатов одновременно и вернуть результаты"""
+    app = create_mock_app(latency=latency)
+    runner, base_url = await start_mock_server(app)
+
+    # Квота OpenRouter к локальному mock серверу не относится
+    src.config.RATE_LIMIT_ENABLED = False
+    src.config.reload_config()
+    os.environ.setdefault("OPENROUTER_API_KEY", "benchmark")
+    init_llm_client(base_url=base_url)
+    await warmup_llm_client()
+
+    stop_event = asyncio.Event()
+    lag_task = asyncio.create_task(measure_loop_lag(stop_event))
+
+    start_time = time.perf_counter()
+    replies = await asyncio.gather(*[
+        send_to_llm(f"Вопрос {i}", chat_id=f"bench_{i}") for i in range(chats)
+    ])
+    elapsed = time.perf_counter() - start_time
+
+    stop_event.set()
+    max_lag = await lag_task
+
+    await close_llm_client()
+    await runner.cleanup()
+
+    return {
+        "chats": chats,
+        "latency": latency,
+        "elapsed": elapsed,
+        "serial_estimate": chats * latency,
+        "max_in_flight": app["stats"]["max_in_flight"],
+        "max_loop_lag": max_lag,
+        "ok_replies": sum(1 for r in replies if r == "Ответ mock сервера")
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк параллельных LLM вызовов")
+    parser.add_argument("--chats", type=int, default=50, help="Количество одновременных чатов")
+    parser.add_argument("--latency", type=float, default=0.5, help="Задержка mock LLM (сек)")
+    args = parser.parse_args()
+
+    result = asyncio.run(run_benchmark(args.chats, args.latency))
+
+    print(f"Чатов: {result['chats']}, задержка LLM: {result['latency']:.2f}s")
+    print(f"Общее время: {result['elapsed']:.2f}s (последовательно было бы ~{result['serial_estimate']:.2f}s)")
+    print(f"Максимум одновременных запросов на сервере: {result['max_in_flight']}")
+    print(f"Максимальная задержка event loop: {result['max_loop_lag'] * 1000:.1f}ms")
+    print(f"Успешных ответов: {result['ok_replies']}/{result['chats']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Нагрузочный тест: добавляет ли постоянное хранение задержку в handle_message
+
+Прогоняет одинаковую нагрузку через handle_message с локальным mock LLM
+без backend и с SQLite backend и сравнивает задержку на сообщение.
+
+Запуск: uv run python -m benchmarks.bench_persistence --messages 5000 --chats 500
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+import src.config
+from types import SimpleNamespace
+from benchmarks.mock_llm_server import create_mock_app, start_mock_server
+from src.config import get_public_config
+from src.handlers import handle_message, chat_conversations
+from src.llm_client import init_llm_client, close_llm_client
+from src.persistence import create_persistence_backend
+
+
+class FakeSentMessage:
+    """Отправленное сообщение: правки ничего не стоят"""
+
+    async def edit_text(self, text):
+        return self
+
+
+class FakeMessage:
+    """Входящее сообщение без обращения к Telegram"""
+
+    def __init__(self, chat_id, text):
+        self.chat = SimpleNamespace(id=chat_id, type="private")
+        self.from_user = None
+        self.text = text
+
+    async def answer(self, text):
+        return FakeSentMessage()
+
+
+async def run_load(messages, chats, concurrency):
+    """Прогнать нагрузку и вернуть задержки handle_message"""
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            start = time.perf_counter()
+            await handle_message(FakeMessage(1000 + i % chats, f"Вопрос {i}"))
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*[one(i) for i in range(messages)])
+    return sorted(latencies)
+
+
+async def run_benchmark(messages, chats, concurrency):
+    app = create_mock_app(latency=0.0)
+    runner, base_url = await start_mock_server(app)
+    # Квота OpenRouter к локальному mock серверу не относится
+    src.config.RATE_LIMIT_ENABLED = False
+    src.config.reload_config()
+    os.environ.setdefault("OPENROUTER_API_KEY", "benchmark")
+    init_llm_client(base_url=base_url)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in ("none", "sqlite"):
+            chat_conversations.clear()
+            config = dict(get_public_config(), persistence_backend=name,
+                          persistence_path=os.path.join(tmp, "bench.db"))
+            chat_conversations.backend = create_persistence_backend(config)
+
+            latencies = await run_load(messages, chats, concurrency)
+
+            flush_time = 0.0
+            if chat_conversations.backend is not None:
+                start = time.perf_counter()
+                chat_conversations.backend.close()
+                flush_time = time.perf_counter() - start
+            chat_conversations.backend = None
+            results[name] = (latencies, flush_time)
+
+    await close_llm_client()
+    await runner.cleanup()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест постоянного хранения")
+    parser.add_argument("--messages", type=int, default=5000, help="Всего сообщений")
+    parser.add_argument("--chats", type=int, default=500, help="Количество чатов")
+    parser.add_argument("--concurrency", type=int, default=10, help="Одновременных сообщений")
+    args = parser.parse_args()
+
+    results = asyncio.run(run_benchmark(args.messages, args.chats, args.concurrency))
+
+    print(f"Сообщений: {args.messages}, чатов: {args.chats}, параллельно: {args.concurrency}")
+    for name, (latencies, flush_time) in results.items():
+        p99 = latencies[int(len(latencies) * 0.99) - 1]
+        print(f"backend={name:6} p50={statistics.median(latencies) * 1000:.2f}ms "
+              f"p99={p99 * 1000:.2f}ms дозапись при остановке={flush_time * 1000:.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
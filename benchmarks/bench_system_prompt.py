@@ -0,0 +1,41 @@
+"""
+Микро-бенчмарк: стоимость build_prompt с чтением промпта с диска и из кеша
+
+Запуск: uv run python -m benchmarks.bench_system_prompt --calls 20000
+"""
+
+import argparse
+import timeit
+from src.llm_client import build_prompt, load_system_prompt
+
+
+def build_prompt_from_disk(chat_id, user_message, history=None):
+    """Прежняя сборка промпта: файл читается на каждое сообщение"""
+    messages = [{"role": "system", "content": load_system_prompt()}]
+    if history:
+        messages.extend(history)
+    messages.append({"role": "user", "content": user_message})
+    return messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк кеша системного промпта")
+    parser.add_argument("--calls", type=int, default=20000, help="Количество вызовов")
+    args = parser.parse_args()
+
+    history = [
+        {"role": "user", "content": "Сколько стоит интеграция ИИ в CRM?"},
+        {"role": "assistant", "content": "Зависит от объема работ."}
+    ]
+
+    disk_time = timeit.timeit(lambda: build_prompt_from_disk("bench", "Вопрос", history), number=args.calls)
+    cached_time = timeit.timeit(lambda: build_prompt("bench", "Вопрос", history), number=args.calls)
+
+    print(f"Вызовов: {args.calls}")
+    print(f"Чтение с диска: {disk_time / args.calls * 1e6:.2f} мкс/вызов")
+    print(f"Кеш в памяти:   {cached_time / args.calls * 1e6:.2f} мкс/вызов")
+    print(f"Ускорение: {disk_time / cached_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Бенчмарк пропускной способности webhook приема обновлений
+
+Поднимает webhook сервер с настоящим aiogram Dispatcher и обработчиком-счетчиком,
+затем "фейковый Telegram" шлет тысячи обновлений в секунду. Сеть не нужна.
+
+Запуск: uv run python -m benchmarks.bench_webhook --updates 20000 --concurrency 200
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from benchmarks.fake_telegram import fire_updates
+from src.config import get_public_config
+from src.webhook import create_webhook_app, QUEUE_KEY, STATS_KEY
+
+SECRET = "bench_secret"
+
+
+async def run_benchmark(total, concurrency, handler_delay):
+    """Прогнать total обновлений через webhook и вернуть результаты"""
+    processed = 0
+
+    async def counting_handler(message):
+        nonlocal processed
+        if handler_delay:
+            await asyncio.sleep(handler_delay)
+        processed += 1
+
+    bot = Bot(token="123456:BENCHMARK")
+    dp = Dispatcher()
+    dp.message.register(counting_handler)
+
+    app = create_webhook_app(dp, bot, SECRET)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    url = f"http://127.0.0.1:{port}{get_public_config()['webhook_path']}"
+
+    result = await fire_updates(url, SECRET, total, concurrency)
+
+    # Ждем пока пул дообработает очередь
+    drain_start = time.perf_counter()
+    await app[QUEUE_KEY].join()
+    drain_time = time.perf_counter() - drain_start
+
+    await runner.cleanup()
+    await bot.session.close()
+
+    result["processed"] = processed
+    result["drain_time"] = drain_time
+    result["stats"] = app[STATS_KEY]
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк webhook приема")
+    parser.add_argument("--updates", type=int, default=20000, help="Количество обновлений")
+    parser.add_argument("--concurrency", type=int, default=200, help="Параллельных соединений")
+    parser.add_argument("--handler-delay", type=float, default=0.0, help="Время обработки одного обновления (сек)")
+    args = parser.parse_args()
+
+    result = asyncio.run(run_benchmark(args.updates, args.concurrency, args.handler_delay))
+    latencies = sorted(result["ack_latencies"])
+
+    print(f"Обновлений: {args.updates}, параллельно: {args.concurrency}")
+    print(f"Прием: {args.updates / result['elapsed']:.0f} обновлений/с за {result['elapsed']:.2f}s")
+    print(f"Ответы сервера: {result['statuses']}")
+    print(f"Ack p50: {statistics.median(latencies) * 1000:.1f}ms, "
+          f"p99: {latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f}ms")
+    print(f"Обработано: {result['processed']} (дообработка очереди {result['drain_time']:.2f}s)")
+    print(f"Статистика сервера: {result['stats']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Локальный сервер Bot API для бенчмарков
+
+Принимает запросы бота (sendMessage, editMessageText и т.д.) вместо
+api.telegram.org и отвечает в формате Bot API с заданной задержкой
+"""
+
+import asyncio
+import itertools
+import time
+from aiohttp import web
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+_message_ids = itertools.count(1)
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Bench Bot", "username": "bench_bot"}
+
+
+def build_message(data):
+    """Сообщение бота в ответ на sendMessage/editMessageText"""
+    return {
+        "message_id": int(data.get("message_id") or next(_message_ids)),
+        "date": int(time.time()),
+        "chat": {"id": int(data["chat_id"]), "type": "private"},
+        "from": BOT_USER,
+        "text": data.get("text", "")
+    }
+
+
+def create_fake_bot_api(latency=0.0):
+    """Создать aiohttp приложение, отвечающее как Bot API"""
+    app = web.Application()
+    app["stats"] = {"requests": 0, "methods": {}}
+
+    async def handle_method(request):
+        method = request.match_info["method"]
+        stats = request.app["stats"]
+        stats["requests"] += 1
+        stats["methods"][method] = stats["methods"].get(method, 0) + 1
+
+        data = dict(await request.post())
+        if latency:
+            await asyncio.sleep(latency)
+
+        if method in ("sendMessage", "editMessageText"):
+            result = build_message(data)
+        elif method == "getMe":
+            result = BOT_USER
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    app.router.add_post("/bot{token}/{method}", handle_method)
+    return app
+
+
+async def start_fake_bot_api(app, host="127.0.0.1", port=0):
+    """Запустить сервер и вернуть (runner, сессия aiogram, направленная на него)"""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+
+    bound_port = site._server.sockets[0].getsockname()[1]
+    session = AiohttpSession(api=TelegramAPIServer.from_base(f"http://{host}:{bound_port}"))
+    return runner, session
@@ -0,0 +1,57 @@
+"""
+Локальный "фейковый Telegram" для бенчмарков
+
+Генерирует обновления в формате Bot API и отправляет их на webhook
+так же, как это делает Telegram: POST с JSON и секретным заголовком
+"""
+
+import asyncio
+import itertools
+import time
+import aiohttp
+from src.webhook import SECRET_HEADER
+
+# Сквозной счетчик update_id, как у настоящего Telegram
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+
+def make_update(chat_id, text, update_id=None):
+    """Сформировать обновление с текстовым сообщением из личного чата"""
+    return {
+        "update_id": update_id if update_id is not None else next(_update_ids),
+        "message": {
+            "message_id": next(_message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private", "first_name": "Bench"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Bench", "username": f"user{chat_id}"},
+            "text": text
+        }
+    }
+
+
+async def fire_updates(url, secret, total, concurrency=100, chats=1000):
+    """Отправить total обновлений с заданной параллельностью
+
+    Возвращает dict: время, коды ответов и задержки подтверждения (ack)
+    """
+    ack_latencies = []
+    statuses = {}
+    counter = itertools.count()
+
+    async def sender(session):
+        while next(counter) < total:
+            update = make_update(chat_id=100000 + next(_update_ids) % chats, text="Сколько стоит чат-бот?")
+            start = time.perf_counter()
+            async with session.post(url, json=update, headers={SECRET_HEADER: secret}) as response:
+                await response.read()
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+            ack_latencies.append(time.perf_counter() - start)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        start_time = time.perf_counter()
+        await asyncio.gather(*[sender(session) for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start_time
+
+    return {"elapsed": elapsed, "statuses": statuses, "ack_latencies": ack_latencies}
@@ -0,0 +1,117 @@
+"""
+Локальный OpenAI-совместимый mock сервер для бенчмарков
+
+Отвечает на /v1/chat/completions с заданной задержкой, без обращения в сеть.
+Задержка может иметь "хвост" (экспоненциальная добавка), часть ответов -
+ошибки 500 и 429, как у настоящего upstream под нагрузкой.
+"""
+
+import asyncio
+import json
+import random
+import time
+from aiohttp import web
+
+
+def build_completion(content, model):
+    """Сформировать ответ в формате chat.completions"""
+    return {
+        "id": f"mock-{time.time_ns()}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop"
+        }],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 10, "total_tokens": 20}
+    }
+
+
+def build_chunk(content, model):
+    """Сформировать фрагмент потокового ответа chat.completions"""
+    return {
+        "id": "mock-stream",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": {"content": content}, "finish_reason": None}]
+    }
+
+
+async def stream_completion(request, content, model, latency, chunk_size=8, include_usage=False):
+    """Отдать ответ через SSE: первый фрагмент после задержки, остальные подряд"""
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+    await response.prepare(request)
+    await asyncio.sleep(latency)
+    for start in range(0, len(content), chunk_size):
+        chunk = build_chunk(content[start:start + chunk_size], model)
+        await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        await asyncio.sleep(0)
+    if include_usage:
+        # Как у OpenAI: расход токенов - отдельным фрагментом без choices
+        usage = dict(build_chunk("", model), choices=[], usage=build_completion(content, model)["usage"])
+        await response.write(f"data: {json.dumps(usage)}\n\n".encode())
+    await response.write(b"data: [DONE]\n\n")
+    await response.write_eof()
+    return response
+
+
+def sample_latency(latency, jitter):
+    """Задержка ответа: база плюс экспоненциальный хвост со средним jitter"""
+    return latency + (random.expovariate(1.0 / jitter) if jitter > 0 else 0.0)
+
+
+def create_mock_app(latency=0.5, reply="Ответ mock сервера", jitter=0.0, error_rate=0.0, rate_limit_rate=0.0):
+    """Создать aiohttp приложение mock сервера
+
+    error_rate - доля ответов 500, rate_limit_rate - доля ответов 429 с Retry-After.
+    """
+    app = web.Application()
+    app["stats"] = {"requests": 0, "in_flight": 0, "max_in_flight": 0, "errors": 0, "rate_limited": 0}
+
+    async def handle_completion(request):
+        stats = request.app["stats"]
+        stats["requests"] += 1
+        stats["in_flight"] += 1
+        stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+        try:
+            body = await request.json()
+            delay = sample_latency(latency, jitter)
+            roll = random.random()
+            if roll < error_rate:
+                stats["errors"] += 1
+                await asyncio.sleep(delay)
+                return web.json_response({"error": {"message": "mock upstream error", "code": 500}}, status=500)
+            if roll < error_rate + rate_limit_rate:
+                stats["rate_limited"] += 1
+                return web.json_response({"error": {"message": "Rate limit exceeded", "code": 429}},
+                                         status=429, headers={"Retry-After": "1"})
+            if body.get("stream"):
+                include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+                return await stream_completion(request, reply, body.get("model", "mock"), delay,
+                                               include_usage=include_usage)
+            await asyncio.sleep(delay)
+            return web.json_response(build_completion(reply, body.get("model", "mock")))
+        finally:
+            stats["in_flight"] -= 1
+
+    async def handle_root(request):
+        return web.Response(text="ok")
+
+    app.router.add_post("/v1/chat/completions", handle_completion)
+    app.router.add_route("*", "/v1", handle_root)
+    return app
+
+
+async def start_mock_server(app, host="127.0.0.1", port=0):
+    """Запустить mock сервер и вернуть (runner, base_url)"""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+
+    # При port=0 система выбирает свободный порт
+    bound_port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{bound_port}/v1"
@@ -4,13 +4,23 @@
 
 import asyncio
 import os
+import signal
 import time
 from aiogram import Bot, Dispatcher
-from aiogram.filters import Command
-from dotenv import load_dotenv
-from src.handlers import simple_handler, handle_start, handle_help, handle_clear, handle_stop, handle_message
-from src.config import get_public_config
-from src.logging_config import setup_logging, log_bot_start, log_bot_stop
+from src.handlers import register_handlers, chat_conversations, request_scheduler, reload_settings
+from src.config import get_public_config, reload_config, load_env_file
+from src.llm_client import init_llm_client, warmup_llm_client, close_llm_client, get_system_prompt
+from src.response_cache import load_cache_seed
+from src.webhook import run_webhook
+from src.sharding import run_sharded
+from src.persistence import create_persistence_backend
+from src.snapshot import restore_snapshot, save_snapshot
+from src.summarizer import stop_summaries
+from src.usage import start_usage_flusher, stop_usage_flusher
+from src.retrieval import init_knowledge_index
+from src.tracing import toggle_profiling, stop_profiling
+from src.metrics import start_metrics_server, MESSAGES_TOTAL
+from src.logging_config import setup_logging, shutdown_logging, log_bot_start, log_bot_stop, log_shutdown_drain
 
 
 async def main():
@@ -20,13 +30,18 @@ async def main():
     print("LLM Telegram Bot v1.0.0")
     print("Инициализация...")
     
+    # Загружаем переменные окружения: секреты и переопределения настроек
+    load_env_file()
+    try:
+        reload_config()
+    except ValueError as e:
+        print(f"Ошибка: {e}")
+        return
+    
     # Настройка логирования
     logger = setup_logging()
     log_bot_start("1.0.0")
     
-    # Загружаем переменные окружения
-    load_dotenv()
-    
     # Получаем секретные данные из .env
     telegram_token = os.getenv("TELEGRAM_BOT_TOKEN")
     openrouter_api_key = os.getenv("OPENROUTER_API_KEY")
@@ -47,35 +62,118 @@ async def main():
     print(f"Конфигурация загружена:")
     print(f"- Модель LLM: {config['model_name']}")
     print(f"- Максимум истории: {config['max_history_length']} сообщений")
+    print(f"- Режим получения обновлений: {config['bot_mode']}")
+    
+    # Для webhook режима нужны публичный адрес и секрет
+    webhook_url = os.getenv("WEBHOOK_URL")
+    webhook_secret = os.getenv("WEBHOOK_SECRET")
+    if config["bot_mode"] == "webhook" and not (webhook_url and webhook_secret):
+        print("Ошибка: для webhook режима нужны WEBHOOK_URL и WEBHOOK_SECRET в .env файле")
+        return
+    
+    # В режиме шардов история, кеш и LLM клиент живут в процессах-воркерах
+    sharded = config["shard_workers"] > 1
+    if sharded:
+        print(f"- Процессов-воркеров: {config['shard_workers']}")
+    else:
+        # Подключаем постоянное хранение истории диалогов
+        chat_conversations.backend = create_persistence_backend(config)
+        print(f"- Хранение истории: {config['persistence_backend']}")
+        
+        # Снимок прошлого запуска: чаты подгружаются из него при первом обращении
+        if config["snapshot_enabled"]:
+            restored = restore_snapshot(chat_conversations, config["snapshot_path"])
+            print(f"- Чатов в снимке истории: {restored}")
+    
+        # Предзаполняем кеш ответов на частые вопросы
+        if config["response_cache_seed_file"]:
+            seeded = load_cache_seed(config["response_cache_seed_file"], get_system_prompt()["hash"])
+            print(f"- Кеш ответов предзаполнен: {seeded} записей")
+    
+        # Индекс базы знаний: ответы без LLM и фрагменты в промпт
+        snippets = init_knowledge_index(config)
+        print(f"- Фрагментов в базе знаний: {snippets}")
+    
+        # Периодический отчет о расходе токенов по чатам
+        start_usage_flusher(config["usage_log_path"])
+    
+        # Создаем общий LLM клиент и заранее устанавливаем соединение
+        if openrouter_api_key:
+            init_llm_client()
+            await warmup_llm_client()
     
     # Создаем бота и диспетчер
     bot = Bot(token=telegram_token)
     dp = Dispatcher()
     
-    # Регистрируем обработчики команд
-    dp.message.register(handle_start, Command("start"))
-    dp.message.register(handle_help, Command("help"))
-    dp.message.register(handle_clear, Command("clear"))
-    dp.message.register(handle_stop, Command("stop"))
+    # Регистрируем обработчики команд и сообщений
+    register_handlers(dp)
+    
+    # Запускаем сервер метрик
+    metrics_runner = None
+    if config["metrics_enabled"]:
+        metrics_runner = await start_metrics_server(config["metrics_host"], config["metrics_port"])
+        print(f"- Метрики: http://{config['metrics_host']}:{config['metrics_port']}/metrics")
+    
+    # SIGHUP - перечитать настройки без перезапуска (в режиме шардов - см. src/sharding.py)
+    if hasattr(signal, "SIGHUP") and not sharded:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, reload_settings)
     
-    # Регистрируем обработчик обычных сообщений (должен быть последним)
-    dp.message.register(handle_message)
+    # SIGUSR1 - начать или закончить окно профилирования (в режиме шардов - в воркерах)
+    if hasattr(signal, "SIGUSR1") and not sharded:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, toggle_profiling)
     
     print("Бот запущен и готов к работе!")
     logger.info("Бот запущен и готов к работе!")
     
     try:
-        # Запускаем polling
-        await dp.start_polling(bot)
+        if sharded:
+            await run_sharded(dp, bot, config, webhook_url, webhook_secret)
+        elif config["bot_mode"] == "webhook":
+            await run_webhook(dp, bot, webhook_url, webhook_secret)
+        else:
+            # Снимаем webhook, если он остался от webhook режима, и запускаем polling
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
     except KeyboardInterrupt:
         logger.info("Получен сигнал остановки")
     except Exception as e:
         logger.error(f"Критическая ошибка: {e}")
     finally:
+        # Новые обновления уже не принимаются: даем дообработать начатые сообщения
+        if not sharded:
+            drain_start = time.time()
+            drained = await request_scheduler.wait_idle(config["shutdown_timeout"])
+            log_shutdown_drain(drained, time.time() - drain_start)
+        
+        # Незаконченное окно профилирования записываем как есть
+        await stop_profiling()
+        
+        # Отменяем фоновые сжатия истории и закрываем пул соединений LLM
+        await stop_summaries()
+        if not sharded:
+            await stop_usage_flusher(config["usage_log_path"])
+        await close_llm_client()
+        
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        
+        # Сохраняем снимок истории для быстрого перезапуска
+        if not sharded and config["snapshot_enabled"]:
+            save_snapshot(chat_conversations, config["snapshot_path"], config["chat_idle_ttl"])
+        
+        # Дописываем на диск очередь изменений истории
+        if chat_conversations.backend is not None:
+            chat_conversations.backend.close()
+        
         # Логируем остановку
         uptime = time.time() - start_time
-        log_bot_stop(uptime_seconds=int(uptime))
+        # В режиме шардов сообщения считают воркеры (их /metrics), у супервизора счетчик пуст
+        log_bot_stop(uptime_seconds=int(uptime), total_requests=None if sharded else MESSAGES_TOTAL.get())
         logger.info("Бот остановлен")
+        
+        # Дописываем очередь логов
+        shutdown_logging()
 
 
 if __name__ == "__main__":
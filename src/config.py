@@ -3,18 +3,164 @@
 
 Публичные настройки приложения согласно vision.md
 Секретные данные (токены) читаются отдельно из .env
+
+Константы ниже - значения по умолчанию. Любую можно переопределить
+переменной окружения с тем же именем (TEMPERATURE=0.3, FALLBACK_MODELS=a,b,
+LOG_SAMPLE_RATES={"QUEUE_WAIT": 0.1}). Настройки собираются один раз в
+неизменяемый объект Settings с проверкой значений; reload_config() (SIGHUP)
+собирает новый объект и заменяет текущий целиком.
 """
 
+import json
+import os
+from dataclasses import dataclass, fields
+from collections.abc import Mapping
+from types import MappingProxyType
+from dotenv import dotenv_values
+
 # Настройки LLM
 MODEL_NAME = "openai/gpt-4o-mini"
 TEMPERATURE = 0.7
 MAX_TOKENS = 1000
 
+# Устойчивость вызовов LLM
+FALLBACK_MODELS = []                # Резервные модели по порядку, например ["anthropic/claude-3-haiku"]
+LLM_MAX_RETRIES = 2                 # Повторов временных ошибок для каждой модели
+LLM_RETRY_BASE_DELAY = 0.5          # Базовая пауза перед повтором (сек), растет вдвое
+LLM_RETRY_MAX_DELAY = 8.0           # Максимальная пауза перед повтором (сек)
+LLM_HEDGE_ENABLED = False           # Страховочный запрос при медленном ответе (тратит токены)
+LLM_HEDGE_DELAY = 0.0               # Когда отправлять страховку (сек); 0 - по p95 последних ответов
+
+# Настройки HTTP-клиента LLM (общий пул соединений на процесс)
+LLM_BASE_URL = "https://openrouter.ai/api/v1"
+LLM_MAX_CONNECTIONS = 100           # Максимум одновременных соединений
+LLM_MAX_KEEPALIVE_CONNECTIONS = 20  # Соединения, которые держим открытыми
+LLM_KEEPALIVE_EXPIRY = 30.0         # Сколько секунд держать простаивающее соединение
+LLM_CONNECT_TIMEOUT = 5.0           # Таймаут установки соединения (сек)
+LLM_READ_TIMEOUT = 60.0             # Таймаут чтения ответа (сек)
+LLM_WRITE_TIMEOUT = 10.0            # Таймаут отправки запроса (сек)
+LLM_POOL_TIMEOUT = 5.0              # Ожидание свободного соединения в пуле (сек)
+
+# Планировщик: порядок сообщений в чате и общий лимит вызовов LLM
+LLM_MAX_CONCURRENCY = 50            # Одновременных вызовов LLM на процесс
+SCHEDULER_QUEUE_SIZE = 1000         # Максимум сообщений в ожидании (дальше отказ)
+SCHEDULER_CHAT_QUEUE_SIZE = 5       # Максимум сообщений в очереди одного чата
+
+# Шардирование по чатам: несколько процессов-воркеров (см. src/sharding.py)
+SHARD_WORKERS = 1                   # Процессов-воркеров; 1 - все в одном процессе
+SHARD_REPLICAS = 100                # Виртуальных узлов на воркер в кольце хешей
+SHARD_REBALANCE_TIMEOUT = 60.0      # Сколько ждать передачи чатов при смене числа воркеров (сек)
+SHARD_SHARED_PERSISTENCE = False    # Один backend истории на всех воркеров (иначе - свой файл у каждого)
+
+# Ограничение частоты запросов к LLM (token bucket)
+RATE_LIMIT_ENABLED = True
+RATE_LIMIT_GLOBAL_RPS = 20.0        # Запросов в секунду на процесс (квота OpenRouter)
+RATE_LIMIT_GLOBAL_BURST = 40        # Запас для коротких всплесков
+RATE_LIMIT_CHAT_PER_MINUTE = 10     # Запросов в минуту от одного чата
+RATE_LIMIT_CHAT_BURST = 5           # Сколько сообщений чат может отправить подряд
+RATE_LIMIT_MAX_WAIT = 5.0           # Дольше ждать токен не будем - отказ (сек)
+RATE_LIMIT_BACKOFF = 0.5            # Во сколько раз снижать скорость после 429
+RATE_LIMIT_MIN_RPS = 1.0            # Ниже этой скорости не опускаемся
+RATE_LIMIT_RECOVERY = 0.1           # Прибавка скорости за каждый успешный ответ (запросов/сек)
+
+# Кеш ответов на повторяющиеся вопросы
+RESPONSE_CACHE_ENABLED = True
+RESPONSE_CACHE_SIZE = 1000              # Максимум ответов в кеше (LRU)
+RESPONSE_CACHE_TTL = 6 * 3600           # Время жизни ответа (сек)
+RESPONSE_CACHE_CONTEXT_MESSAGES = 0     # Сообщений истории в ключе (0 - только первый вопрос)
+RESPONSE_CACHE_SEED_FILE = ""           # JSON [{"question", "answer"}] для предзаполнения
+
+# Режим получения обновлений: "polling" или "webhook"
+# Для webhook в .env нужны WEBHOOK_URL и WEBHOOK_SECRET
+BOT_MODE = "polling"
+WEBHOOK_HOST = "0.0.0.0"
+WEBHOOK_PORT = 8080
+WEBHOOK_PATH = "/webhook"
+WEBHOOK_WORKERS = 32                # Обновлений, обрабатываемых параллельно
+WEBHOOK_QUEUE_SIZE = 1000           # Максимум обновлений в очереди (дальше 503)
+
+# Настройки потоковой отправки ответов
+STREAM_RESPONSES = True             # Показывать ответ по мере генерации
+STREAM_EDIT_INTERVAL = 1.0          # Пауза между редактированиями сообщения (сек)
+STREAM_GROUP_EDIT_INTERVAL = 3.0    # То же для групп (лимит Telegram 20 сообщений/мин)
+STREAM_MAX_EDIT_INTERVAL = 5.0      # Верхняя граница паузы после flood control
+
+# Очередь исходящих сообщений (лимиты Telegram Bot API)
+TELEGRAM_GLOBAL_RPS = 30.0          # Сообщений в секунду на бота
+TELEGRAM_CHAT_RPS = 1.0             # Сообщений в секунду в личный чат
+TELEGRAM_GROUP_PER_MINUTE = 20      # Сообщений в минуту в группу
+TELEGRAM_CHAT_BURST = 3             # Сколько сообщений чат может получить подряд
+TELEGRAM_SEND_ATTEMPTS = 3          # Попыток отправки при flood control (RetryAfter)
+
+# Сообщения, пришедшие, пока бот отвечает на прошлое, уходят в LLM одной репликой;
+# одиночное сообщение обрабатывается сразу
+MESSAGE_DEBOUNCE_WINDOW = 0.0       # Сколько секунд дополнительно ждать продолжения (0 - не ждать)
+
 # Настройки истории диалогов
-MAX_HISTORY_LENGTH = 20
+MAX_HISTORY_LENGTH = 50            # Сколько реплик хранить; в промпт идет то, что влезает в бюджет токенов
+CONTEXT_TOKEN_BUDGET = 8000        # Токенов на запрос: системный промпт + история + ответ
+HISTORY_TRIM_CHUNK = 10            # Старые реплики отбрасываются пачками, чтобы начало промпта не менялось каждый ход
+MAX_USER_MESSAGE_TOKENS = 2000     # Более длинное сообщение пользователя обрезается
+MAX_ACTIVE_CHATS = 100000   # Сколько чатов держать в памяти (вытесняются по LRU)
+CHAT_IDLE_TTL = 24 * 3600   # Через сколько секунд простоя история чата удаляется
+
+# База знаний: ответы без LLM и фрагменты в промпт (см. src/retrieval.py)
+RETRIEVAL_ENABLED = True
+KNOWLEDGE_DIR = "knowledge"                    # Тексты об услугах (.md) и готовые ответы (.json)
+KNOWLEDGE_INDEX_DIR = "data/knowledge_index"   # Собирается: python -m src.retrieval build
+RETRIEVAL_TOP_K = 3                 # Сколько фрагментов добавлять в промпт
+RETRIEVAL_MIN_SCORE = 0.2           # Ниже - фрагмент не относится к вопросу
+RETRIEVAL_ANSWER_SCORE = 0.85       # Выше - готовый ответ отправляется без вызова LLM
+RETRIEVAL_CONTEXT_TOKENS = 600      # Токенов на фрагменты в промпте
+
+# Сжатие длинных диалогов: старые реплики заменяются кратким содержанием
+SUMMARY_ENABLED = False
+SUMMARY_MODEL = "meta-llama/llama-3.1-8b-instruct"   # Дешевая модель для пересказа
+SUMMARY_TRIGGER_TOKENS = 2000      # Сжимать, когда история длиннее (токенов)
+SUMMARY_KEEP_TURNS = 6             # Сколько последних реплик оставлять дословно
+SUMMARY_MAX_TOKENS = 400           # Максимальная длина краткого содержания
+
+# Учет расхода токенов и дневные бюджеты чатов (см. src/usage.py)
+USAGE_FLUSH_INTERVAL = 60.0         # Как часто сбрасывать накопленный расход (сек)
+USAGE_LOG_PATH = "logs/token_usage.jsonl"   # Отчет по чатам и моделям ("" - только сводка в логе)
+TOKEN_BUDGET_ENABLED = True
+CHAT_DAILY_TOKEN_BUDGET = 200000    # Токенов (промпт + ответ) на чат в сутки
+TOKEN_BUDGET_DOWNSHIFT = 0.8        # С какой доли бюджета сокращать ответы
+TOKEN_BUDGET_MAX_TOKENS = 300       # max_tokens для чатов близко к лимиту
+TOKEN_BUDGET_MODEL = "meta-llama/llama-3.1-8b-instruct"   # Модель после исчерпания бюджета ("" - прежняя)
+
+# Постоянное хранение истории ("none" - только память, "sqlite" - файл на диске)
+PERSISTENCE_BACKEND = "sqlite"
+PERSISTENCE_PATH = "data/conversations.db"
+PERSISTENCE_BATCH_SIZE = 500        # Максимум операций в одной транзакции
+PERSISTENCE_FLUSH_INTERVAL = 0.05   # Сколько секунд копить операции в пачку
+
+# Остановка и перезапуск: дообработка сообщений и снимок истории (см. src/snapshot.py)
+SHUTDOWN_TIMEOUT = 20.0             # Сколько секунд ждать сообщения в обработке при остановке
+SNAPSHOT_ENABLED = True
+SNAPSHOT_PATH = "data/conversations.snapshot"
+
+# HTTP сервер метрик Prometheus (GET /metrics)
+METRICS_ENABLED = True
+METRICS_HOST = "127.0.0.1"          # "0.0.0.0", чтобы метрики собирали снаружи контейнера
+METRICS_PORT = 9090
+
+# Трассировка обработки обновлений и профилирование по запросу (см. src/tracing.py)
+TRACE_ENABLED = True
+TRACE_SAMPLE_RATE = 0.01            # Доля обычных трасс, которые пишутся в лог
+TRACE_SLOW_THRESHOLD = 5.0          # Трассы дольше (сек) пишутся в лог всегда
+TRACE_BUFFER_SIZE = 1000            # Сколько последних трасс отдавать по GET /traces
+ADMIN_CHAT_IDS = []                 # Чаты, которым доступна команда /profile, например ["123456789"]
+PROFILE_DIR = "logs/profiles"       # Куда записывать результаты профилирования
+PROFILE_DURATION = 30.0             # Окно профилирования по умолчанию (сек)
+PROFILE_INTERVAL = 0.005            # Как часто снимать стек event loop (сек)
 
 # Системные настройки
 SYSTEM_PROMPT_FILE = "src/system_prompt.md"
+PROMPT_CHECK_INTERVAL = 1.0  # Как часто проверять изменение файла промпта (сек)
+PROMPT_CACHE_ENABLED = True  # Метки кеша промпта провайдера (cache_control)
+# Модели, которым нужны явные метки; OpenAI и DeepSeek кешируют начало промпта сами
+PROMPT_CACHE_MODELS = ["anthropic/", "google/gemini"]
 
 # Настройки логирования
 LOG_TO_FILE = True          # Логировать в файл
@@ -22,22 +168,317 @@ LOG_TO_CONSOLE = True       # Логировать в консоль
 LOG_FILE_PATH = "logs/llm_bot.log"
 LOG_LEVEL = "INFO"
 LOG_MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
-LOG_BACKUP_COUNT = 5        # Количество файлов ротации
+LOG_BACKUP_COUNT = 5        # Количество файлов ротации (старые сжимаются gzip)
+LOG_FORMAT = "text"         # "text" или "json" (JSON lines)
+LOG_QUEUE_SIZE = 10000      # Записей в очереди к потоку записи (дальше отбрасываются)
+LOG_SAMPLE_RATES = {}       # Доля записей частых событий, например {"QUEUE_WAIT": 0.1}
+
+
+@dataclass(frozen=True, slots=True)
+class Settings:
+    """Публичные настройки: неизменяемый объект, поля - имена констант в нижнем регистре
+
+    Поддерживает и чтение как словаря (config["max_tokens"]), поэтому
+    код, написанный для dict, работает без изменений.
+    """
+
+    model_name: str
+    temperature: float
+    max_tokens: int
+    fallback_models: tuple
+    llm_max_retries: int
+    llm_retry_base_delay: float
+    llm_retry_max_delay: float
+    llm_hedge_enabled: bool
+    llm_hedge_delay: float
+    llm_base_url: str
+    llm_max_connections: int
+    llm_max_keepalive_connections: int
+    llm_keepalive_expiry: float
+    llm_connect_timeout: float
+    llm_read_timeout: float
+    llm_write_timeout: float
+    llm_pool_timeout: float
+    llm_max_concurrency: int
+    scheduler_queue_size: int
+    scheduler_chat_queue_size: int
+    shard_workers: int
+    shard_replicas: int
+    shard_rebalance_timeout: float
+    shard_shared_persistence: bool
+    rate_limit_enabled: bool
+    rate_limit_global_rps: float
+    rate_limit_global_burst: int
+    rate_limit_chat_per_minute: float
+    rate_limit_chat_burst: int
+    rate_limit_max_wait: float
+    rate_limit_backoff: float
+    rate_limit_min_rps: float
+    rate_limit_recovery: float
+    response_cache_enabled: bool
+    response_cache_size: int
+    response_cache_ttl: float
+    response_cache_context_messages: int
+    response_cache_seed_file: str
+    bot_mode: str
+    webhook_host: str
+    webhook_port: int
+    webhook_path: str
+    webhook_workers: int
+    webhook_queue_size: int
+    stream_responses: bool
+    stream_edit_interval: float
+    stream_group_edit_interval: float
+    stream_max_edit_interval: float
+    telegram_global_rps: float
+    telegram_chat_rps: float
+    telegram_group_per_minute: float
+    telegram_chat_burst: int
+    telegram_send_attempts: int
+    message_debounce_window: float
+    max_history_length: int
+    context_token_budget: int
+    history_trim_chunk: int
+    max_user_message_tokens: int
+    max_active_chats: int
+    chat_idle_ttl: float
+    retrieval_enabled: bool
+    knowledge_dir: str
+    knowledge_index_dir: str
+    retrieval_top_k: int
+    retrieval_min_score: float
+    retrieval_answer_score: float
+    retrieval_context_tokens: int
+    summary_enabled: bool
+    summary_model: str
+    summary_trigger_tokens: int
+    summary_keep_turns: int
+    summary_max_tokens: int
+    usage_flush_interval: float
+    usage_log_path: str
+    token_budget_enabled: bool
+    chat_daily_token_budget: int
+    token_budget_downshift: float
+    token_budget_max_tokens: int
+    token_budget_model: str
+    persistence_backend: str
+    persistence_path: str
+    persistence_batch_size: int
+    persistence_flush_interval: float
+    shutdown_timeout: float
+    snapshot_enabled: bool
+    snapshot_path: str
+    metrics_enabled: bool
+    metrics_host: str
+    metrics_port: int
+    trace_enabled: bool
+    trace_sample_rate: float
+    trace_slow_threshold: float
+    trace_buffer_size: int
+    admin_chat_ids: tuple
+    profile_dir: str
+    profile_duration: float
+    profile_interval: float
+    system_prompt_file: str
+    prompt_check_interval: float
+    prompt_cache_enabled: bool
+    prompt_cache_models: tuple
+    # Настройки логирования
+    log_to_file: bool
+    log_to_console: bool
+    log_file_path: str
+    log_level: str
+    log_max_file_size: int
+    log_backup_count: int
+    log_format: str
+    log_queue_size: int
+    log_sample_rates: Mapping
+
+    def __post_init__(self):
+        errors = validate_settings(self)
+        if errors:
+            raise ValueError("Неверные настройки: " + "; ".join(errors))
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __contains__(self, key):
+        return key in SETTINGS_FIELDS
+
+    def keys(self):
+        return SETTINGS_FIELDS
+
+
+SETTINGS_FIELDS = tuple(field.name for field in fields(Settings))
+
+# Поля, которые должны быть больше нуля
+POSITIVE_FIELDS = (
+    "max_tokens", "llm_max_connections", "llm_max_concurrency", "scheduler_queue_size",
+    "scheduler_chat_queue_size", "shard_workers", "shard_replicas", "rate_limit_global_rps",
+    "rate_limit_global_burst", "rate_limit_chat_per_minute", "rate_limit_chat_burst",
+    "response_cache_size", "telegram_global_rps", "telegram_chat_rps", "telegram_group_per_minute",
+    "telegram_chat_burst", "telegram_send_attempts", "webhook_workers", "webhook_queue_size", "max_history_length",
+    "context_token_budget", "history_trim_chunk", "max_user_message_tokens", "max_active_chats", "chat_idle_ttl",
+    "retrieval_top_k", "retrieval_context_tokens",
+    "summary_keep_turns", "summary_max_tokens", "usage_flush_interval", "chat_daily_token_budget",
+    "token_budget_max_tokens", "persistence_batch_size", "shutdown_timeout", "trace_buffer_size",
+    "profile_duration", "profile_interval", "log_max_file_size",
+    "log_backup_count", "log_queue_size"
+)
+
+# Допустимые значения строковых настроек
+CHOICES = {
+    "bot_mode": ("polling", "webhook"),
+    "persistence_backend": ("none", "sqlite"),
+    "log_format": ("text", "json"),
+    "log_level": ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"),
+}
+
+TRUE_VALUES = ("1", "true", "yes", "on")
+FALSE_VALUES = ("0", "false", "no", "off")
+
+
+def matches_type(value, expected):
+    """Подходит ли значение под тип поля (bool не считается числом)"""
+    if expected is float:
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    if expected is int:
+        return isinstance(value, int) and not isinstance(value, bool)
+    return isinstance(value, expected)
+
+
+def validate_settings(settings):
+    """Проверить значения настроек; вернуть список ошибок"""
+    errors = []
+    for name in SETTINGS_FIELDS:
+        expected = Settings.__dataclass_fields__[name].type
+        value = getattr(settings, name)
+        if not matches_type(value, expected):
+            errors.append(f"{name}: ожидается {expected.__name__}, получено {value!r}")
+    if errors:
+        return errors
+
+    for name in POSITIVE_FIELDS:
+        if getattr(settings, name) <= 0:
+            errors.append(f"{name} должно быть больше 0")
+    for name, allowed in CHOICES.items():
+        if getattr(settings, name) not in allowed:
+            errors.append(f"{name} должно быть одним из {allowed}")
+    if not 0.0 <= settings.temperature <= 2.0:
+        errors.append("temperature должна быть от 0 до 2")
+    if not 0.0 < settings.rate_limit_backoff <= 1.0:
+        errors.append("rate_limit_backoff должно быть в (0, 1]")
+    if not 0.0 <= settings.retrieval_min_score <= settings.retrieval_answer_score <= 1.0:
+        errors.append("нужно 0 <= retrieval_min_score <= retrieval_answer_score <= 1")
+    if settings.message_debounce_window < 0:
+        errors.append("message_debounce_window не может быть отрицательным")
+    if not 0.0 < settings.token_budget_downshift <= 1.0:
+        errors.append("token_budget_downshift должно быть в (0, 1]")
+    if not 0.0 <= settings.trace_sample_rate <= 1.0:
+        errors.append("trace_sample_rate должно быть от 0 до 1")
+    if settings.trace_slow_threshold < 0:
+        errors.append("trace_slow_threshold не может быть отрицательным")
+    if any(not 0.0 <= rate <= 1.0 for rate in settings.log_sample_rates.values()):
+        errors.append("log_sample_rates: доли должны быть от 0 до 1")
+    return errors
+
+
+def parse_env_value(name, raw, expected):
+    """Преобразовать строку из окружения к типу настройки"""
+    if expected is bool:
+        if raw.strip().lower() in TRUE_VALUES:
+            return True
+        if raw.strip().lower() in FALSE_VALUES:
+            return False
+        raise ValueError(f"{name}: ожидается true/false, получено {raw!r}")
+    if expected is tuple:
+        return tuple(item.strip() for item in raw.split(",") if item.strip())
+    if expected is Mapping:
+        value = json.loads(raw)
+        if not isinstance(value, dict):
+            raise ValueError(f"{name}: ожидается JSON объект")
+        return value
+    try:
+        return expected(raw)
+    except ValueError:
+        raise ValueError(f"{name}: ожидается {expected.__name__}, получено {raw!r}") from None
+
+
+def load_settings(environ=None):
+    """Собрать настройки из констант модуля и переменных окружения"""
+    environ = os.environ if environ is None else environ
+    values = {}
+    for name in SETTINGS_FIELDS:
+        expected = Settings.__dataclass_fields__[name].type
+        constant = name.upper()
+        value = globals()[constant]
+        if constant in environ:
+            value = parse_env_value(constant, environ[constant], expected)
+        # Изменяемые контейнеры замораживаем, int в float-полях приводим
+        if expected is tuple:
+            value = tuple(value)
+        elif expected is Mapping:
+            value = MappingProxyType(dict(value))
+        elif expected is float and isinstance(value, int) and not isinstance(value, bool):
+            value = float(value)
+        values[name] = value
+    return Settings(**values)
+
+
+# Значения, прочитанные из .env последним вызовом load_env_file
+_env_file_values = {}
+
+
+def load_env_file(path=None):
+    """Прочитать .env в os.environ (при запуске и при перезагрузке)
+
+    Как у load_dotenv(), окружение процесса важнее .env: значение из .env
+    ставится, если переменной нет в окружении или она сама пришла из .env
+    (равна прошлому прочитанному значению). Поэтому правки .env применяются
+    при перезагрузке, а заданное в окружении процесса ими не перекрывается.
+    """
+    values = {name: value for name, value in dotenv_values(path).items() if value is not None}
+    for name, value in values.items():
+        current = os.environ.get(name)
+        if current is None or current == _env_file_values.get(name, value):
+            os.environ[name] = value
+    _env_file_values.clear()
+    _env_file_values.update(values)
+
+
+# Текущие настройки: собираются при первом обращении, при перезагрузке заменяются целиком
+_settings = None
+
+# Кто подстраивается под новые настройки: callback(settings)
+_reload_listeners = []
 
 
 def get_public_config():
-    """Получить публичные настройки приложения"""
-    return {
-        "model_name": MODEL_NAME,
-        "temperature": TEMPERATURE,
-        "max_tokens": MAX_TOKENS,
-        "max_history_length": MAX_HISTORY_LENGTH,
-        "system_prompt_file": SYSTEM_PROMPT_FILE,
-        # Настройки логирования
-        "log_to_file": LOG_TO_FILE,
-        "log_to_console": LOG_TO_CONSOLE,
-        "log_file_path": LOG_FILE_PATH,
-        "log_level": LOG_LEVEL,
-        "log_max_file_size": LOG_MAX_FILE_SIZE,
-        "log_backup_count": LOG_BACKUP_COUNT
-    }
\ No newline at end of file
+    """Получить публичные настройки приложения (один и тот же объект до перезагрузки)"""
+    settings = _settings
+    if settings is None:
+        settings = reload_config()[0]
+    return settings
+
+
+def reload_config(environ=None):
+    """Перечитать настройки; вернуть (новые настройки, имена изменившихся полей)
+
+    Если значения неверные, поднимается ValueError и действуют прежние настройки.
+    """
+    global _settings
+    settings = load_settings(environ)
+    previous, _settings = _settings, settings
+    changed = [name for name in SETTINGS_FIELDS if previous is None or previous[name] != settings[name]]
+    if previous is not None:
+        for listener in _reload_listeners:
+            listener(settings)
+    return settings, changed
+
+
+def add_reload_listener(callback):
+    """Вызывать callback(settings) после каждой перезагрузки настроек"""
+    _reload_listeners.append(callback)
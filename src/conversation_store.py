@@ -0,0 +1,359 @@
+"""
+Хранилище истории диалогов в памяти
+
+Каждый чат - кольцевой буфер фиксированной емкости из компактных реплик.
+Число чатов ограничено политикой LRU + TTL: давно неактивные чаты вытесняются.
+Старые реплики чата можно заменить кратким содержанием (см. src/summarizer.py).
+После перезапуска чаты лениво подгружаются из снимка (см. src/snapshot.py).
+"""
+
+import asyncio
+import sys
+import time
+from collections import OrderedDict, deque
+from itertools import islice
+from src.tokens import count_message_tokens
+
+
+class Turn:
+    """Одна реплика диалога (компактная запись вместо dict)
+
+    Количество токенов считается один раз при создании и хранится в записи.
+    """
+
+    __slots__ = ("role", "content", "tokens")
+
+    def __init__(self, role, content):
+        self.role = role
+        self.content = content
+        self.tokens = count_message_tokens(content)
+
+    def as_message(self):
+        """Сообщение в формате OpenAI API"""
+        return {"role": self.role, "content": self.content}
+
+
+class ChatHistory:
+    """История одного чата: кольцевой буфер реплик, краткое содержание более
+    ранних реплик, общая сумма токенов и время обращения
+
+    dropped - сколько реплик ушло из начала буфера (вытеснение, сжатие):
+    сквозной номер первой реплики, от которого считается обрезка пачками.
+    """
+
+    __slots__ = ("turns", "summary", "tokens", "last_access", "dropped")
+
+    def __init__(self, max_messages, now):
+        self.turns = deque(maxlen=max_messages)
+        self.summary = None
+        self.tokens = 0
+        self.last_access = now
+        self.dropped = 0
+
+    def add(self, turn):
+        """Добавить реплику, поддерживая сумму токенов; вернуть вытесненную"""
+        evicted = self.turns[0] if len(self.turns) == self.turns.maxlen else None
+        if evicted is not None:
+            self.tokens -= evicted.tokens
+            self.dropped += 1
+        self.turns.append(turn)
+        self.tokens += turn.tokens
+        return evicted
+
+
+class ConversationStore:
+    """Ограниченное по памяти хранилище историй диалогов
+
+    append - O(1): старая реплика вытесняется из кольцевого буфера без копирования.
+    Чаты хранятся в порядке последнего обращения, поэтому вытеснение по LRU
+    и по TTL снимает записи с начала и стоит O(1) на вытесненный чат.
+    Поддерживает dict-подобный доступ: chat_id in store, store[chat_id], del store[chat_id].
+
+    Если подключен backend (см. src/persistence.py), изменения уходят в него
+    в фоне, а при промахе история чата подгружается с диска. Если подключен
+    снимок прошлого запуска, при промахе чат сначала ищется в нем.
+    """
+
+    def __init__(self, max_messages, max_chats, idle_ttl, backend=None, snapshot=None):
+        self.max_messages = max_messages
+        self.max_chats = max_chats
+        self.idle_ttl = idle_ttl
+        self.backend = backend
+        self.snapshot = snapshot
+        self._chats = OrderedDict()
+        self._bytes = 0
+        self.evicted = 0
+
+    def _chat_bytes(self, chat_id, chat):
+        """Оценка памяти под чат без учета реплик"""
+        summary = self._turn_bytes(chat.summary) if chat.summary is not None else 0
+        return sys.getsizeof(chat_id) + sys.getsizeof(chat) + sys.getsizeof(chat.turns) + summary
+
+    def _turn_bytes(self, turn):
+        """Оценка памяти под реплику (строки ролей - общие литералы и не учитываются)"""
+        return sys.getsizeof(turn) + sys.getsizeof(turn.content)
+
+    def _touch(self, chat_id, now):
+        """Получить или создать чат и отметить обращение"""
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = ChatHistory(self.max_messages, now)
+            self._chats[chat_id] = chat
+            self._bytes += self._chat_bytes(chat_id, chat)
+            self._evict(now)
+        else:
+            chat.last_access = now
+            self._chats.move_to_end(chat_id)
+        return chat
+
+    def _evict(self, now):
+        """Вытеснить чаты сверх лимита и простаивающие дольше idle_ttl"""
+        while self._chats:
+            chat_id, oldest = next(iter(self._chats.items()))
+            if len(self._chats) <= self.max_chats and now - oldest.last_access < self.idle_ttl:
+                break
+            self._remove(chat_id)
+            self.evicted += 1
+
+    def _remove(self, chat_id):
+        """Удалить чат и вычесть его из учета памяти"""
+        chat = self._chats.pop(chat_id)
+        self._bytes -= self._chat_bytes(chat_id, chat)
+        for turn in chat.turns:
+            self._bytes -= self._turn_bytes(turn)
+
+    def _has_cold_storage(self):
+        return self.backend is not None or self.snapshot is not None
+
+    def _load_snapshot(self, chat_id):
+        """Перенести чат из снимка в горячий слой; True если он там был"""
+        if self.snapshot is None:
+            return False
+        state = self.snapshot.pop(chat_id)
+        if state is None:
+            return False
+        self.import_chat(chat_id, state)
+        return True
+
+    def _install(self, chat_id, rows):
+        """Положить прочитанные из backend реплики в горячий слой"""
+        chat = self._touch(chat_id, time.monotonic())
+        for role, content in rows:
+            turn = Turn(role, content)
+            chat.add(turn)
+            self._bytes += self._turn_bytes(turn)
+        return chat
+
+    def _load(self, chat_id):
+        """Подгрузить историю чата из снимка или backend в горячий слой (синхронно)"""
+        if self._load_snapshot(chat_id):
+            return self._chats[chat_id]
+        if self.backend is None:
+            return None
+        rows = self.backend.load(chat_id, self.max_messages)
+        return self._install(chat_id, rows) if rows else None
+
+    async def load_chat(self, chat_id):
+        """Подгрузить чат из холодного слоя, не блокируя event loop
+
+        Чтение backend идет в отдельном потоке. Обработчики вызывают это перед
+        работой с историей, и get_messages/append/delete находят чат в памяти;
+        синхронная подгрузка в них остается для вызовов вне event loop.
+        """
+        if chat_id in self._chats or not self._has_cold_storage():
+            return
+        if self._load_snapshot(chat_id) or self.backend is None:
+            return
+        rows = await asyncio.to_thread(self.backend.load, chat_id, self.max_messages)
+        # Пока шло чтение, в чат могли уже что-то записать - не затираем
+        if rows and chat_id not in self._chats:
+            self._install(chat_id, rows)
+
+    def append(self, chat_id, role, content):
+        """Добавить реплику в историю чата"""
+        if chat_id not in self._chats and self._has_cold_storage():
+            self._load(chat_id)
+        chat = self._touch(chat_id, time.monotonic())
+        turn = Turn(role, content)
+
+        # Буфер полон - самая старая реплика вытесняется
+        evicted = chat.add(turn)
+        if evicted is not None:
+            self._bytes -= self._turn_bytes(evicted)
+        self._bytes += self._turn_bytes(turn)
+
+        if self.backend is not None:
+            self.backend.enqueue_append(chat_id, role, content)
+
+    def get_messages(self, chat_id, token_budget=None, trim_chunk=1):
+        """История чата в формате OpenAI API (пустой список если чата нет)
+
+        С token_budget отбрасываются самые старые реплики, пока история
+        не уложится в бюджет; считается по сохраненным в записях токенам.
+        С trim_chunk > 1 начало истории сдвигается пачками: первая реплика -
+        кратная trim_chunk по сквозному номеру, поэтому несколько ходов подряд
+        история начинается с одной и той же реплики (кеш промпта провайдера).
+        """
+        chat = self._chats.get(chat_id)
+        if chat is None and self._has_cold_storage():
+            chat = self._load(chat_id)
+        if chat is None:
+            return []
+        chat.last_access = time.monotonic()
+        self._chats.move_to_end(chat_id)
+
+        skip = 0
+        if token_budget is not None:
+            total = chat.tokens
+            for turn in chat.turns:
+                if total <= token_budget:
+                    break
+                total -= turn.tokens
+                skip += 1
+            if trim_chunk > 1 and chat.dropped + skip > 0:
+                start = -(-(chat.dropped + skip) // trim_chunk) * trim_chunk
+                # Последнюю реплику не отбрасываем ради выравнивания
+                skip = min(start - chat.dropped, max(len(chat.turns) - 1, skip))
+        messages = [turn.as_message() for turn in islice(chat.turns, skip, None)]
+        if chat.summary is not None:
+            messages.insert(0, chat.summary.as_message())
+        return messages
+
+    def get_tokens(self, chat_id):
+        """Сумма токенов истории чата в памяти (0 если чата нет)"""
+        chat = self._chats.get(chat_id)
+        return chat.tokens if chat is not None else 0
+
+    def get_compaction_input(self, chat_id, keep_turns):
+        """Что сжимать: (текущее краткое содержание, реплики старше keep_turns последних)"""
+        chat = self._chats.get(chat_id)
+        if chat is None or len(chat.turns) <= keep_turns:
+            return None, []
+        summary = chat.summary.content if chat.summary is not None else None
+        return summary, list(islice(chat.turns, 0, len(chat.turns) - keep_turns))
+
+    def compact(self, chat_id, summary, turns, prefix=""):
+        """Заменить сжатые реплики кратким содержанием; вернуть число удаленных реплик
+
+        Реплики сравниваются по объекту: пока шло сжатие, часть из них могла
+        быть вытеснена, удаляются только оставшиеся.
+        """
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            return 0
+
+        covered = {id(turn) for turn in turns}
+        removed = 0
+        while chat.turns and id(chat.turns[0]) in covered:
+            turn = chat.turns.popleft()
+            chat.tokens -= turn.tokens
+            self._bytes -= self._turn_bytes(turn)
+            removed += 1
+        chat.dropped += removed
+        # Ни одной сжатой реплики не осталось (например, после /clear) - содержание неактуально
+        if removed == 0:
+            return 0
+
+        if chat.summary is not None:
+            chat.tokens -= chat.summary.tokens
+            self._bytes -= self._turn_bytes(chat.summary)
+        chat.summary = Turn("system", prefix + summary)
+        chat.tokens += chat.summary.tokens
+        self._bytes += self._turn_bytes(chat.summary)
+        return removed
+
+    def chat_ids(self):
+        """Идентификаторы чатов в памяти"""
+        return list(self._chats)
+
+    def export_chat(self, chat_id):
+        """Состояние чата для передачи другому процессу или в снимок (None если чата нет)
+
+        idle - сколько секунд к чату не обращались.
+        """
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            return None
+        return {
+            "summary": chat.summary.content if chat.summary is not None else None,
+            "turns": [(turn.role, turn.content) for turn in chat.turns],
+            "idle": time.monotonic() - chat.last_access
+        }
+
+    def import_chat(self, chat_id, state, persist=False):
+        """Принять чат от другого процесса
+
+        persist=False - backend общий, запись уже сделал прежний владелец;
+        persist=True - у процесса свой backend, чат переписывается в него.
+        """
+        if chat_id in self._chats:
+            self._remove(chat_id)
+        chat = self._touch(chat_id, time.monotonic())
+        if persist and self.backend is not None:
+            self.backend.enqueue_delete(chat_id)
+        for role, content in state["turns"]:
+            turn = Turn(role, content)
+            chat.add(turn)
+            self._bytes += self._turn_bytes(turn)
+            if persist and self.backend is not None:
+                self.backend.enqueue_append(chat_id, role, content)
+        if state["summary"] is not None:
+            chat.summary = Turn("system", state["summary"])
+            chat.tokens += chat.summary.tokens
+            self._bytes += self._turn_bytes(chat.summary)
+
+    def forget(self, chat_id):
+        """Убрать чат только из памяти (например, после передачи другому процессу)"""
+        if chat_id in self._chats:
+            self._remove(chat_id)
+
+    def delete(self, chat_id):
+        """Удалить историю чата; True если она была в памяти или в снимке
+
+        Backend здесь не читается: чтобы учесть историю только на диске,
+        сначала подгрузите чат через load_chat.
+        """
+        existed = chat_id in self._chats
+        if existed:
+            self._remove(chat_id)
+        if self.snapshot is not None:
+            existed = self.snapshot.discard(chat_id) or existed
+
+        if self.backend is not None:
+            self.backend.enqueue_delete(chat_id)
+        return existed
+
+    def evict_idle(self):
+        """Принудительно вытеснить простаивающие чаты; вернуть их количество"""
+        before = self.evicted
+        self._evict(time.monotonic())
+        return self.evicted - before
+
+    def size_bytes(self):
+        """Оценка занимаемой памяти в байтах"""
+        return self._bytes + sys.getsizeof(self._chats)
+
+    def clear(self):
+        """Удалить все истории"""
+        self._chats.clear()
+        self._bytes = 0
+
+    def __contains__(self, chat_id):
+        return chat_id in self._chats
+
+    def __len__(self):
+        return len(self._chats)
+
+    def __getitem__(self, chat_id):
+        if chat_id not in self._chats:
+            raise KeyError(chat_id)
+        return self.get_messages(chat_id)
+
+    def __setitem__(self, chat_id, messages):
+        self.delete(chat_id)
+        for message in messages:
+            self.append(chat_id, message["role"], message["content"])
+
+    def __delitem__(self, chat_id):
+        if not self.delete(chat_id):
+            raise KeyError(chat_id)
@@ -4,37 +4,282 @@
 Функции для обработки команд и сообщений согласно vision.md
 """
 
+import asyncio
+import time
 from aiogram.types import Message
-from aiogram.filters import Command
-from src.llm_client import send_to_llm, build_prompt
-from src.config import get_public_config
-from src.logging_config import log_command
+from aiogram.filters import Command, CommandObject
+from aiogram.exceptions import TelegramRetryAfter, TelegramBadRequest
+from src.llm_client import (
+    send_to_llm, stream_llm, build_prompt, truncate_user_message, get_history_token_budget
+)
+from src.config import get_public_config, reload_config, add_reload_listener, load_env_file
+from src.conversation_store import ConversationStore
+from src.scheduler import RequestScheduler, SchedulerOverloaded
+from src.send_queue import SendScheduler, PRIORITY_COMMAND, PRIORITY_ANSWER, GROUP_CHAT_TYPES
+from src.summarizer import schedule_summary
+from src.retrieval import find_direct_answer
+from src.tracing import span, record_span, trace_middleware, start_profiling, stop_profiling
+from src.logging_config import (
+    log_command, log_llm_response, log_queue_wait, log_queue_overload, log_config_reload,
+    log_config_error, log_message_merge, get_logger
+)
+from src.metrics import (
+    MESSAGES_TOTAL, LLM_FIRST_TOKEN_SECONDS, QUEUE_WAIT_SECONDS, register_callback
+)
+
+
+def create_conversation_store():
+    """Создать хранилище истории диалогов по настройкам из config.py"""
+    config = get_public_config()
+    return ConversationStore(
+        max_messages=config["max_history_length"],
+        max_chats=config["max_active_chats"],
+        idle_ttl=config["chat_idle_ttl"]
+    )
+
+
+def create_request_scheduler():
+    """Создать планировщик сообщений по настройкам из config.py"""
+    config = get_public_config()
+    return RequestScheduler(
+        max_concurrency=config["llm_max_concurrency"],
+        max_queue=config["scheduler_queue_size"],
+        max_chat_queue=config["scheduler_chat_queue_size"]
+    )
+
+
+def create_send_scheduler():
+    """Создать очередь исходящих сообщений по настройкам из config.py"""
+    config = get_public_config()
+    return SendScheduler(
+        global_rps=config["telegram_global_rps"],
+        chat_rps=config["telegram_chat_rps"],
+        group_per_minute=config["telegram_group_per_minute"],
+        chat_burst=config["telegram_chat_burst"],
+        max_attempts=config["telegram_send_attempts"]
+    )
+
 
 # Глобальное хранилище истории диалогов в памяти
-chat_conversations = {}
+chat_conversations = create_conversation_store()
+
+# Очередь сообщений по чатам с общим лимитом вызовов LLM
+request_scheduler = create_request_scheduler()
+
+# Очередь исходящих сообщений с учетом лимитов Telegram
+send_scheduler = create_send_scheduler()
+
+
+class PendingTurn:
+    """Сообщения чата, которые уйдут в LLM одной репликой"""
+
+    __slots__ = ("parts",)
+
+    def __init__(self, text):
+        self.parts = [text]
+
+
+# Открытые для дополнения реплики: chat_id -> PendingTurn.
+# Реплика открыта, пока она ждет в очереди чата (например, пока генерируется
+# ответ на прошлое сообщение) и пока идет окно MESSAGE_DEBOUNCE_WINDOW
+_pending_turns = {}
+
+# Счетчики объединения: turns - реплики, ушедшие в LLM, merged - присоединенные сообщения
+_merge_stats = {"turns": 0, "merged": 0}
+
+
+def close_pending_turn(chat_id, pending):
+    """Закрыть реплику для новых сообщений; вернуть ее текст"""
+    if _pending_turns.get(chat_id) is pending:
+        del _pending_turns[chat_id]
+    return "\n".join(pending.parts)
+
+
+def get_merge_stats():
+    """Счетчики объединения сообщений и число открытых реплик"""
+    return dict(_merge_stats, pending=len(_pending_turns))
+
+
+def apply_settings(config):
+    """Новые лимиты после перезагрузки настроек
+
+    Длина истории (MAX_HISTORY_LENGTH) меняется только перезапуском:
+    буферы уже созданных чатов имеют фиксированную емкость.
+    """
+    request_scheduler.resize(
+        config["llm_max_concurrency"], config["scheduler_queue_size"], config["scheduler_chat_queue_size"]
+    )
+    send_scheduler.resize(
+        config["telegram_global_rps"], config["telegram_chat_rps"], config["telegram_group_per_minute"],
+        config["telegram_chat_burst"], config["telegram_send_attempts"]
+    )
+    chat_conversations.max_chats = config["max_active_chats"]
+    chat_conversations.idle_ttl = config["chat_idle_ttl"]
+    get_logger().setLevel(config["log_level"])
+
+
+def reload_settings():
+    """Перечитать .env и настройки без перезапуска (SIGHUP); вернуть изменившиеся поля
+
+    Как и при запуске, окружение процесса важнее .env (см. load_env_file).
+    При неверных значениях действуют прежние настройки.
+    """
+    load_env_file()
+    try:
+        _, changed = reload_config()
+    except ValueError as e:
+        log_config_error(str(e))
+        return None
+    log_config_reload(changed)
+    return changed
+
+
+add_reload_listener(apply_settings)
+
+# Текущая загрузка читается при запросе /metrics
+register_callback("scheduler_in_flight", "Сообщения в обработке (заняты места вызовов LLM)",
+                  lambda: request_scheduler.active)
+register_callback("scheduler_queued", "Сообщения в очереди", lambda: request_scheduler.waiting)
+register_callback("scheduler_rejected_total", "Сообщения, отклоненные из-за переполненной очереди",
+                  lambda: request_scheduler.stats["rejected"], "counter")
+register_callback("telegram_send_retry_after_total", "Ответы Telegram с flood control при отправке",
+                  lambda: send_scheduler.stats["retry_after"], "counter")
+register_callback("telegram_send_failed_total", "Сообщения, которые не удалось отправить",
+                  lambda: send_scheduler.stats["failed"], "counter")
+register_callback("messages_merged_total", "Сообщения, присоединенные к предыдущему (без отдельного вызова LLM)",
+                  lambda: _merge_stats["merged"], "counter")
+register_callback("conversation_store_chats", "Чаты с историей в памяти", lambda: len(chat_conversations))
+register_callback("conversation_store_bytes", "Оценка памяти под историю", lambda: chat_conversations.size_bytes())
+
+# Лимит длины одного сообщения Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Текст сообщения, которое показываем до первых токенов ответа
+STREAM_PLACEHOLDER = "✍️ Печатаю ответ..."
+
+# Ответ при переполненной очереди сообщений
+OVERLOAD_TEXT = "Сейчас очень много запросов. Пожалуйста, повторите сообщение через минуту."
+
+# Ответ на случай, если LLM вернула пустой текст
+EMPTY_RESPONSE_TEXT = "Не удалось получить ответ. Попробуйте переформулировать вопрос."
 
 
 def save_to_history(chat_id, user_message, bot_response):
-    """Сохранить сообщение в историю диалога"""
-    if chat_id not in chat_conversations:
-        chat_conversations[chat_id] = []
-    
-    # Добавляем сообщения пользователя и бота
-    chat_conversations[chat_id].extend([
-        {"role": "user", "content": user_message},
-        {"role": "assistant", "content": bot_response}
-    ])
+    """Сохранить сообщение в историю диалога (лимит соблюдает кольцевой буфер)
+
+    Если включено сжатие и история выросла, старые реплики пересказываются в фоне.
+    """
+    with span("save_history"):
+        chat_conversations.append(chat_id, "user", user_message)
+        chat_conversations.append(chat_id, "assistant", bot_response)
+        schedule_summary(chat_conversations, chat_id)
+
+
+def get_conversation_history(chat_id, token_budget=None):
+    """Получить историю диалога для чата (с token_budget - только свежая часть,
+    старые реплики отбрасываются пачками по HISTORY_TRIM_CHUNK)"""
+    return chat_conversations.get_messages(chat_id, token_budget, get_public_config()["history_trim_chunk"])
+
+
+async def reply(message: Message, text, priority=PRIORITY_ANSWER):
+    """Ответить в чат сообщения через очередь исходящих; вернуть отправленное сообщение"""
+    with span("telegram_send", priority=priority):
+        return await send_scheduler.send(
+            str(message.chat.id), lambda: message.answer(text), priority,
+            is_group=message.chat.type in GROUP_CHAT_TYPES
+        )
+
+
+def find_split_point(text, limit=TELEGRAM_MESSAGE_LIMIT):
+    """Найти место разрыва длинного текста: по абзацу или пробелу, не дальше лимита"""
+    if len(text) <= limit:
+        return len(text)
     
-    # Обрезаем историю до лимита
-    config = get_public_config()
-    max_history = config["max_history_length"]
-    if len(chat_conversations[chat_id]) > max_history:
-        chat_conversations[chat_id] = chat_conversations[chat_id][-max_history:]
+    for separator in ("\n", " "):
+        position = text.rfind(separator, limit // 2, limit)
+        if position > 0:
+            return position + 1
+    return limit
+
+
+async def edit_stream_message(sent_message, text):
+    """Отредактировать сообщение; вернуть паузу flood control (0 - правка прошла)"""
+    try:
+        with span("telegram_edit"):
+            await sent_message.edit_text(text)
+        return 0
+    except TelegramRetryAfter as e:
+        return e.retry_after
+    except TelegramBadRequest:
+        # Например "message is not modified" - следующая правка все исправит
+        return 0
+
 
+async def finish_stream_message(sent_message, text, attempts=3):
+    """Финальная правка сообщения: при flood control ждем и повторяем"""
+    for _ in range(attempts):
+        retry_after = await edit_stream_message(sent_message, text)
+        if not retry_after:
+            return
+        await asyncio.sleep(retry_after)
 
-def get_conversation_history(chat_id):
-    """Получить историю диалога для чата"""
-    return chat_conversations.get(chat_id, [])
+
+async def send_streaming_response(message: Message, deltas):
+    """Показать ответ LLM по мере генерации, редактируя сообщение-плейсхолдер
+    
+    Правки идут не чаще заданного интервала (реже в группах), после
+    flood control интервал увеличивается. Текст длиннее 4096 символов
+    продолжается в новом сообщении. Возвращает полный текст ответа.
+    """
+    config = get_public_config()
+    chat_id = str(message.chat.id)
+    is_private = message.chat.type == "private"
+    interval = config["stream_edit_interval"] if is_private else config["stream_group_edit_interval"]
+    start_time = time.time()
+    first_token_time = None
+    
+    current = await reply(message, STREAM_PLACEHOLDER)
+    full_text = ""
+    offset = 0          # Начало текста текущего сообщения в полном ответе
+    shown = ""          # Что сейчас отображается в текущем сообщении
+    next_edit_at = 0.0
+    
+    async for delta in deltas:
+        full_text += delta
+        
+        # Текст не помещается в сообщение - закрываем его и продолжаем в новом
+        while len(full_text) - offset > TELEGRAM_MESSAGE_LIMIT:
+            split = offset + find_split_point(full_text[offset:])
+            await finish_stream_message(current, full_text[offset:split])
+            offset = split
+            shown = full_text[offset:offset + TELEGRAM_MESSAGE_LIMIT]
+            current = await reply(message, shown)
+        
+        text = full_text[offset:]
+        if time.monotonic() < next_edit_at or not text.strip() or text == shown:
+            continue
+        
+        retry_after = await edit_stream_message(current, text)
+        if retry_after:
+            interval = min(interval * 2, config["stream_max_edit_interval"])
+        else:
+            shown = text
+            if first_token_time is None:
+                first_token_time = time.time() - start_time
+        next_edit_at = time.monotonic() + max(interval, retry_after)
+    
+    # Генерация закончилась: финальная правка не держит место вызова LLM
+    request_scheduler.release_place(chat_id)
+    if not full_text.strip():
+        full_text = EMPTY_RESPONSE_TEXT
+    if full_text[offset:] != shown:
+        await finish_stream_message(current, full_text[offset:])
+    
+    response_time = time.time() - start_time
+    log_llm_response(chat_id, response_time, len(full_text), first_token_time)
+    if first_token_time is not None:
+        LLM_FIRST_TOKEN_SECONDS.observe(first_token_time)
+    return full_text
 
 
 async def handle_start(message: Message):
@@ -57,7 +302,7 @@ async def handle_start(message: Message):
 
 📋 Команды: /help - справка, /clear - очистить историю, /stop - завершить"""
     
-    await message.answer(welcome)
+    await reply(message, welcome, PRIORITY_COMMAND)
 
 
 async def handle_help(message: Message):
@@ -83,7 +328,7 @@ async def handle_help(message: Message):
 • "Какие задачи можно автоматизировать с помощью ИИ?"
 • "Обучаете ли вы команды работе с ИИ?"
 """
-    await message.answer(help_text)
+    await reply(message, help_text, PRIORITY_COMMAND)
 
 
 async def handle_clear(message: Message):
@@ -94,11 +339,12 @@ async def handle_clear(message: Message):
     # Логируем команду
     log_command(chat_id, "/clear", username)
     
-    if chat_id in chat_conversations:
-        del chat_conversations[chat_id]
-        await message.answer("✅ История диалога очищена! Можете начать новый разговор.")
+    # История только на диске тоже считается: подгружаем ее, не блокируя event loop
+    await chat_conversations.load_chat(chat_id)
+    if chat_conversations.delete(chat_id):
+        await reply(message, "✅ История диалога очищена! Можете начать новый разговор.", PRIORITY_COMMAND)
     else:
-        await message.answer("✅ История диалога уже пуста.")
+        await reply(message, "✅ История диалога уже пуста.", PRIORITY_COMMAND)
 
 
 async def handle_stop(message: Message):
@@ -110,8 +356,7 @@ async def handle_stop(message: Message):
     log_command(chat_id, "/stop", username)
     
     # Очищаем историю при завершении
-    if chat_id in chat_conversations:
-        del chat_conversations[chat_id]
+    chat_conversations.delete(chat_id)
     
     goodbye = """👋 Спасибо за обращение!
 
@@ -119,7 +364,7 @@ async def handle_stop(message: Message):
 
 До свидания! 🤖"""
     
-    await message.answer(goodbye)
+    await reply(message, goodbye, PRIORITY_COMMAND)
 
 
 async def handle_message(message: Message):
@@ -129,27 +374,147 @@ async def handle_message(message: Message):
     
     # Проверяем что это текстовое сообщение
     if not user_text:
-        await message.answer("Пожалуйста, отправьте текстовое сообщение.")
+        await reply(message, "Пожалуйста, отправьте текстовое сообщение.", PRIORITY_COMMAND)
         return
     
+    MESSAGES_TOTAL.inc()
+    
+    # Мысль, набранная несколькими сообщениями подряд, уходит в LLM одной
+    # репликой: сообщение присоединяется к реплике чата, которая еще ждет
+    # своей очереди (пока бот отвечает на прошлое сообщение). Одиночное
+    # сообщение получает очередь сразу и никого не ждет
+    pending = _pending_turns.get(chat_id)
+    if pending is not None:
+        pending.parts.append(user_text)
+        _merge_stats["merged"] += 1
+        return
+    pending = _pending_turns[chat_id] = PendingTurn(user_text)
+    debounce_window = get_public_config()["message_debounce_window"]
+    
     # Отправляем сообщение в LLM с учетом истории
     try:
-        # Получаем историю диалога для контекста
-        history = get_conversation_history(chat_id)
-        
-        # Отправляем в LLM с историей
-        response = await send_to_llm(user_text, chat_id, history)
-        
-        # Сохраняем в историю
-        save_to_history(chat_id, user_text, response)
-        
-        await message.answer(response)
+        # Сообщения чата обрабатываются по очереди: историю читает и дополняет
+        # только одно сообщение за раз. Окно ожидания продолжения идет уже
+        # в очереди, чтобы при остановке бот дождался и эту реплику
+        async with request_scheduler.slot(chat_id, debounce_window) as wait_time:
+            log_queue_wait(chat_id, wait_time, request_scheduler.waiting)
+            QUEUE_WAIT_SECONDS.observe(wait_time)
+            record_span("queue_wait", wait_time)
+            
+            user_text = close_pending_turn(chat_id, pending)
+            _merge_stats["turns"] += 1
+            if len(pending.parts) > 1:
+                log_message_merge(chat_id, len(pending.parts))
+            
+            # Слишком длинное сообщение обрезаем, чтобы оно не вытеснило весь контекст
+            user_text = truncate_user_message(user_text)
+            
+            # Получаем историю диалога, укладывающуюся в бюджет токенов
+            with span("history"):
+                await chat_conversations.load_chat(chat_id)
+                history = get_conversation_history(chat_id, get_history_token_budget(user_text))
+            
+            # Вопрос почти дословно есть в базе готовых ответов - отвечаем без LLM.
+            # Только в начале диалога: короткое уточнение посреди разговора
+            # (как и в кеше ответов) зависит от контекста
+            if not history:
+                with span("knowledge"):
+                    answer = find_direct_answer(user_text)
+                if answer is not None:
+                    request_scheduler.release_place(chat_id)
+                    save_to_history(chat_id, user_text, answer)
+                    await reply(message, answer)
+                    return
+            
+            # Потоковый режим: показываем ответ по мере генерации
+            if get_public_config()["stream_responses"]:
+                response = await send_streaming_response(message, stream_llm(user_text, chat_id, history))
+                save_to_history(chat_id, user_text, response)
+                return
+            
+            # Отправляем в LLM с историей
+            response = await send_to_llm(user_text, chat_id, history)
+            # Ответ готов: отправка в Telegram (с ожиданием темпа) не держит место вызова LLM
+            request_scheduler.release_place(chat_id)
+            
+            # Сохраняем в историю
+            save_to_history(chat_id, user_text, response)
+            
+            await reply(message, response)
+    
+    except SchedulerOverloaded:
+        log_queue_overload(chat_id, request_scheduler.waiting)
+        await reply(message, OVERLOAD_TEXT, PRIORITY_COMMAND)
         
     except Exception as e:
-        await message.answer("Извините, произошла ошибка при обработке вашего сообщения.")
+        await reply(message, "Извините, произошла ошибка при обработке вашего сообщения.")
+    
+    finally:
+        # Отклоненная или упавшая реплика не должна принимать новые сообщения
+        close_pending_turn(chat_id, pending)
+
+
+def is_admin_chat(message: Message):
+    """Фильтр служебных команд: только чаты из ADMIN_CHAT_IDS"""
+    return str(message.chat.id) in get_public_config()["admin_chat_ids"]
+
+
+async def handle_profile(message: Message, command: CommandObject):
+    """Обработка команды /profile: окно профилирования CPU и памяти
+
+    /profile [секунды] - начать (по умолчанию PROFILE_DURATION), /profile stop -
+    закончить досрочно. Когда окно закончится, бот пришлет пути файлов с результатами.
+    """
+    chat_id = str(message.chat.id)
+    username = message.from_user.username if message.from_user else None
+    log_command(chat_id, "/profile", username)
+    
+    args = (command.args or "").strip()
+    if args == "stop":
+        if await stop_profiling() is None:
+            await reply(message, "Профилирование не запущено.", PRIORITY_COMMAND)
+        return
+    
+    try:
+        duration = float(args) if args else None
+    except ValueError:
+        duration = 0
+    if duration is not None and duration <= 0:
+        await reply(message, "Использование: /profile [секунды] или /profile stop", PRIORITY_COMMAND)
+        return
+    
+    async def report(paths):
+        if paths:
+            text = "Профилирование закончено, результаты:\n" + "\n".join(paths)
+        else:
+            text = "Не удалось записать результаты профилирования, подробности в логе."
+        await reply(message, text, PRIORITY_COMMAND)
+    
+    window = start_profiling(duration, report)
+    if window is None:
+        await reply(message, "Профилирование уже идет. /profile stop - закончить раньше.", PRIORITY_COMMAND)
+    else:
+        await reply(message, f"Профилирование запущено на {window:.0f} сек. /profile stop - закончить раньше.",
+                    PRIORITY_COMMAND)
 
 
 # Устаревший обработчик для совместимости
 async def simple_handler(message: Message):
     """Простой обработчик - перенаправляет к handle_message"""
-    await handle_message(message)
\ No newline at end of file
+    await handle_message(message)
+
+
+def register_handlers(dp):
+    """Зарегистрировать обработчики команд и сообщений в диспетчере"""
+    # Каждое обновление - трасса с участками обработки (см. src/tracing.py)
+    dp.update.outer_middleware(trace_middleware)
+    
+    dp.message.register(handle_start, Command("start"))
+    dp.message.register(handle_help, Command("help"))
+    dp.message.register(handle_clear, Command("clear"))
+    dp.message.register(handle_stop, Command("stop"))
+    # Для остальных чатов /profile - обычное сообщение
+    dp.message.register(handle_profile, Command("profile"), is_admin_chat)
+    
+    # Обработчик обычных сообщений (должен быть последним)
+    dp.message.register(handle_message)
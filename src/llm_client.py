@@ -4,23 +4,108 @@
 Функции взаимодействия с LLM согласно vision.md
 """
 
+import hashlib
 import os
 import time
-from openai import OpenAI
+from functools import partial
+import httpx
+from openai import AsyncOpenAI
+from openai.types import CompletionUsage
 from src.config import get_public_config
-from src.logging_config import log_llm_request, log_llm_response, log_llm_error
+from src.tokens import count_message_tokens, truncate_to_tokens
+from src.response_cache import make_cache_key, get_cached_response, store_response, get_cache_stats
+from src.singleflight import make_request_key, coalesce, coalesce_stream, get_singleflight_stats
+from src.rate_limiter import (
+    RateLimitExceeded, acquire_chat, acquire_global, report_rate_limited, report_success,
+    get_rate_limiter_stats
+)
+from src.resilience import (
+    call_with_resilience, is_rate_limit_error, get_retry_after, get_resilience_stats
+)
+from src.retrieval import build_knowledge_message, is_knowledge_loaded
+from src.usage import record_usage, apply_chat_budget, BUDGET_OK
+from src.tracing import span, record_span
+from src.metrics import (
+    LLM_REQUESTS_TOTAL, LLM_ERRORS_TOTAL, LLM_TOKENS_TOTAL, LLM_RESPONSE_SECONDS, register_callback
+)
+from src.logging_config import (
+    log_llm_request, log_llm_response, log_llm_error, log_llm_warmup, log_llm_cache_hit
+)
 
+# Единый асинхронный клиент на процесс (создается в main.main при старте)
+_llm_client = None
+_http_client = None
 
-def get_llm_client():
-    """Создать клиент для OpenRouter"""
+# Кеш системного промпта; при перезагрузке заменяется целиком (атомарно)
+_prompt_cache = None
+
+
+def create_http_client(config):
+    """Создать HTTP-клиент с keep-alive пулом соединений"""
+    limits = httpx.Limits(
+        max_connections=config["llm_max_connections"],
+        max_keepalive_connections=config["llm_max_keepalive_connections"],
+        keepalive_expiry=config["llm_keepalive_expiry"]
+    )
+    timeout = httpx.Timeout(
+        connect=config["llm_connect_timeout"],
+        read=config["llm_read_timeout"],
+        write=config["llm_write_timeout"],
+        pool=config["llm_pool_timeout"]
+    )
+    return httpx.AsyncClient(limits=limits, timeout=timeout)
+
+
+def init_llm_client(base_url=None):
+    """Создать общий асинхронный клиент для OpenRouter"""
+    global _llm_client, _http_client
+    
     api_key = os.getenv("OPENROUTER_API_KEY")
     if not api_key:
         raise ValueError("OPENROUTER_API_KEY не найден в .env файле")
     
-    return OpenAI(
-        base_url="https://openrouter.ai/api/v1",
-        api_key=api_key
+    config = get_public_config()
+    _http_client = create_http_client(config)
+    _llm_client = AsyncOpenAI(
+        base_url=base_url or config["llm_base_url"],
+        api_key=api_key,
+        http_client=_http_client,
+        # Повторами управляет src.resilience
+        max_retries=0
     )
+    return _llm_client
+
+
+def get_llm_client():
+    """Получить общий клиент для OpenRouter (создается при первом обращении)"""
+    if _llm_client is None:
+        return init_llm_client()
+    return _llm_client
+
+
+async def warmup_llm_client():
+    """Прогреть пул: установить TCP/TLS соединение до начала работы бота"""
+    client = get_llm_client()
+    start_time = time.time()
+    
+    try:
+        # Любой ответ сервера означает, что соединение установлено и осталось в пуле
+        await _http_client.head(str(client.base_url))
+        log_llm_warmup(time.time() - start_time, success=True)
+        return True
+    except Exception as e:
+        log_llm_warmup(time.time() - start_time, success=False, error_message=str(e))
+        return False
+
+
+async def close_llm_client():
+    """Закрыть общий клиент и освободить соединения пула"""
+    global _llm_client, _http_client
+    
+    if _llm_client is not None:
+        await _llm_client.close()
+    _llm_client = None
+    _http_client = None
 
 
 def load_system_prompt():
@@ -33,65 +118,362 @@ def load_system_prompt():
         return "Вы - дружелюбный ИИ-ассистент. Отвечайте вежливо и профессионально на русском языке."
 
 
+def get_prompt_file_stat(path):
+    """Отпечаток файла промпта для проверки изменений: (mtime, размер)"""
+    try:
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
+
+
+def reload_system_prompt():
+    """Перечитать системный промпт и заменить кеш целиком"""
+    global _prompt_cache
+    
+    config = get_public_config()
+    file_stat = get_prompt_file_stat(config["system_prompt_file"])
+    text = load_system_prompt()
+    
+    _prompt_cache = {
+        "text": text,
+        "message": {"role": "system", "content": text},
+        "cached_message": with_cache_control({"role": "system", "content": text}),
+        "hash": hashlib.sha256(text.encode("utf-8")).hexdigest()[:16],
+        "tokens": count_message_tokens(text),
+        "path": config["system_prompt_file"],
+        "stat": file_stat,
+        "check_interval": config["prompt_check_interval"],
+        "checked_at": time.monotonic()
+    }
+    return _prompt_cache
+
+
+def get_system_prompt():
+    """Получить системный промпт из кеша
+    
+    Возвращает dict с текстом, готовым system-сообщением, числом токенов
+    и хешем содержимого (ключ кеша для других слоев). Файл проверяется не чаще check_interval
+    и перечитывается, только если изменились mtime или размер.
+    """
+    cache = _prompt_cache
+    if cache is None:
+        return reload_system_prompt()
+    
+    now = time.monotonic()
+    if now - cache["checked_at"] < cache["check_interval"]:
+        return cache
+    
+    if get_prompt_file_stat(cache["path"]) != cache["stat"]:
+        return reload_system_prompt()
+    
+    cache["checked_at"] = now
+    return cache
+
+
+def with_cache_control(message):
+    """Копия сообщения с меткой кеша промпта провайдера (content по частям)"""
+    return {
+        "role": message["role"],
+        "content": [{"type": "text", "text": message["content"], "cache_control": {"type": "ephemeral"}}]
+    }
+
+
+def uses_cache_control(config):
+    """Нужны ли модели явные метки кеша промпта"""
+    return config["prompt_cache_enabled"] and config["model_name"].startswith(tuple(config["prompt_cache_models"]))
+
+
+def get_cached_answer(chat_id, user_message, history):
+    """Найти готовый ответ в кеше; вернуть (ключ кеша, ответ или None)"""
+    cache_key = make_cache_key(get_system_prompt()["hash"], user_message, history)
+    if cache_key is None:
+        return None, None
+    
+    cached = get_cached_response(cache_key)
+    if cached is not None:
+        log_llm_cache_hit(chat_id)
+    return cache_key, cached
+
+
+def build_completion_request(config, messages, stream=False):
+    """Параметры вызова chat.completions.create"""
+    request = {
+        "model": config["model_name"],
+        "messages": messages,
+        "temperature": config["temperature"],
+        "max_tokens": config["max_tokens"]
+    }
+    if stream:
+        request["stream"] = True
+        # Расход токенов приходит последним фрагментом потока
+        request["stream_options"] = {"include_usage": True}
+    return request
+
+
+def record_token_usage(model, usage, chat_id="unknown"):
+    """Учесть токены, потраченные вызовом LLM: в метриках модели и в расходе чата"""
+    if isinstance(usage, CompletionUsage):
+        LLM_TOKENS_TOTAL.inc(model, "prompt", amount=usage.prompt_tokens)
+        LLM_TOKENS_TOTAL.inc(model, "completion", amount=usage.completion_tokens)
+        # Часть промпта, прочитанная из кеша провайдера (дешевле и быстрее)
+        details = usage.prompt_tokens_details
+        cached = (details.cached_tokens or 0) if details is not None else 0
+        if cached:
+            LLM_TOKENS_TOTAL.inc(model, "cached", amount=cached)
+        record_usage(chat_id, model, usage.prompt_tokens, usage.completion_tokens, cached)
+
+
+async def create_completion(client, request, chat_id="unknown", answered=None):
+    """Одна попытка вызова LLM за токеном общего ограничителя; 429 замедляет ограничитель
+
+    answered - словарь, куда записывается модель успешной попытки (с учетом
+    резервных моделей call_with_resilience).
+    """
+    await acquire_global()
+    try:
+        response = await client.chat.completions.create(**request)
+    except Exception as e:
+        if is_rate_limit_error(e):
+            report_rate_limited(get_retry_after(e))
+        raise
+    report_success()
+    if answered is not None:
+        answered["model"] = request["model"]
+    if not request.get("stream"):
+        record_token_usage(request["model"], response.usage, chat_id)
+    return response
+
+
+async def iter_stream_deltas(client, request, chat_id="unknown"):
+    """Открыть поток LLM и отдавать непустые фрагменты текста
+
+    Первым отдается имя модели, которая отвечает (с учетом резервных): поток
+    делится между одинаковыми запросами, и модель узнает каждый подписчик.
+    """
+    answered = {}
+    stream = await call_with_resilience(
+        partial(create_completion, client, chat_id=chat_id, answered=answered), request
+    )
+    try:
+        yield answered["model"]
+        async for chunk in stream:
+            if not chunk.choices:
+                record_token_usage(answered["model"], getattr(chunk, "usage", None), chat_id)
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+    finally:
+        await stream.close()
+
+
 async def send_to_llm(user_message, chat_id="unknown", history=None):
     """Отправка запроса в OpenRouter с учетом истории диалога"""
     start_time = time.time()
     
     try:
+        # Повторяющийся вопрос - отвечаем из кеша без обращения к LLM
+        cache_key, cached = get_cached_answer(chat_id, user_message, history)
+        if cached is not None:
+            return cached
+        
+        # Лимит чата проверяем только для запросов, которые дойдут до LLM
+        with span("rate_limit"):
+            await acquire_chat(chat_id)
+        
         config = get_public_config()
         client = get_llm_client()
         
-        # Логируем запрос
-        log_llm_request(chat_id, len(user_message), config["model_name"])
+        # Строим сообщения для LLM с историей; чат близко к дневному лимиту
+        # получает более короткий ответ или более дешевую модель, и такой
+        # ответ не попадает в общий кеш
+        with span("build_prompt"):
+            messages = build_prompt(chat_id, user_message, history)
+            request = build_completion_request(config, messages)
+            if apply_chat_budget(chat_id, request, config) != BUDGET_OK:
+                cache_key = None
         
-        # Строим сообщения для LLM с историей
-        messages = build_prompt(chat_id, user_message, history)
+        async def call_llm():
+            # Логируется и считается только сам вызов (лидер); присоединившиеся
+            # к нему запросы считает llm_coalesced_total
+            log_llm_request(chat_id, len(user_message), request["model"])
+            LLM_REQUESTS_TOTAL.inc(request["model"])
+            answered = {}
+            response = await call_with_resilience(
+                partial(create_completion, client, chat_id=chat_id, answered=answered), request
+            )
+            return answered["model"], response
         
-        # Отправляем запрос
-        response = client.chat.completions.create(
-            model=config["model_name"],
-            messages=messages,
-            temperature=config["temperature"],
-            max_tokens=config["max_tokens"]
-        )
+        # Отправляем запрос; одинаковые запросы в полете делят один вызов
+        with span("llm_call", model=request["model"]):
+            model, response = await coalesce(make_request_key(request), call_llm)
         
         response_content = response.choices[0].message.content
         response_time = time.time() - start_time
         
-        # Логируем ответ
+        # Логируем ответ; время - по модели, которая ответила
         log_llm_response(chat_id, response_time, len(response_content))
+        LLM_RESPONSE_SECONDS.observe(response_time, model)
         
+        store_response(cache_key, response_content)
         return response_content
         
     except Exception as e:
         # Логируем ошибку
-        error_msg = str(e)
-        if "timeout" in error_msg.lower():
-            error_type = "timeout"
-            user_message = "Извините, сервис временно недоступен. Попробуйте еще раз."
-        elif "rate limit" in error_msg.lower():
-            error_type = "rate_limit"
-            user_message = "Слишком много запросов. Подождите немного и повторите."
-        elif "api" in error_msg.lower():
-            error_type = "api_error"
-            user_message = "Произошла техническая ошибка. Обратитесь к администратору."
-        else:
-            error_type = "unknown"
-            user_message = "Не удалось получить ответ. Попробуйте переформулировать вопрос."
-        
-        log_llm_error(chat_id, error_type, error_msg)
+        error_type, user_message = classify_llm_error(e)
+        log_llm_error(chat_id, error_type, str(e))
+        LLM_ERRORS_TOTAL.inc(error_type)
         return user_message
 
 
+async def stream_llm(user_message, chat_id="unknown", history=None):
+    """Потоковая отправка запроса в OpenRouter: отдает ответ частями по мере генерации
+    
+    LLM_RESPONSE логирует отправитель ответа, так как только он знает,
+    когда первый фрагмент стал виден пользователю. Время до конца потока
+    пишется здесь - по модели, которая ответила.
+    """
+    start_time = time.time()
+    deltas = None
+    received = False
+    
+    try:
+        cache_key, cached = get_cached_answer(chat_id, user_message, history)
+        if cached is not None:
+            yield cached
+            return
+        
+        # Лимит чата проверяем только для запросов, которые дойдут до LLM
+        with span("rate_limit"):
+            await acquire_chat(chat_id)
+        
+        config = get_public_config()
+        client = get_llm_client()
+        
+        # Строим сообщения для LLM с историей и ограничиваем запрос бюджетом чата
+        with span("build_prompt"):
+            messages = build_prompt(chat_id, user_message, history)
+            request = build_completion_request(config, messages, stream=True)
+            if apply_chat_budget(chat_id, request, config) != BUDGET_OK:
+                cache_key = None
+        
+        def call_llm():
+            # Как в send_to_llm: логируется и считается только вызов лидера
+            log_llm_request(chat_id, len(user_message), request["model"])
+            LLM_REQUESTS_TOTAL.inc(request["model"])
+            return iter_stream_deltas(client, request, chat_id)
+        
+        deltas = coalesce_stream(make_request_key(request), call_llm)
+        
+        # Участок llm_stream включает и показ ответа: правки сообщения - вложенные участки
+        parts = []
+        model = None
+        stream_start = time.perf_counter()
+        with span("llm_stream", model=request["model"]):
+            async for delta in deltas:
+                # Первый элемент потока - модель, которая отвечает (см. iter_stream_deltas)
+                if model is None:
+                    model = delta
+                    continue
+                if not received:
+                    record_span("llm_first_delta", time.perf_counter() - stream_start)
+                received = True
+                parts.append(delta)
+                yield delta
+        
+        LLM_RESPONSE_SECONDS.observe(time.time() - start_time, model)
+        store_response(cache_key, "".join(parts))
+    
+    except Exception as e:
+        error_type, error_text = classify_llm_error(e)
+        log_llm_error(chat_id, error_type, str(e))
+        LLM_ERRORS_TOTAL.inc(error_type)
+        # Если часть ответа уже показана, дописываем ошибку отдельным абзацем
+        yield f"\n\n{error_text}" if received else error_text
+    
+    finally:
+        if deltas is not None:
+            await deltas.aclose()
+
+
+def classify_llm_error(error):
+    """Определить тип ошибки LLM и понятное сообщение для пользователя"""
+    if isinstance(error, RateLimitExceeded) or is_rate_limit_error(error):
+        return "rate_limit", "Слишком много запросов. Подождите немного и повторите."
+    error_msg = str(error).lower()
+    if "timeout" in error_msg:
+        return "timeout", "Извините, сервис временно недоступен. Попробуйте еще раз."
+    if "rate limit" in error_msg:
+        return "rate_limit", "Слишком много запросов. Подождите немного и повторите."
+    if "api" in error_msg:
+        return "api_error", "Произошла техническая ошибка. Обратитесь к администратору."
+    return "unknown", "Не удалось получить ответ. Попробуйте переформулировать вопрос."
+
+
+def truncate_user_message(user_message):
+    """Обрезать слишком длинное сообщение пользователя до лимита токенов"""
+    config = get_public_config()
+    return truncate_to_tokens(user_message, config["max_user_message_tokens"])
+
+
+def get_history_token_budget(user_message):
+    """Сколько токенов остается на историю после промпта, сообщения, фрагментов базы знаний и ответа"""
+    config = get_public_config()
+    reserved = get_system_prompt()["tokens"] + count_message_tokens(user_message) + config["max_tokens"]
+    if is_knowledge_loaded():
+        reserved += config["retrieval_context_tokens"]
+    return max(config["context_token_budget"] - reserved, 0)
+
+
 def build_prompt(chat_id, user_message, history=None):
-    """Формирование промпта с контекстом и системным сообщением"""
-    messages = [{"role": "system", "content": load_system_prompt()}]
+    """Формирование промпта с контекстом и системным сообщением
+    
+    История приходит уже уложенной в бюджет токенов (get_history_token_budget):
+    хранилище обрезает ее по счетчикам, посчитанным один раз при сохранении
+    реплики, поэтому здесь токены истории не пересчитываются.
     
-    # Добавляем историю диалога если есть
-    if history:
-        messages.extend(history)
+    Начало промпта - системный промпт и история; пока история только
+    растет, оно побайтно совпадает с прошлым запросом чата, и его находит
+    кеш промпта провайдера (хранилище отбрасывает старые реплики пачками,
+    HISTORY_TRIM_CHUNK). Для моделей из PROMPT_CACHE_MODELS системный промпт
+    и последняя реплика истории получают метки cache_control (граница
+    кешируемой части).
+    
+    Фрагменты базы знаний, относящиеся к вопросу, идут отдельным системным
+    сообщением после этой границы: они меняются от вопроса к вопросу.
+    """
+    config = get_public_config()
+    user_message = truncate_user_message(user_message)
+    messages = [get_system_prompt()["message"], *(history or [])]
+    
+    if uses_cache_control(config):
+        messages[0] = get_system_prompt()["cached_message"]
+        if len(messages) > 1:
+            messages[-1] = with_cache_control(messages[-1])
+    
+    knowledge = build_knowledge_message(user_message)
+    if knowledge is not None:
+        messages.append(knowledge)
     
     # Добавляем текущее сообщение пользователя
     messages.append({"role": "user", "content": user_message})
     
-    return messages
\ No newline at end of file
+    return messages
+
+
+# Счетчики слоев перед LLM читаются при запросе /metrics
+register_callback("llm_cache_hits_total", "Ответы из кеша без вызова LLM",
+                  lambda: get_cache_stats()["hits"], "counter")
+register_callback("llm_coalesced_total", "Вызовы LLM, сэкономленные объединением одинаковых запросов",
+                  lambda: get_singleflight_stats()["coalesced"], "counter")
+register_callback("llm_retries_total", "Повторы вызовов LLM",
+                  lambda: get_resilience_stats()["retries"], "counter")
+register_callback("llm_hedges_total", "Страховочные запросы к LLM",
+                  lambda: get_resilience_stats()["hedges"], "counter")
+register_callback("llm_fallbacks_total", "Переходы на резервную модель",
+                  lambda: get_resilience_stats()["fallbacks"], "counter")
+register_callback("rate_limit_rejected_total", "Запросы, отклоненные ограничителем частоты",
+                  lambda: get_rate_limiter_stats()["rejected"], "counter")
+register_callback("rate_limit_global_rps", "Текущая разрешенная скорость запросов к LLM",
+                  lambda: get_rate_limiter_stats()["global_rate"])
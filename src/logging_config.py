@@ -1,57 +1,216 @@
 """
 Конфигурация логирования для LLM Telegram Bot
 
-Двойное логирование согласно vision.md: файл + консоль одновременно
+Двойное логирование согласно vision.md: файл + консоль одновременно.
+Запись не блокирует event loop: logger только кладет запись в очередь,
+форматирование, запись в файл и ротацию выполняет фоновый поток
+(QueueListener). Старые файлы сжимаются gzip в отдельном потоке.
 """
 
+import atexit
+import gzip
+import json
 import logging
 import os
-from logging.handlers import RotatingFileHandler
+import queue
+import random
+import shutil
+import threading
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from src.config import get_public_config
 
+# Фоновый поток записи логов (один на процесс)
+_log_listener = None
 
-def setup_logging():
-    """Настройка двойного логирования (файл + консоль)"""
+# Записи, отброшенные из-за переполненной очереди
+_log_stats = {"dropped": 0}
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Кладет запись в очередь, не блокируя вызывающий поток
+
+    При переполненной очереди запись отбрасывается и учитывается в счетчике,
+    а не ждет места (event loop важнее отдельной строки лога).
+    """
+
+    def prepare(self, record):
+        # Форматирование - в потоке записи; здесь только подставляем аргументы
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _log_stats["dropped"] += 1
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает заданную долю записей частых событий (предупреждения и ошибки - всегда)"""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(str(record.msg).split(" |", 1)[0])
+        return rate is None or random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON; поля "EVENT | key=value" разбираются в ключи"""
+
+    def format(self, record):
+        entry = {"time": self.formatTime(record, self.datefmt), "level": record.levelname}
+        parts = record.getMessage().split(" | ")
+        if len(parts) > 1 and parts[0].isupper():
+            entry["event"] = parts[0]
+            for part in parts[1:]:
+                key, _, value = part.partition("=")
+                entry[key] = value.strip('"')
+        else:
+            entry["message"] = " | ".join(parts)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class LogListener(QueueListener):
+    """Фоновый поток записи логов"""
+
+    def enqueue_sentinel(self):
+        # Ждем места в очереди: при остановке записи не должны потеряться
+        self.queue.put(self._sentinel)
+
+
+def compress_file(source, dest):
+    """Сжать файл в gzip и удалить исходный"""
+    with open(source, "rb") as src, gzip.open(dest + ".tmp", "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.replace(dest + ".tmp", dest)
+    os.remove(source)
+
+
+class GzipRotatingFileHandler(RotatingFileHandler):
+    """Ротация по размеру со сжатием старых файлов (llm_bot.log.1.gz, ...) в отдельном потоке"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.namer = lambda name: name + ".gz"
+        self._compressor = None
+
+    def doRollover(self):
+        # Прошлый сегмент должен быть сжат до сдвига номеров файлов
+        self.wait_compression()
+        super().doRollover()
+
+    def rotate(self, source, dest):
+        pending = self.baseFilename + ".rotated"
+        os.replace(source, pending)
+        self._compressor = threading.Thread(target=compress_file, args=(pending, dest), name="log-compressor", daemon=True)
+        self._compressor.start()
+
+    def wait_compression(self):
+        if self._compressor is not None:
+            self._compressor.join()
+            self._compressor = None
+
+    def close(self):
+        super().close()
+        self.wait_compression()
+
+
+def create_formatter(config):
+    """Формат записей: text - как раньше, json - JSON lines"""
+    if config["log_format"] == "json":
+        return JsonFormatter(datefmt="%Y-%m-%dT%H:%M:%S")
+    return logging.Formatter(
+        "%(asctime)s | %(levelname)s | %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S"
+    )
+
+
+def setup_logging(log_file_path=None):
+    """Настройка двойного логирования (файл + консоль) через очередь
+
+    log_file_path заменяет LOG_FILE_PATH (у каждого процесса-воркера свой файл).
+    """
+    global _log_listener
     config = get_public_config()
+    log_file_path = log_file_path or config["log_file_path"]
     
     # Создаем главный logger для бота
     logger = logging.getLogger("llm_bot")
     logger.setLevel(getattr(logging, config["log_level"]))
     
-    # Очищаем существующие handlers (для перезапуска)
+    # Останавливаем прежний поток записи и очищаем handlers (для перезапуска)
+    shutdown_logging()
     logger.handlers.clear()
     
     # Создаем директорию для логов если её нет
-    log_dir = os.path.dirname(config["log_file_path"])
+    log_dir = os.path.dirname(log_file_path)
     if log_dir and not os.path.exists(log_dir):
         os.makedirs(log_dir)
     
     # Единый формат для всех handlers
-    formatter = logging.Formatter(
-        "%(asctime)s | %(levelname)s | %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S"
-    )
+    formatter = create_formatter(config)
+    handlers = []
     
     # Handler для файла с ротацией (если включен)
     if config["log_to_file"]:
-        file_handler = RotatingFileHandler(
-            config["log_file_path"], 
+        file_handler = GzipRotatingFileHandler(
+            log_file_path, 
             maxBytes=config["log_max_file_size"],
             backupCount=config["log_backup_count"],
             encoding='utf-8'
         )
         file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
+        handlers.append(file_handler)
     
     # Handler для консоли (если включен)
     if config["log_to_console"]:
         console_handler = logging.StreamHandler()
         console_handler.setFormatter(formatter)
-        logger.addHandler(console_handler)
+        handlers.append(console_handler)
+    
+    # Logger только кладет записи в очередь, пишет фоновый поток
+    log_queue = queue.Queue(maxsize=config["log_queue_size"])
+    queue_handler = DroppingQueueHandler(log_queue)
+    if config["log_sample_rates"]:
+        queue_handler.addFilter(SamplingFilter(config["log_sample_rates"]))
+    logger.addHandler(queue_handler)
+    
+    _log_listener = LogListener(log_queue, *handlers, respect_handler_level=True)
+    _log_listener.start()
     
     return logger
 
 
+def shutdown_logging():
+    """Дописать все записи из очереди и остановить поток записи"""
+    global _log_listener
+    if _log_listener is None:
+        return
+    
+    if _log_stats["dropped"]:
+        get_logger().warning(f"LOG_DROPPED | count={_log_stats['dropped']}")
+        _log_stats["dropped"] = 0
+    
+    listener = _log_listener
+    _log_listener = None
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+
+
+# Записи не теряются, даже если процесс завершается без явной остановки
+atexit.register(shutdown_logging)
+
+
 def get_logger():
     """Получить logger для использования в других модулях"""
     return logging.getLogger("llm_bot")
@@ -65,11 +224,11 @@ def log_bot_start(version="1.0.0"):
 
 
 def log_bot_stop(uptime_seconds=None, total_requests=None):
-    """Логирование остановки бота"""
+    """Логирование остановки бота (без total_requests, если процесс сам сообщения не обрабатывал)"""
     logger = get_logger()
-    uptime = f"{uptime_seconds}s" if uptime_seconds else "unknown"
-    requests = total_requests if total_requests else "unknown"
-    logger.info(f"BOT_STOP | uptime={uptime} | total_requests={requests}")
+    uptime = f"{uptime_seconds}s" if uptime_seconds is not None else "unknown"
+    requests = f" | total_requests={total_requests}" if total_requests is not None else ""
+    logger.info(f"BOT_STOP | uptime={uptime}{requests}")
 
 
 def log_llm_request(chat_id, message_length, model):
@@ -78,10 +237,55 @@ def log_llm_request(chat_id, message_length, model):
     logger.info(f"LLM_REQUEST | chat_id={chat_id} | model={model} | message_length={message_length}")
 
 
-def log_llm_response(chat_id, response_time, response_length):
-    """Логирование LLM ответа"""
+def log_llm_response(chat_id, response_time, response_length, first_token_time=None):
+    """Логирование LLM ответа (first_token_time - когда пользователь увидел первый фрагмент)"""
     logger = get_logger()
-    logger.info(f"LLM_RESPONSE | chat_id={chat_id} | response_time={response_time:.2f}s | response_length={response_length}")
+    first_token = f" | first_token_time={first_token_time:.2f}s" if first_token_time is not None else ""
+    logger.info(f"LLM_RESPONSE | chat_id={chat_id} | response_time={response_time:.2f}s{first_token} | response_length={response_length}")
+
+
+def log_queue_wait(chat_id, wait_time, queue_depth):
+    """Логирование ожидания в очереди до начала обработки (отдельно от времени LLM)"""
+    logger = get_logger()
+    logger.info(f"QUEUE_WAIT | chat_id={chat_id} | wait_time={wait_time:.3f}s | queue_depth={queue_depth}")
+
+
+def log_queue_overload(chat_id, queue_depth):
+    """Логирование отказа из-за переполненной очереди"""
+    logger = get_logger()
+    logger.warning(f"QUEUE_OVERLOAD | chat_id={chat_id} | queue_depth={queue_depth}")
+
+
+def log_rate_limit_backoff(rate, retry_after=None):
+    """Логирование снижения скорости запросов после 429 от upstream"""
+    logger = get_logger()
+    retry = f"{retry_after:.1f}s" if retry_after is not None else "unknown"
+    logger.warning(f"RATE_LIMIT_BACKOFF | rate={rate:.2f}rps | retry_after={retry}")
+
+
+def log_llm_attempt(model, attempt, kind, outcome, duration):
+    """Логирование отдельной попытки вызова LLM (kind: primary или hedge)"""
+    logger = get_logger()
+    message = f"LLM_ATTEMPT | model={model} | attempt={attempt} | kind={kind} | outcome={outcome} | duration={duration:.2f}s"
+    if outcome.startswith("error"):
+        logger.warning(message)
+    else:
+        logger.info(message)
+
+
+def log_llm_cache_hit(chat_id):
+    """Логирование ответа из кеша без обращения к LLM"""
+    logger = get_logger()
+    logger.info(f"LLM_CACHE_HIT | chat_id={chat_id}")
+
+
+def log_llm_warmup(warmup_time, success, error_message=None):
+    """Логирование прогрева соединения с LLM"""
+    logger = get_logger()
+    if success:
+        logger.info(f"LLM_WARMUP | warmup_time={warmup_time:.2f}s | status=success")
+    else:
+        logger.warning(f"LLM_WARMUP | warmup_time={warmup_time:.2f}s | status=failed | message=\"{error_message}\"")
 
 
 def log_llm_error(chat_id, error_type, error_message):
@@ -94,4 +298,139 @@ def log_command(chat_id, command, username=None):
     """Логирование выполнения команды"""
     logger = get_logger()
     user_info = f"user={username}" if username else "user=unknown"
-    logger.info(f"COMMAND | chat_id={chat_id} | {user_info} | command={command}")
\ No newline at end of file
+    logger.info(f"COMMAND | chat_id={chat_id} | {user_info} | command={command}")
+
+
+def log_webhook_start(url, workers):
+    """Логирование запуска webhook сервера"""
+    logger = get_logger()
+    logger.info(f"WEBHOOK_START | url={url} | workers={workers}")
+
+
+def log_update_error(update_id, error_message):
+    """Логирование ошибки обработки обновления"""
+    logger = get_logger()
+    logger.error(f"UPDATE_ERROR | update_id={update_id} | message=\"{error_message}\"")
+
+
+def log_shard_worker_start(index, pid):
+    """Логирование запуска процесса-воркера шарда"""
+    logger = get_logger()
+    logger.info(f"SHARD_WORKER_START | shard={index} | pid={pid}")
+
+
+def log_shard_worker_exit(index, exitcode):
+    """Логирование неожиданного завершения процесса-воркера"""
+    logger = get_logger()
+    logger.error(f"SHARD_WORKER_EXIT | shard={index} | exitcode={exitcode}")
+
+
+def log_shard_rebalance(old_count, new_count, moved, rebalance_time):
+    """Логирование перераспределения чатов между воркерами"""
+    logger = get_logger()
+    logger.info(f"SHARD_REBALANCE | workers={old_count}->{new_count} | moved_chats={moved} | rebalance_time={rebalance_time:.2f}s")
+
+
+def log_send_retry_after(chat_id, retry_after, attempt):
+    """Логирование flood control Telegram при отправке сообщения"""
+    logger = get_logger()
+    logger.warning(f"SEND_RETRY_AFTER | chat_id={chat_id} | retry_after={retry_after}s | attempt={attempt}")
+
+
+def log_config_reload(changed):
+    """Логирование перезагрузки настроек"""
+    logger = get_logger()
+    logger.info(f"CONFIG_RELOAD | changed={','.join(changed) or 'none'}")
+
+
+def log_config_error(error_message):
+    """Логирование неверных настроек при перезагрузке (действуют прежние)"""
+    logger = get_logger()
+    logger.error(f"CONFIG_ERROR | message=\"{error_message}\"")
+
+
+def log_history_summary(chat_id, turns, tokens_before, tokens_after, summary_time):
+    """Логирование сжатия истории чата в краткое содержание"""
+    logger = get_logger()
+    logger.info(f"HISTORY_SUMMARY | chat_id={chat_id} | turns={turns} | tokens_before={tokens_before} | tokens_after={tokens_after} | summary_time={summary_time:.2f}s")
+
+
+def log_persistence_error(batch_size, error_message):
+    """Логирование ошибки записи истории на диск"""
+    logger = get_logger()
+    logger.error(f"PERSISTENCE_ERROR | batch_size={batch_size} | message=\"{error_message}\"")
+
+
+def log_shutdown_drain(drained, drain_time):
+    """Логирование дообработки сообщений при остановке"""
+    logger = get_logger()
+    level = logger.info if drained else logger.warning
+    level(f"SHUTDOWN_DRAIN | drained={drained} | drain_time={drain_time:.2f}s")
+
+
+def log_snapshot(action, chats, snapshot_time):
+    """Логирование записи (save) или открытия (load) снимка истории"""
+    logger = get_logger()
+    logger.info(f"SNAPSHOT | action={action} | chats={chats} | time={snapshot_time:.2f}s")
+
+
+def log_snapshot_error(action, error_message):
+    """Логирование ошибки снимка истории"""
+    logger = get_logger()
+    logger.error(f"SNAPSHOT_ERROR | action={action} | message=\"{error_message}\"")
+
+
+def log_token_usage(window_time, chats, prompt_tokens, completion_tokens, cached_tokens, top_chats):
+    """Логирование расхода токенов за окно; top_chats - [(chat_id, токены), ...]"""
+    logger = get_logger()
+    top = ",".join(f"{chat_id}:{tokens}" for chat_id, tokens in top_chats)
+    logger.info(f"TOKEN_USAGE | window={window_time:.0f}s | chats={chats} | prompt={prompt_tokens} | completion={completion_tokens} | cached={cached_tokens} | top={top}")
+
+
+def log_token_budget(chat_id, level, used, budget):
+    """Логирование перехода чата на сокращенные ответы или дешевую модель"""
+    logger = get_logger()
+    logger.warning(f"TOKEN_BUDGET | chat_id={chat_id} | level={level} | used={used} | budget={budget}")
+
+
+def log_usage_error(error_message):
+    """Логирование ошибки записи отчета о расходе токенов"""
+    logger = get_logger()
+    logger.error(f"USAGE_ERROR | message=\"{error_message}\"")
+
+
+def log_message_merge(chat_id, parts):
+    """Логирование объединения нескольких сообщений в одну реплику"""
+    logger = get_logger()
+    logger.info(f"MESSAGE_MERGE | chat_id={chat_id} | parts={parts}")
+
+
+def log_knowledge_index(snippets, error_message=None):
+    """Логирование подключения индекса базы знаний"""
+    logger = get_logger()
+    if error_message is None:
+        logger.info(f"KNOWLEDGE_INDEX | snippets={snippets}")
+    else:
+        logger.warning(f"KNOWLEDGE_INDEX | disabled | message=\"{error_message}\"")
+
+
+def log_trace(trace_id, update_id, chat_id, duration, spans):
+    """Логирование трассы обновления; spans - [(участок, длительность), ...]"""
+    logger = get_logger()
+    parts = ",".join(f"{name}:{span_time * 1000:.0f}ms" for name, span_time in spans)
+    logger.info(f"TRACE | trace_id={trace_id} | update_id={update_id} | chat_id={chat_id} | time={duration:.3f}s | spans={parts}")
+
+
+def log_profile(action, profile_window=None, files=()):
+    """Логирование запуска (start) и остановки (stop) профилирования"""
+    logger = get_logger()
+    if action == "start":
+        logger.info(f"PROFILE | action=start | window={profile_window:.0f}s")
+    else:
+        logger.info(f"PROFILE | action=stop | files={','.join(files)}")
+
+
+def log_profile_error(error_message):
+    """Логирование ошибки записи результатов профилирования"""
+    logger = get_logger()
+    logger.error(f"PROFILE_ERROR | message=\"{error_message}\"")
@@ -0,0 +1,166 @@
+"""
+Метрики процесса в формате Prometheus
+
+Счетчики и гистограммы обновляются в event loop одной-двумя операциями
+над словарем, без блокировок и форматирования. Значения, которые уже
+считаются в других модулях (размер очередей, счетчики кеша), не
+дублируются: они читаются функциями-источниками в момент запроса /metrics.
+"""
+
+from bisect import bisect_left
+from aiohttp import web
+
+# Границы корзин гистограмм задержек (сек)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Все метрики процесса: имя -> метрика
+_registry = {}
+
+# Другие страницы сервера метрик: путь -> обработчик GET
+_pages = {}
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    """Монотонный счетчик с метками"""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.values = {}
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def get(self, *labels):
+        return self.values.get(labels, 0)
+
+    def render(self):
+        return [f"{self.name}{format_labels(self.labelnames, labels)} {value}"
+                for labels, value in self.values.items()]
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами (кумулятивные суммы - при выводе)"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # Метки -> [счетчики корзин (последняя - +Inf), сумма, количество]
+        self.values = {}
+
+    def observe(self, value, *labels):
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def render(self):
+        lines = []
+        for labels, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                bucket_labels = format_labels(self.labelnames + ("le",), labels + (bound,))
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            label_text = format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {total}")
+            lines.append(f"{self.name}_count{label_text} {count}")
+        return lines
+
+
+class Callback:
+    """Значение, которое читается из источника при выводе метрик"""
+
+    def __init__(self, name, help_text, source, kind="gauge"):
+        self.name = name
+        self.help_text = help_text
+        self.source = source
+        self.kind = kind
+
+    def render(self):
+        value = self.source()
+        return [] if value is None else [f"{self.name} {value}"]
+
+
+def counter(name, help_text, labelnames=()):
+    """Зарегистрировать счетчик"""
+    return _registry.setdefault(name, Counter(name, help_text, labelnames))
+
+
+def histogram(name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+    """Зарегистрировать гистограмму"""
+    return _registry.setdefault(name, Histogram(name, help_text, labelnames, buckets))
+
+
+def register_callback(name, help_text, source, kind="gauge"):
+    """Зарегистрировать значение из источника (повторная регистрация заменяет источник)"""
+    _registry[name] = Callback(name, help_text, source, kind)
+
+
+def register_page(path, handler):
+    """Отдавать на сервере метрик еще одну страницу (например, /traces)"""
+    _pages[path] = handler
+
+
+def render_metrics():
+    """Все метрики в текстовом формате Prometheus"""
+    lines = []
+    for metric in _registry.values():
+        lines.append(f"# HELP {metric.name} {metric.help_text}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def reset_metrics():
+    """Обнулить счетчики и гистограммы (источники значений остаются)"""
+    for metric in _registry.values():
+        if not isinstance(metric, Callback):
+            metric.values.clear()
+
+
+async def handle_metrics(request):
+    """GET /metrics"""
+    return web.Response(body=render_metrics().encode("utf-8"),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+async def start_metrics_server(host, port):
+    """Запустить HTTP сервер метрик; вернуть runner для остановки"""
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    for path, handler in _pages.items():
+        app.router.add_get(path, handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+# Метрики обработки сообщений и вызовов LLM
+MESSAGES_TOTAL = counter("bot_messages_total", "Текстовые сообщения пользователей")
+LLM_REQUESTS_TOTAL = counter("llm_requests_total", "Запросы к LLM (без ответов из кеша)", ("model",))
+LLM_ERRORS_TOTAL = counter("llm_errors_total", "Ошибки LLM по типам", ("error_type",))
+LLM_TOKENS_TOTAL = counter("llm_tokens_total", "Токены, потраченные в вызовах LLM", ("model", "type"))
+LLM_ATTEMPT_SECONDS = histogram("llm_attempt_duration_seconds", "Длительность успешного вызова LLM", ("model",))
+LLM_RESPONSE_SECONDS = histogram("llm_response_seconds", "Время ответа LLM (по модели, которая ответила)", ("model",))
+LLM_FIRST_TOKEN_SECONDS = histogram("llm_first_token_seconds", "Время до первого видимого фрагмента ответа")
+TELEGRAM_SEND_LAG_SECONDS = histogram("telegram_send_lag_seconds",
+                                      "Ожидание исходящего сообщения в очереди до отправки", ("lane",))
+QUEUE_WAIT_SECONDS = histogram("scheduler_queue_wait_seconds", "Ожидание в очереди до начала обработки")
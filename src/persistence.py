@@ -0,0 +1,205 @@
+"""
+Постоянное хранение истории диалогов
+
+Горячий слой - ConversationStore в памяти, холодный - backend на диске.
+Запись идет в фоне (write-behind): операции копятся в очереди и отдельный
+поток пишет их пачками в одной транзакции, не блокируя event loop.
+
+Backend - объект с методами:
+    load(chat_id, limit) -> [(role, content), ...]  # чтение при промахе горячего слоя (из потока)
+    enqueue_append(chat_id, role, content)         # запись реплики в фоне
+    enqueue_delete(chat_id)                        # удаление истории в фоне
+    flush(timeout)                                 # дождаться записи очереди
+    close()                                        # дописать очередь и остановиться
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import deque
+from src.logging_config import log_persistence_error
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_chat ON messages (chat_id, id);
+"""
+
+
+class SQLiteBackend:
+    """SQLite в режиме WAL с фоновой пакетной записью"""
+
+    def __init__(self, path, max_messages, batch_size=500, flush_interval=0.05):
+        self.path = path
+        self.max_messages = max_messages
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.batches_written = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # Отдельное соединение для чтения: в WAL читатели не ждут писателя
+        self._read_conn = self._connect()
+        self._read_conn.executescript(SCHEMA)
+        self._read_lock = threading.Lock()
+
+        # Еще не записанные операции по чатам: чтение накладывает их на строки
+        # из файла, а не ждет записи. Поток записи делает COMMIT и снимает
+        # записанные операции под _read_lock, поэтому чтение видит каждую ровно раз.
+        # _pending_lock держится только на время операций со словарем
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._writer_loop, name="persistence-writer", daemon=True)
+        self._thread.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        # Файл может быть общим для воркеров (SHARD_SHARED_PERSISTENCE): ждем блокировку, а не падаем
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    def _enqueue(self, op):
+        with self._pending_lock:
+            self._pending.setdefault(op[1], deque()).append(op)
+        self._queue.put(op)
+
+    def _mark_written(self, batch):
+        """Снять обработанные операции пачки из очереди в памяти"""
+        with self._pending_lock:
+            for op in batch:
+                if op[0] in ("append", "delete"):
+                    ops = self._pending[op[1]]
+                    ops.popleft()
+                    if not ops:
+                        del self._pending[op[1]]
+
+    def enqueue_append(self, chat_id, role, content):
+        """Поставить запись реплики в очередь"""
+        self._enqueue(("append", chat_id, role, content, time.time()))
+
+    def enqueue_delete(self, chat_id):
+        """Поставить удаление истории чата в очередь"""
+        self._enqueue(("delete", chat_id))
+
+    def load(self, chat_id, limit):
+        """Прочитать последние limit реплик чата (в хронологическом порядке)
+
+        Блокирующее чтение: из event loop вызывается через asyncio.to_thread.
+        Еще не записанные операции чата берутся из очереди в памяти.
+        """
+        with self._read_lock:
+            rows = self._read_conn.execute(
+                "SELECT role, content FROM messages WHERE chat_id = ? ORDER BY id DESC LIMIT ?",
+                (chat_id, limit)
+            ).fetchall()
+            with self._pending_lock:
+                ops = list(self._pending.get(chat_id, ()))
+        rows.reverse()
+        for op in ops:
+            if op[0] == "append":
+                rows.append((op[2], op[3]))
+            else:
+                rows.clear()
+        return rows[-limit:] if limit else []
+
+    def flush(self, timeout=5.0):
+        """Дождаться, пока все поставленные операции будут записаны"""
+        done = threading.Event()
+        self._queue.put(("flush", done))
+        return done.wait(timeout)
+
+    def close(self, timeout=10.0):
+        """Дописать очередь и остановить поток записи"""
+        self._queue.put(("stop",))
+        self._thread.join(timeout)
+        self._read_conn.close()
+
+    def _collect_batch(self):
+        """Дождаться операции и добрать пачку за flush_interval"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        # flush и stop закрывают пачку: их обрабатываем после коммита
+        while len(batch) < self.batch_size and batch[-1][0] in ("append", "delete"):
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _writer_loop(self):
+        conn = self._connect()
+        running = True
+        while running:
+            batch = self._collect_batch()
+            try:
+                self._write_batch(conn, batch)
+                self.batches_written += 1
+            except sqlite3.Error as e:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                log_persistence_error(len(batch), str(e))
+                # Пачка потеряна: чтение больше не накладывает ее операции
+                self._mark_written(batch)
+
+            for op in batch:
+                if op[0] == "flush":
+                    op[1].set()
+                elif op[0] == "stop":
+                    running = False
+        conn.close()
+
+    def _write_batch(self, conn, batch):
+        """Записать пачку операций одной транзакцией и обрезать историю до лимита"""
+        touched = set()
+        conn.execute("BEGIN")
+        for op in batch:
+            if op[0] == "append":
+                conn.execute(
+                    "INSERT INTO messages (chat_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+                    op[1:]
+                )
+                touched.add(op[1])
+            elif op[0] == "delete":
+                conn.execute("DELETE FROM messages WHERE chat_id = ?", (op[1],))
+                touched.discard(op[1])
+
+        for chat_id in touched:
+            conn.execute(
+                "DELETE FROM messages WHERE chat_id = ? AND id NOT IN "
+                "(SELECT id FROM messages WHERE chat_id = ? ORDER BY id DESC LIMIT ?)",
+                (chat_id, chat_id, self.max_messages)
+            )
+        with self._read_lock:
+            conn.execute("COMMIT")
+            self._mark_written(batch)
+
+
+def create_persistence_backend(config):
+    """Создать backend по настройке persistence_backend ("none" - только память)"""
+    name = config["persistence_backend"]
+    if name == "none":
+        return None
+    if name == "sqlite":
+        return SQLiteBackend(
+            config["persistence_path"],
+            max_messages=config["max_history_length"],
+            batch_size=config["persistence_batch_size"],
+            flush_interval=config["persistence_flush_interval"]
+        )
+    raise ValueError(f"Неизвестный persistence_backend: {name}")
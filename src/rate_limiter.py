@@ -0,0 +1,189 @@
+"""
+Ограничение частоты запросов к LLM (token bucket)
+
+Два уровня: ведро на каждый чат (один пользователь не забирает всю квоту)
+и общее ведро на процесс (не выходим за квоту OpenRouter). Общее ведро
+подстраивается под upstream: после 429 скорость снижается вдвое и
+запросы приостанавливаются на Retry-After, после успешных ответов
+скорость постепенно восстанавливается до настроенной.
+"""
+
+import asyncio
+import time
+from src.config import get_public_config, add_reload_listener
+from src.logging_config import log_rate_limit_backoff
+
+# Сколько ведер чатов держать, прежде чем удалять заполненные (простаивающие)
+MAX_CHAT_BUCKETS = 10000
+
+# Снижать скорость не чаще раза в секунду: пачка 429 от одновременных
+# запросов - это один сигнал перегрузки, а не несколько
+BACKOFF_COOLDOWN = 1.0
+
+
+class RateLimitExceeded(Exception):
+    """Токен не появится в пределах допустимого ожидания"""
+
+    def __init__(self, scope, retry_after):
+        super().__init__(f"rate limit exceeded: scope={scope} retry_after={retry_after:.1f}s")
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Ведро: rate токенов в секунду, не больше capacity про запас"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Через сколько секунд появится свободный токен"""
+        self.refill(now)
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def reserve(self, max_wait):
+        """Занять токен; вернуть время ожидания или None, если ждать дольше max_wait
+
+        Токен занимается сразу (ведро может уйти в минус), поэтому
+        одновременные запросы выстраиваются в очередь, а не толпятся.
+        """
+        wait = self.wait_time(time.monotonic())
+        if wait > max_wait:
+            return None
+        self.tokens -= 1
+        return wait
+
+    def is_full(self, now):
+        self.refill(now)
+        return self.tokens >= self.capacity
+
+
+# Ведра: общее создается при первом запросе, чатов - по мере появления
+_global_bucket = None
+_chat_buckets = {}
+_backoff_state = {"last_backoff": 0.0}
+
+# Счетчики для мониторинга
+_limiter_stats = {"delayed": 0, "rejected": 0, "backoffs": 0}
+
+
+def get_global_bucket():
+    """Общее ведро процесса"""
+    global _global_bucket
+    if _global_bucket is None:
+        config = get_public_config()
+        _global_bucket = TokenBucket(config["rate_limit_global_rps"], config["rate_limit_global_burst"])
+    return _global_bucket
+
+
+def get_chat_bucket(chat_id):
+    """Ведро чата (простаивающие заполненные ведра периодически удаляются)"""
+    bucket = _chat_buckets.get(chat_id)
+    if bucket is None:
+        if len(_chat_buckets) >= MAX_CHAT_BUCKETS:
+            now = time.monotonic()
+            for key in [key for key, b in _chat_buckets.items() if b.is_full(now)]:
+                del _chat_buckets[key]
+        config = get_public_config()
+        bucket = TokenBucket(config["rate_limit_chat_per_minute"] / 60.0, config["rate_limit_chat_burst"])
+        _chat_buckets[chat_id] = bucket
+    return bucket
+
+
+async def _acquire(bucket, scope):
+    config = get_public_config()
+    wait = bucket.reserve(config["rate_limit_max_wait"])
+    if wait is None:
+        _limiter_stats["rejected"] += 1
+        raise RateLimitExceeded(scope, bucket.wait_time(time.monotonic()))
+    if wait > 0:
+        _limiter_stats["delayed"] += 1
+        await asyncio.sleep(wait)
+
+
+async def acquire_chat(chat_id):
+    """Дождаться токена чата (RateLimitExceeded, если ждать слишком долго)"""
+    if get_public_config()["rate_limit_enabled"]:
+        await _acquire(get_chat_bucket(chat_id), "chat")
+
+
+async def acquire_global():
+    """Дождаться токена общего ведра перед вызовом LLM"""
+    if get_public_config()["rate_limit_enabled"]:
+        await _acquire(get_global_bucket(), "global")
+
+
+def report_rate_limited(retry_after=None):
+    """Upstream ответил 429: снизить скорость и приостановить запросы"""
+    config = get_public_config()
+    if not config["rate_limit_enabled"]:
+        return
+
+    bucket = get_global_bucket()
+    now = time.monotonic()
+    bucket.refill(now)
+
+    if now - _backoff_state["last_backoff"] >= BACKOFF_COOLDOWN:
+        _backoff_state["last_backoff"] = now
+        bucket.rate = max(bucket.rate * config["rate_limit_backoff"], config["rate_limit_min_rps"])
+        _limiter_stats["backoffs"] += 1
+        log_rate_limit_backoff(bucket.rate, retry_after)
+
+    # Следующий токен - не раньше, чем через retry_after (или один интервал)
+    pause = retry_after if retry_after is not None else 1.0 / bucket.rate
+    bucket.tokens = min(bucket.tokens, 1 - pause * bucket.rate)
+
+
+def report_success():
+    """Успешный ответ upstream: понемногу возвращать скорость к настроенной"""
+    config = get_public_config()
+    if not config["rate_limit_enabled"]:
+        return
+
+    bucket = get_global_bucket()
+    if bucket.rate < config["rate_limit_global_rps"]:
+        bucket.refill(time.monotonic())
+        bucket.rate = min(bucket.rate + config["rate_limit_recovery"], config["rate_limit_global_rps"])
+
+
+def apply_settings(config):
+    """Новые лимиты после перезагрузки настроек: ведра меняются на месте, без сброса"""
+    if _global_bucket is not None:
+        resize_bucket(_global_bucket, config["rate_limit_global_rps"], config["rate_limit_global_burst"])
+    for bucket in _chat_buckets.values():
+        resize_bucket(bucket, config["rate_limit_chat_per_minute"] / 60.0, config["rate_limit_chat_burst"])
+
+
+def resize_bucket(bucket, rate, capacity):
+    bucket.refill(time.monotonic())
+    bucket.rate = rate
+    bucket.capacity = capacity
+    bucket.tokens = min(bucket.tokens, capacity)
+
+
+def get_rate_limiter_stats():
+    """Счетчики ограничителя и текущая скорость общего ведра"""
+    rate = _global_bucket.rate if _global_bucket is not None else None
+    return dict(_limiter_stats, global_rate=rate, chats=len(_chat_buckets))
+
+
+def reset_rate_limiters():
+    """Сбросить ведра и счетчики (ведра пересоздаются по текущим настройкам)"""
+    global _global_bucket
+    _global_bucket = None
+    _chat_buckets.clear()
+    _backoff_state["last_backoff"] = 0.0
+    for name in _limiter_stats:
+        _limiter_stats[name] = 0
+
+
+add_reload_listener(apply_settings)
@@ -0,0 +1,194 @@
+"""
+Устойчивость вызовов LLM: повторы, страховочный запрос и резервные модели
+
+Порядок для одного запроса:
+- повтор с экспоненциальной паузой и случайным разбросом (jitter)
+  для временных ошибок (таймауты, обрывы соединения, 429, 5xx);
+- если ответа нет дольше p95 обычной задержки, параллельно уходит
+  страховочный запрос (hedge), побеждает первый ответ, второй отменяется;
+- когда повторы исчерпаны, запрос уходит к следующей модели из FALLBACK_MODELS.
+"""
+
+import asyncio
+import random
+import time
+from collections import deque
+import httpx
+import openai
+from src.config import get_public_config
+from src.logging_config import log_llm_attempt
+from src.metrics import LLM_ATTEMPT_SECONDS
+from src.tracing import span
+
+# Коды ответа, после которых запрос имеет смысл повторить
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+# Коды, после которых стоит попробовать другую модель, но не повторять эту
+FALLBACK_STATUS = {404}
+
+# Сколько последних задержек учитывать для p95 и сколько нужно для оценки
+LATENCY_WINDOW = 200
+HEDGE_MIN_SAMPLES = 20
+
+# Задержки успешных вызовов отдельно для обычных и потоковых запросов
+_latencies = {False: deque(maxlen=LATENCY_WINDOW), True: deque(maxlen=LATENCY_WINDOW)}
+
+# Счетчики для мониторинга
+_resilience_stats = {"retries": 0, "hedges": 0, "hedge_wins": 0, "fallbacks": 0}
+
+
+def is_rate_limit_error(error):
+    """Ответил ли upstream 429 Too Many Requests"""
+    return getattr(error, "status_code", None) == 429
+
+
+def get_retry_after(error):
+    """Через сколько секунд upstream разрешает повторить запрос (None - не сообщил)"""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+        # OpenRouter: время сброса лимита в миллисекундах unix time
+        if headers.get("x-ratelimit-reset"):
+            return max(float(headers["x-ratelimit-reset"]) / 1000 - time.time(), 0.0)
+    except ValueError:
+        pass
+    return None
+
+
+def is_retryable_error(error):
+    """Временная ли ошибка: повтор того же запроса может пройти"""
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    return isinstance(error, (openai.APIConnectionError, httpx.TransportError, asyncio.TimeoutError))
+
+
+def get_error_outcome(error):
+    """Короткое название ошибки для лога попытки"""
+    status = getattr(error, "status_code", None)
+    return f"error_{status}" if status is not None else f"error_{type(error).__name__}"
+
+
+def get_retry_delay(error, attempt, config):
+    """Пауза перед повтором: full jitter, но не меньше Retry-After"""
+    backoff = random.uniform(0, min(config["llm_retry_max_delay"], config["llm_retry_base_delay"] * 2 ** (attempt - 1)))
+    retry_after = get_retry_after(error) or 0.0
+    return min(max(backoff, retry_after), config["llm_retry_max_delay"])
+
+
+def get_hedge_delay(stream, config):
+    """Через сколько секунд без ответа отправлять страховочный запрос (None - не отправлять)"""
+    if not config["llm_hedge_enabled"]:
+        return None
+    if config["llm_hedge_delay"] > 0:
+        return config["llm_hedge_delay"]
+
+    samples = _latencies[stream]
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return None
+    return sorted(samples)[int(len(samples) * 0.95)]
+
+
+async def run_attempt(call, request, attempt, kind):
+    """Одна попытка вызова с логированием результата"""
+    start_time = time.monotonic()
+    try:
+        with span("llm_attempt", model=request["model"], attempt=attempt, kind=kind):
+            result = await call(request)
+    except asyncio.CancelledError:
+        log_llm_attempt(request["model"], attempt, kind, "cancelled", time.monotonic() - start_time)
+        raise
+    except Exception as e:
+        log_llm_attempt(request["model"], attempt, kind, get_error_outcome(e), time.monotonic() - start_time)
+        raise
+
+    duration = time.monotonic() - start_time
+    _latencies[bool(request.get("stream"))].append(duration)
+    LLM_ATTEMPT_SECONDS.observe(duration, request["model"])
+    log_llm_attempt(request["model"], attempt, kind, "success", duration)
+    return result
+
+
+async def run_hedged(call, request, attempt, config):
+    """Попытка со страховочным запросом: побеждает первый успешный ответ"""
+    stream = bool(request.get("stream"))
+    primary = asyncio.ensure_future(run_attempt(call, request, attempt, "primary"))
+    hedge_delay = get_hedge_delay(stream, config)
+    if hedge_delay is None:
+        return await primary
+
+    pending = {primary}
+    try:
+        done, pending = await asyncio.wait(pending, timeout=hedge_delay)
+        if done:
+            return primary.result()
+
+        _resilience_stats["hedges"] += 1
+        pending.add(asyncio.ensure_future(run_attempt(call, request, attempt, "hedge")))
+
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            winner = None
+            for task in done:
+                if task.exception() is not None:
+                    error = task.exception()
+                elif winner is None:
+                    winner = task
+                elif stream:
+                    # Оба потока открылись одновременно - лишний закрываем
+                    await task.result().close()
+            if winner is not None:
+                if winner is not primary:
+                    _resilience_stats["hedge_wins"] += 1
+                return winner.result()
+        raise error
+    finally:
+        # Проигравший запрос больше не нужен
+        for task in pending:
+            task.cancel()
+
+
+async def call_with_resilience(call, request):
+    """Вызвать call(request) с повторами, страховкой и резервными моделями
+
+    call - корутина одной попытки (например, chat.completions.create).
+    Возвращает первый успешный результат или поднимает последнюю ошибку.
+    """
+    config = get_public_config()
+    models = [request["model"]] + [m for m in config["fallback_models"] if m != request["model"]]
+
+    error = None
+    for index, model in enumerate(models):
+        if index > 0:
+            _resilience_stats["fallbacks"] += 1
+        model_request = dict(request, model=model)
+
+        for attempt in range(1, config["llm_max_retries"] + 2):
+            try:
+                return await run_hedged(call, model_request, attempt, config)
+            except Exception as e:
+                error = e
+                if not is_retryable_error(e) or attempt > config["llm_max_retries"]:
+                    break
+                _resilience_stats["retries"] += 1
+                await asyncio.sleep(get_retry_delay(e, attempt, config))
+
+        # Ошибку запроса (400, 401...) другая модель не исправит
+        if not is_retryable_error(error) and getattr(error, "status_code", None) not in FALLBACK_STATUS:
+            raise error
+    raise error
+
+
+def get_resilience_stats():
+    """Счетчики повторов, страховочных запросов и переходов на резервные модели"""
+    return dict(_resilience_stats)
+
+
+def clear_resilience():
+    """Сбросить счетчики и накопленные задержки"""
+    for samples in _latencies.values():
+        samples.clear()
+    for name in _resilience_stats:
+        _resilience_stats[name] = 0
@@ -0,0 +1,105 @@
+"""
+Кеш ответов LLM на повторяющиеся вопросы
+
+Ключ - хеш системного промпта, нормализованный текст вопроса и окно
+предыдущих сообщений. Ограничен по размеру (LRU) и по времени жизни (TTL).
+"""
+
+import json
+import re
+import time
+from collections import OrderedDict
+from src.config import get_public_config
+
+# Кеш: ключ -> (истекает_в, ответ); порядок - от давно использованных к свежим
+_response_cache = OrderedDict()
+
+# Счетчики для мониторинга
+_cache_stats = {"hits": 0, "misses": 0, "stores": 0, "skipped": 0, "evictions": 0}
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_question(text):
+    """Привести вопрос к каноническому виду: регистр, ё, пунктуация, пробелы"""
+    text = text.lower().replace("ё", "е")
+    text = _PUNCTUATION.sub(" ", text)
+    return _SPACES.sub(" ", text).strip()
+
+
+def make_cache_key(prompt_hash, user_message, history=None):
+    """Построить ключ кеша или вернуть None, если вопрос зависит от контекста
+
+    В ключ входят последние response_cache_context_messages сообщений истории.
+    Если история длиннее этого окна, ответ зависит от того, что в ключ
+    не попало, и кешировать его нельзя.
+    """
+    config = get_public_config()
+    if not config["response_cache_enabled"]:
+        return None
+
+    window = config["response_cache_context_messages"]
+    history = history or []
+    if len(history) > window:
+        _cache_stats["skipped"] += 1
+        return None
+
+    context = tuple((m["role"], normalize_question(m["content"])) for m in history)
+    return (prompt_hash, normalize_question(user_message), context)
+
+
+def get_cached_response(key):
+    """Получить ответ из кеша (None при промахе или истекшем TTL)"""
+    entry = _response_cache.get(key)
+    if entry is None or entry[0] < time.time():
+        if entry is not None:
+            del _response_cache[key]
+        _cache_stats["misses"] += 1
+        return None
+
+    _response_cache.move_to_end(key)
+    _cache_stats["hits"] += 1
+    return entry[1]
+
+
+def store_response(key, response, ttl=None):
+    """Сохранить успешный ответ в кеш (ttl=None - из настроек)"""
+    if key is None or not response:
+        return
+
+    config = get_public_config()
+    ttl = config["response_cache_ttl"] if ttl is None else ttl
+    _response_cache[key] = (time.time() + ttl, response)
+    _response_cache.move_to_end(key)
+    _cache_stats["stores"] += 1
+
+    while len(_response_cache) > config["response_cache_size"]:
+        _response_cache.popitem(last=False)
+        _cache_stats["evictions"] += 1
+
+
+def load_cache_seed(path, prompt_hash):
+    """Предзаполнить кеш из JSON файла [{"question": ..., "answer": ...}]
+
+    Заготовленные ответы не истекают по TTL, но вытесняются по LRU.
+    Возвращает количество загруженных записей.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+
+    for entry in entries:
+        store_response((prompt_hash, normalize_question(entry["question"]), ()), entry["answer"], ttl=float("inf"))
+    return len(entries)
+
+
+def get_cache_stats():
+    """Счетчики кеша и текущий размер"""
+    return dict(_cache_stats, size=len(_response_cache))
+
+
+def clear_response_cache():
+    """Очистить кеш и счетчики"""
+    _response_cache.clear()
+    for name in _cache_stats:
+        _cache_stats[name] = 0
@@ -0,0 +1,301 @@
+"""
+Локальный поиск по базе знаний
+
+База знаний - каталог KNOWLEDGE_DIR:
+- *.md - тексты об услугах; каждый раздел (заголовок и текст под ним) - фрагмент;
+- *.json - проверенные готовые ответы [{"question": ..., "answer": ...}].
+
+Индекс собирается заранее, вне работы бота:
+    uv run --extra retrieval python -m src.retrieval build
+
+Фрагмент - вектор хешированных символьных n-грамм с весами TF-IDF,
+нормированный по длине. Матрица векторов хранится в .npy и при запуске
+отображается в память (mmap); поиск - косинусная близость, одно умножение
+матриц на пачку вопросов.
+
+Если вопрос в начале диалога почти совпадает с вопросом готового ответа
+(RETRIEVAL_ANSWER_SCORE), бот отвечает им без вызова LLM. Иначе в промпт перед вопросом добавляются
+RETRIEVAL_TOP_K ближайших фрагментов, а не вся база знаний.
+
+Нужен NumPy (uv sync --extra retrieval); без него поиск отключен.
+"""
+
+import argparse
+import json
+import math
+import os
+import zlib
+from functools import lru_cache
+from src.config import get_public_config
+from src.response_cache import normalize_question
+from src.tokens import count_message_tokens
+from src.logging_config import log_knowledge_index
+from src.metrics import register_callback
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Размерность хешированных векторов по умолчанию (задается при сборке индекса)
+DEFAULT_DIM = 8192
+
+# Длины символьных n-грамм (слово дополняется пробелами с обеих сторон)
+NGRAM_SIZES = (3, 4, 5)
+
+# Файлы индекса в KNOWLEDGE_INDEX_DIR
+VECTORS_FILE = "vectors.npy"
+IDF_FILE = "idf.npy"
+SNIPPETS_FILE = "snippets.json"
+
+# Виды фрагментов: готовый ответ можно отправить без LLM, текст - только подсказка
+KIND_ANSWER = "answer"
+KIND_TEXT = "text"
+
+KNOWLEDGE_PREFIX = "Справка из базы знаний компании (используй, если относится к вопросу):\n\n"
+
+# Загруженный индекс (None - поиск отключен)
+_index = None
+
+# Счетчики для мониторинга
+_retrieval_stats = {"searches": 0, "answers": 0, "grounded": 0}
+
+
+def iter_ngrams(text):
+    """Символьные n-граммы слов нормализованного текста"""
+    for word in normalize_question(text).split():
+        padded = f" {word} "
+        for size in NGRAM_SIZES:
+            for start in range(len(padded) - size + 1):
+                yield padded[start:start + size]
+
+
+def hash_features(text, dim):
+    """Счетчики n-грамм по хешированным индексам: {индекс: количество}
+
+    crc32, а не hash(): индексы должны совпадать в сборщике и в боте.
+    """
+    counts = {}
+    for gram in iter_ngrams(text):
+        index = zlib.crc32(gram.encode("utf-8")) % dim
+        counts[index] = counts.get(index, 0) + 1
+    return counts
+
+
+def vectorize(texts, idf):
+    """Нормированные TF-IDF векторы текстов (матрица len(texts) x dim)"""
+    matrix = np.zeros((len(texts), len(idf)), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for index, count in hash_features(text, len(idf)).items():
+            matrix[row, index] = 1.0 + math.log(count)
+    matrix *= idf
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+
+def load_knowledge(directory):
+    """Фрагменты базы знаний: разделы .md и готовые ответы из .json
+
+    Каждый фрагмент - {"kind", "source", "title", "text", "key"}; key - текст,
+    по которому ищется фрагмент (у готового ответа - только вопрос).
+    """
+    snippets = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if name.endswith(".json"):
+            with open(path, encoding="utf-8") as f:
+                for entry in json.load(f):
+                    snippets.append({"kind": KIND_ANSWER, "source": name, "title": entry["question"],
+                                     "text": entry["answer"], "key": entry["question"]})
+        elif name.endswith(".md"):
+            with open(path, encoding="utf-8") as f:
+                snippets.extend(split_markdown(name, f.read()))
+    return snippets
+
+
+def split_markdown(source, text):
+    """Разделы markdown: заголовок и текст до следующего заголовка"""
+    sections = []
+    title, lines = "", []
+
+    def flush():
+        body = "\n".join(lines).strip()
+        if body:
+            sections.append({"kind": KIND_TEXT, "source": source, "title": title,
+                             "text": body, "key": f"{title}\n{body}"})
+
+    for line in text.splitlines():
+        if line.startswith("#"):
+            flush()
+            title, lines = line.lstrip("#").strip(), []
+        else:
+            lines.append(line)
+    flush()
+    return sections
+
+
+def build_index(knowledge_dir, index_dir, dim=DEFAULT_DIM):
+    """Собрать индекс базы знаний; вернуть число фрагментов"""
+    snippets = load_knowledge(knowledge_dir)
+    features = [hash_features(snippet["key"], dim) for snippet in snippets]
+
+    # Редкие n-граммы весят больше (сглаженный IDF)
+    document_frequency = np.zeros(dim, dtype=np.float32)
+    for counts in features:
+        document_frequency[list(counts)] += 1
+    idf = (np.log((1 + len(snippets)) / (1 + document_frequency)) + 1).astype(np.float32)
+
+    os.makedirs(index_dir, exist_ok=True)
+    np.save(os.path.join(index_dir, VECTORS_FILE), vectorize([s["key"] for s in snippets], idf))
+    np.save(os.path.join(index_dir, IDF_FILE), idf)
+    with open(os.path.join(index_dir, SNIPPETS_FILE), "w", encoding="utf-8") as f:
+        json.dump([{k: s[k] for k in ("kind", "source", "title", "text")} for s in snippets],
+                  f, ensure_ascii=False, indent=1)
+    return len(snippets)
+
+
+class KnowledgeIndex:
+    """Векторы фрагментов (из mmap), веса IDF и тексты фрагментов"""
+
+    def __init__(self, vectors, idf, snippets):
+        self.vectors = vectors
+        self.idf = idf
+        self.snippets = snippets
+
+    def search(self, queries, top_k):
+        """Для каждого вопроса - до top_k пар (близость, фрагмент), ближайшие первыми"""
+        scores = vectorize(queries, self.idf) @ self.vectors.T
+        top_k = min(top_k, len(self.snippets))
+        results = []
+        for row in scores:
+            best = np.argpartition(-row, top_k - 1)[:top_k]
+            best = best[np.argsort(-row[best])]
+            results.append([(float(row[i]), self.snippets[i]) for i in best])
+        return results
+
+
+def load_index(index_dir):
+    """Открыть собранный индекс (векторы - через mmap)"""
+    with open(os.path.join(index_dir, SNIPPETS_FILE), encoding="utf-8") as f:
+        snippets = json.load(f)
+    vectors = np.load(os.path.join(index_dir, VECTORS_FILE), mmap_mode="r")
+    idf = np.load(os.path.join(index_dir, IDF_FILE))
+    if vectors.shape != (len(snippets), len(idf)):
+        raise ValueError(f"index shape {vectors.shape} does not match {len(snippets)} snippets")
+    return KnowledgeIndex(vectors, idf, snippets)
+
+
+def init_knowledge_index(config):
+    """Подключить индекс базы знаний при старте; вернуть число фрагментов (0 - поиск отключен)"""
+    global _index
+    _index = None
+    _search.cache_clear()
+    if not config["retrieval_enabled"]:
+        return 0
+    if np is None:
+        log_knowledge_index(0, "numpy is not installed")
+        return 0
+    try:
+        index = load_index(config["knowledge_index_dir"])
+    except (OSError, ValueError) as e:
+        log_knowledge_index(0, str(e))
+        return 0
+    if not index.snippets:
+        return 0
+    _index = index
+    log_knowledge_index(len(index.snippets))
+    return len(index.snippets)
+
+
+def is_knowledge_loaded():
+    return _index is not None
+
+
+@lru_cache(maxsize=1024)
+def _search(text, top_k):
+    """Поиск с памятью: один вопрос проверяется и для ответа, и для промпта"""
+    _retrieval_stats["searches"] += 1
+    return tuple(_index.search([text], top_k)[0])
+
+
+def search_knowledge(text):
+    """Фрагменты, относящиеся к вопросу: [(близость, фрагмент), ...]"""
+    if _index is None:
+        return []
+    config = get_public_config()
+    return [(score, snippet) for score, snippet in _search(text, config["retrieval_top_k"])
+            if score >= config["retrieval_min_score"]]
+
+
+def find_direct_answer(text):
+    """Готовый ответ, если вопрос почти совпадает с проверенным (иначе None)"""
+    hits = search_knowledge(text)
+    if not hits:
+        return None
+    score, snippet = hits[0]
+    if snippet["kind"] != KIND_ANSWER or score < get_public_config()["retrieval_answer_score"]:
+        return None
+    _retrieval_stats["answers"] += 1
+    return snippet["text"]
+
+
+def build_knowledge_message(text):
+    """Системное сообщение с ближайшими фрагментами (None, если ничего не нашлось)
+
+    Фрагменты добавляются, пока укладываются в RETRIEVAL_CONTEXT_TOKENS.
+    """
+    hits = search_knowledge(text)
+    if not hits:
+        return None
+
+    budget = get_public_config()["retrieval_context_tokens"]
+    parts = []
+    for _, snippet in hits:
+        part = f"{snippet['title']}\n{snippet['text']}" if snippet["title"] else snippet["text"]
+        tokens = count_message_tokens(part)
+        if tokens > budget:
+            break
+        budget -= tokens
+        parts.append(part)
+    if not parts:
+        return None
+
+    _retrieval_stats["grounded"] += 1
+    return {"role": "system", "content": KNOWLEDGE_PREFIX + "\n\n".join(parts)}
+
+
+def get_retrieval_stats():
+    """Счетчики поиска по базе знаний и число фрагментов в индексе"""
+    return dict(_retrieval_stats, snippets=len(_index.snippets) if _index is not None else 0)
+
+
+register_callback("knowledge_answers_total", "Ответы из базы знаний без вызова LLM",
+                  lambda: _retrieval_stats["answers"], "counter")
+register_callback("knowledge_grounded_total", "Промпты с фрагментами базы знаний",
+                  lambda: _retrieval_stats["grounded"], "counter")
+
+
+def main():
+    config = get_public_config()
+    parser = argparse.ArgumentParser(description="Индекс базы знаний для поиска без LLM")
+    parser.add_argument("command", choices=["build", "search"])
+    parser.add_argument("query", nargs="?", help="Вопрос для проверки индекса (для search)")
+    parser.add_argument("--knowledge", default=config["knowledge_dir"], help="Каталог базы знаний")
+    parser.add_argument("--output", default=config["knowledge_index_dir"], help="Каталог индекса")
+    parser.add_argument("--dim", type=int, default=DEFAULT_DIM, help="Размерность хешированных векторов")
+    args = parser.parse_args()
+
+    if np is None:
+        parser.error("нужен NumPy: uv sync --extra retrieval")
+    if args.command == "build":
+        count = build_index(args.knowledge, args.output, args.dim)
+        print(f"Фрагментов в индексе: {count} ({args.output})")
+        return
+
+    for score, snippet in load_index(args.output).search([args.query or ""], config["retrieval_top_k"])[0]:
+        print(f"{score:.3f}  [{snippet['kind']}] {snippet['source']}: {snippet['title']}")
+
+
+if __name__ == "__main__":
+    main()
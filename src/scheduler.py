@@ -0,0 +1,175 @@
+"""
+Планировщик обработки сообщений
+
+Сообщения одного чата обрабатываются строго по очереди (FIFO), чтобы
+два быстрых сообщения не читали одну и ту же историю и не перемешивали
+реплики. Общее число одновременных вызовов LLM ограничено, очередь
+ожидающих - тоже: при переполнении новые сообщения отклоняются.
+"""
+
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+
+class SchedulerOverloaded(Exception):
+    """Очередь сообщений переполнена"""
+
+
+class ChatQueue:
+    """Очередь одного чата: блокировка, число сообщений в ней и занято ли
+    место вызова LLM сообщением, которое сейчас обрабатывается"""
+
+    __slots__ = ("lock", "pending", "holds_place")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.pending = 0
+        self.holds_place = False
+
+
+class RequestScheduler:
+    """Очередь сообщений по чатам и общий лимит одновременных вызовов LLM"""
+
+    def __init__(self, max_concurrency, max_queue, max_chat_queue):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_chat_queue = max_chat_queue
+        self.active = 0
+        self.waiting = 0
+        self.stats = {"scheduled": 0, "rejected": 0, "wait_time_total": 0.0, "wait_time_max": 0.0}
+        self._chats = {}
+        # Ожидающие свободного места; свое future на каждый вызов,
+        # поэтому планировщик не привязан к конкретному event loop
+        self._waiters = deque()
+        # Ожидающие, пока не останется сообщений (остановка бота)
+        self._idle_waiters = []
+
+    @asynccontextmanager
+    async def slot(self, chat_id, delay=0.0):
+        """Дождаться своей очереди в чате и свободного места; отдает время ожидания (сек)
+
+        delay - сколько секунд подождать перед очередью (окно объединения
+        сообщений); сообщение уже числится в очереди, поэтому wait_idle его
+        дождется, а в время ожидания delay не входит.
+        """
+        chat = self._chats.get(chat_id)
+        if self.waiting >= self.max_queue or (chat is not None and chat.pending >= self.max_chat_queue):
+            self.stats["rejected"] += 1
+            raise SchedulerOverloaded(f"queue_depth={self.waiting}")
+
+        if chat is None:
+            chat = self._chats[chat_id] = ChatQueue()
+        chat.pending += 1
+        self.waiting += 1
+        waiting = True
+
+        try:
+            if delay > 0:
+                await asyncio.sleep(delay)
+            start_time = time.perf_counter()
+            async with chat.lock:
+                await self._acquire()
+                chat.holds_place = True
+                try:
+                    self.waiting -= 1
+                    waiting = False
+                    wait_time = time.perf_counter() - start_time
+                    self._record_wait(wait_time)
+                    yield wait_time
+                finally:
+                    if chat.holds_place:
+                        chat.holds_place = False
+                        self._release()
+        finally:
+            if waiting:
+                self.waiting -= 1
+            chat.pending -= 1
+            if chat.pending == 0:
+                del self._chats[chat_id]
+                if not self._chats:
+                    self._notify_idle()
+
+    def release_place(self, chat_id):
+        """Отдать место вызова LLM до выхода из slot (генерация закончилась)
+
+        Очередь чата остается занятой до выхода из slot: ответ отправляется
+        и сохраняется в историю, но ожидание темпа Telegram не держит место,
+        нужное другим чатам для вызова LLM.
+        """
+        chat = self._chats.get(chat_id)
+        if chat is not None and chat.holds_place:
+            chat.holds_place = False
+            self._release()
+
+    async def _acquire(self):
+        """Занять место среди одновременных вызовов (в порядке очереди)"""
+        if self.active < self.max_concurrency and not self._waiters:
+            self.active += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            # Освободившееся место передается напрямую, active не меняется
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release()
+            else:
+                self._waiters.remove(future)
+            raise
+
+    def _release(self):
+        """Освободить место или передать его следующему в очереди"""
+        # После уменьшения лимита лишние места не передаются, а освобождаются
+        if self.active <= self.max_concurrency:
+            while self._waiters:
+                future = self._waiters.popleft()
+                if not future.done():
+                    future.set_result(None)
+                    return
+        self.active -= 1
+
+    def _notify_idle(self):
+        for future in self._idle_waiters:
+            if not future.done():
+                future.set_result(None)
+        self._idle_waiters.clear()
+
+    async def wait_idle(self, timeout):
+        """Дождаться, пока не останется сообщений в обработке и в очереди
+
+        Возвращает False, если за timeout секунд они не закончились.
+        """
+        if not self._chats:
+            return True
+        future = asyncio.get_running_loop().create_future()
+        self._idle_waiters.append(future)
+        done, _ = await asyncio.wait([future], timeout=timeout)
+        if not done:
+            self._idle_waiters.remove(future)
+            future.cancel()
+        return bool(done)
+
+    def resize(self, max_concurrency, max_queue, max_chat_queue):
+        """Поменять лимиты на ходу; при увеличении ожидающие сразу получают места"""
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_chat_queue = max_chat_queue
+        while self.active < self.max_concurrency and self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                self.active += 1
+                future.set_result(None)
+
+    def _record_wait(self, wait_time):
+        self.stats["scheduled"] += 1
+        self.stats["wait_time_total"] += wait_time
+        if wait_time > self.stats["wait_time_max"]:
+            self.stats["wait_time_max"] = wait_time
+
+    def get_stats(self):
+        """Счетчики планировщика и текущая загрузка"""
+        return dict(self.stats, active=self.active, waiting=self.waiting, chats=len(self._chats))
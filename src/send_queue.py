@@ -0,0 +1,174 @@
+"""
+Очередь исходящих сообщений Telegram
+
+Отправка идет с учетом лимитов Bot API: около 30 сообщений в секунду
+на бота, около одного в секунду в личный чат и 20 в минуту в группу
+(короткие всплески допускаются - это ведро с запасом). Ответ с
+TelegramRetryAfter не теряется: чат ждет retry_after, и то же сообщение
+отправляется снова (при 429 Telegram его не принял, дубля не будет).
+
+Приоритеты: ответы на команды обгоняют длинные ответы LLM и в своем чате,
+и в общей очереди бота. Правки потокового ответа идут мимо очереди -
+их частоту ограничивает сам отправитель (см. send_streaming_response).
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from aiogram.exceptions import TelegramRetryAfter
+from src.rate_limiter import TokenBucket, resize_bucket
+from src.logging_config import log_send_retry_after
+from src.metrics import TELEGRAM_SEND_LAG_SECONDS
+
+# Приоритеты (меньше - раньше)
+PRIORITY_COMMAND = 0
+PRIORITY_ANSWER = 1
+LANE_NAMES = {PRIORITY_COMMAND: "command", PRIORITY_ANSWER: "answer"}
+
+# Типы чатов с лимитом групп (20 сообщений в минуту)
+GROUP_CHAT_TYPES = ("group", "supergroup", "channel")
+
+# Сколько чатов держать, прежде чем удалять простаивающие
+MAX_SEND_CHATS = 10000
+
+
+class PriorityGate:
+    """Доступ к ресурсу по одному, ожидающие - по приоритету, затем по порядку"""
+
+    __slots__ = ("busy", "waiters")
+
+    # Общий счетчик порядка: при равном приоритете раньше тот, кто раньше встал
+    _order = itertools.count()
+
+    def __init__(self):
+        self.busy = False
+        self.waiters = []
+
+    async def acquire(self, priority):
+        if not self.busy and not self.waiters:
+            self.busy = True
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self._order), future))
+        try:
+            # Освободившийся доступ передается напрямую, busy не меняется
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        """Передать доступ следующему ожидающему (отмененные пропускаются)"""
+        while self.waiters:
+            _, _, future = heapq.heappop(self.waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.busy = False
+
+    def is_idle(self):
+        return not self.busy and not self.waiters
+
+
+class ChatSendState:
+    """Очередь и ведро одного чата"""
+
+    __slots__ = ("gate", "bucket", "is_group")
+
+    def __init__(self, rate, burst, is_group):
+        self.gate = PriorityGate()
+        self.bucket = TokenBucket(rate, burst)
+        self.is_group = is_group
+
+
+class SendScheduler:
+    """Темп отправки по чатам и по боту, повтор после flood control"""
+
+    def __init__(self, global_rps, chat_rps, group_per_minute, chat_burst, max_attempts):
+        self.chat_rps = chat_rps
+        self.group_rps = group_per_minute / 60.0
+        self.chat_burst = chat_burst
+        self.max_attempts = max_attempts
+        self.global_bucket = TokenBucket(global_rps, global_rps)
+        self.global_gate = PriorityGate()
+        self.stats = {"sent": 0, "retry_after": 0, "failed": 0}
+        self._chats = {}
+
+    def _get_chat(self, chat_id, is_group):
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            if len(self._chats) >= MAX_SEND_CHATS:
+                now = time.monotonic()
+                for key in [key for key, c in self._chats.items() if c.gate.is_idle() and c.bucket.is_full(now)]:
+                    del self._chats[key]
+            chat = ChatSendState(self.group_rps if is_group else self.chat_rps, self.chat_burst, is_group)
+            self._chats[chat_id] = chat
+        return chat
+
+    async def _take_token(self, bucket):
+        """Дождаться токена ведра и занять его"""
+        wait = bucket.wait_time(time.monotonic())
+        if wait > 0:
+            await asyncio.sleep(wait)
+            bucket.refill(time.monotonic())
+        bucket.tokens -= 1
+
+    async def send(self, chat_id, call, priority=PRIORITY_ANSWER, is_group=False):
+        """Выполнить call() (например, message.answer) в свою очередь; вернуть его результат"""
+        enqueued_at = time.monotonic()
+        chat = self._get_chat(chat_id, is_group)
+
+        await chat.gate.acquire(priority)
+        try:
+            await self._take_token(chat.bucket)
+            # Общий темп бота: при нехватке токенов первыми проходят команды
+            await self.global_gate.acquire(priority)
+            try:
+                await self._take_token(self.global_bucket)
+            finally:
+                self.global_gate.release()
+
+            TELEGRAM_SEND_LAG_SECONDS.observe(time.monotonic() - enqueued_at, LANE_NAMES[priority])
+            return await self._call_with_retry(chat_id, call)
+        finally:
+            chat.gate.release()
+
+    async def _call_with_retry(self, chat_id, call):
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                result = await call()
+            except TelegramRetryAfter as e:
+                self.stats["retry_after"] += 1
+                log_send_retry_after(chat_id, e.retry_after, attempt)
+                if attempt == self.max_attempts:
+                    self.stats["failed"] += 1
+                    raise
+                # Чат держим за собой: следующие сообщения чата не обгонят это
+                await asyncio.sleep(e.retry_after)
+                continue
+            except Exception:
+                self.stats["failed"] += 1
+                raise
+            self.stats["sent"] += 1
+            return result
+
+    def resize(self, global_rps, chat_rps, group_per_minute, chat_burst, max_attempts):
+        """Новые лимиты после перезагрузки настроек: ведра меняются на месте"""
+        self.chat_rps = chat_rps
+        self.group_rps = group_per_minute / 60.0
+        self.chat_burst = chat_burst
+        self.max_attempts = max_attempts
+        resize_bucket(self.global_bucket, global_rps, global_rps)
+        for chat in self._chats.values():
+            resize_bucket(chat.bucket, self.group_rps if chat.is_group else chat_rps, chat_burst)
+
+    def get_stats(self):
+        """Счетчики отправки и число чатов в учете"""
+        return dict(self.stats, chats=len(self._chats))
+
+    def clear(self):
+        """Забыть состояние чатов (для тестов)"""
+        self._chats.clear()
@@ -0,0 +1,493 @@
+"""
+Горизонтальное масштабирование: процессы-воркеры с шардированием по чатам
+
+Супервизор (процесс из main.py) получает обновления (polling или webhook)
+и по consistent hash от chat_id отправляет каждое своему процессу-воркеру.
+История чата живет только в памяти его воркера (shared-nothing), порядок
+сообщений чата сохраняет планировщик воркера.
+
+При смене числа воркеров (SIGTTIN / SIGTTOU, как в gunicorn) меняет
+владельца только часть чатов. Супервизор приостанавливает раздачу,
+воркеры дообрабатывают начатое, передают чужие теперь чаты новым
+владельцам и подтверждают готовность; после этого раздача продолжается
+по новому кольцу.
+
+Воркеры ничего не делят и на диске: у каждого свой файл истории
+(conversations.shard<N>.db). Упавший воркер перезапускается с тем же
+номером и подгружает свои чаты из своего файла. Чат, переехавший при
+смене числа воркеров, новый владелец записывает в свой файл, прежний -
+удаляет из своего. Переезжают только чаты в памяти: история давно
+молчавших чатов остается у прежнего владельца.
+
+SHARD_SHARED_PERSISTENCE = True - один backend на всех (например, сетевое
+хранилище с тем же интерфейсом, см. src/persistence.py): тогда новый
+владелец подгружает из него любой чат. Общий SQLite файл работает, но
+воркеры по очереди ждут его блокировку записи.
+"""
+
+import asyncio
+import bisect
+import hashlib
+import multiprocessing
+import os
+import signal
+import time
+from aiogram import Bot, Dispatcher
+from src.config import get_public_config, reload_config, load_env_file
+from src.handlers import register_handlers, chat_conversations, reload_settings
+from src.llm_client import init_llm_client, warmup_llm_client, close_llm_client, get_system_prompt
+from src.response_cache import load_cache_seed
+from src.persistence import create_persistence_backend
+from src.summarizer import stop_summaries
+from src.usage import start_usage_flusher, stop_usage_flusher
+from src.retrieval import init_knowledge_index
+from src.tracing import toggle_profiling, stop_profiling
+from src.webhook import run_webhook, feed_raw_update
+from src.metrics import start_metrics_server, register_callback
+from src.logging_config import (
+    setup_logging, shutdown_logging, log_update_error, log_shard_worker_start,
+    log_shard_worker_exit, log_shard_rebalance, log_config_error
+)
+
+# Поля обновления Telegram, в которых лежит объект с чатом
+CHAT_UPDATE_FIELDS = (
+    "message", "edited_message", "channel_post", "edited_channel_post",
+    "business_message", "edited_business_message", "my_chat_member", "chat_member",
+    "chat_join_request", "message_reaction", "message_reaction_count", "chat_boost"
+)
+
+# Как часто супервизор проверяет, живы ли воркеры (сек)
+MONITOR_INTERVAL = 1.0
+
+# Сколько ждать завершения воркера при остановке (сек)
+STOP_TIMEOUT = 30.0
+
+
+def hash_key(value):
+    """Стабильный между процессами и запусками хеш строки (hash() для str случаен)"""
+    return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """Кольцо consistent hashing: чат -> номер воркера
+
+    У каждого воркера replicas виртуальных узлов, поэтому при добавлении
+    или удалении воркера переезжает около 1/N чатов, остальные остаются на месте.
+    """
+
+    def __init__(self, worker_count, replicas):
+        self.worker_count = worker_count
+        points = sorted(
+            (hash_key(f"shard-{index}-{replica}"), index)
+            for index in range(worker_count) for replica in range(replicas)
+        )
+        self._hashes = [point for point, _ in points]
+        self._workers = [index for _, index in points]
+
+    def get_worker(self, key):
+        """Номер воркера, которому принадлежит ключ"""
+        position = bisect.bisect(self._hashes, hash_key(key)) % len(self._hashes)
+        return self._workers[position]
+
+
+def get_update_chat_id(data):
+    """chat_id обновления Telegram (None, если у обновления нет чата)"""
+    for field in CHAT_UPDATE_FIELDS:
+        if field in data:
+            return data[field]["chat"]["id"]
+    message = (data.get("callback_query") or {}).get("message")
+    if message:
+        return message["chat"]["id"]
+    return None
+
+
+def get_routing_key(data):
+    """Ключ шардирования: chat_id в том виде, в каком его хранят обработчики"""
+    chat_id = get_update_chat_id(data)
+    if chat_id is None:
+        # Обновления без чата (inline-запросы и т.п.) распределяем по update_id
+        return f"update-{data.get('update_id')}"
+    return str(chat_id)
+
+
+def get_shard_log_path(log_file_path, index):
+    """Свой файл для каждого воркера (лог, отчет о расходе, история): файл не делится между процессами"""
+    root, ext = os.path.splitext(log_file_path)
+    return f"{root}.shard{index}{ext}"
+
+
+class ShardWorker:
+    """Обработка обновлений своего шарда внутри процесса-воркера
+
+    Команды из inbox:
+        ("update", data)              - обработать обновление
+        ("import", chat_id, state)    - принять чат от другого воркера
+        ("rebalance", worker_count)   - отдать чужие по новому кольцу чаты
+        ("stop",)                     - дообработать начатое и завершиться
+    В outbox уходят ("handoff", owner, chat_id, state) и ("rebalanced", index, moved).
+    """
+
+    def __init__(self, index, inbox, outbox, process_update, store, replicas, shared_backend=False):
+        self.index = index
+        self.inbox = inbox
+        self.outbox = outbox
+        self.process_update = process_update
+        self.store = store
+        self.replicas = replicas
+        # Общий backend: переезжающие чаты не переписываются из файла в файл
+        self.shared_backend = shared_backend
+        self.tasks = set()
+
+    async def run(self):
+        """Читать команды до ("stop",)"""
+        loop = asyncio.get_running_loop()
+        while True:
+            command = await loop.run_in_executor(None, self.inbox.get)
+            kind = command[0]
+            if kind == "update":
+                self.feed(command[1])
+            elif kind == "import":
+                self.store.import_chat(command[1], command[2], persist=not self.shared_backend)
+            elif kind == "rebalance":
+                await self.rebalance(command[1])
+            elif kind == "stop":
+                await self.drain()
+                return
+
+    def feed(self, data):
+        """Начать обработку обновления; порядок внутри чата держит планировщик обработчиков"""
+        task = asyncio.create_task(self.process(data))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def process(self, data):
+        try:
+            await self.process_update(data)
+        except Exception as e:
+            log_update_error(data.get("update_id"), str(e))
+
+    async def drain(self):
+        """Дождаться обработки уже полученных обновлений"""
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    async def rebalance(self, worker_count):
+        """Передать новым владельцам чаты, которые по новому кольцу уже не наши"""
+        await self.drain()
+        ring = HashRing(worker_count, self.replicas)
+        moved = 0
+        for chat_id in self.store.chat_ids():
+            owner = ring.get_worker(chat_id)
+            if owner != self.index:
+                self.outbox.put(("handoff", owner, chat_id, self.store.export_chat(chat_id)))
+                if self.shared_backend:
+                    self.store.forget(chat_id)
+                else:
+                    # Свой файл: чат теперь живет в файле нового владельца
+                    self.store.delete(chat_id)
+                moved += 1
+
+        # Новый владелец может подгрузить чат из общего backend - дописываем очередь
+        if self.shared_backend and self.store.backend is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self.store.backend.flush)
+        self.outbox.put(("rebalanced", self.index, moved))
+
+
+async def worker_main(index, inbox, outbox):
+    """Процесс-воркер: свои бот, LLM клиент и хранилище, обработка своего шарда"""
+    load_env_file()
+    # Неверное значение в окружении не должно ронять воркер при каждом
+    # перезапуске: работаем на значениях по умолчанию из src/config.py
+    config_error = None
+    try:
+        reload_config()
+    except ValueError as e:
+        config_error = str(e)
+        reload_config(environ={})
+    config = get_public_config()
+    setup_logging(get_shard_log_path(config["log_file_path"], index))
+    log_shard_worker_start(index, os.getpid())
+    if config_error is not None:
+        log_config_error(config_error)
+    asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, reload_settings)
+    asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, toggle_profiling)
+
+    # По умолчанию у каждого воркера свой файл истории (shared-nothing)
+    if config["shard_shared_persistence"]:
+        chat_conversations.backend = create_persistence_backend(config)
+    else:
+        chat_conversations.backend = create_persistence_backend(
+            dict(config, persistence_path=get_shard_log_path(config["persistence_path"], index)))
+    usage_log_path = config["usage_log_path"] and get_shard_log_path(config["usage_log_path"], index)
+    start_usage_flusher(usage_log_path)
+    if config["response_cache_seed_file"]:
+        load_cache_seed(config["response_cache_seed_file"], get_system_prompt()["hash"])
+    init_knowledge_index(config)
+    if os.getenv("OPENROUTER_API_KEY"):
+        init_llm_client()
+        await warmup_llm_client()
+
+    bot = Bot(token=os.getenv("TELEGRAM_BOT_TOKEN"))
+    dp = Dispatcher()
+    register_handlers(dp)
+
+    # Каждый воркер отдает свои метрики на следующем за супервизором порту
+    metrics_runner = None
+    if config["metrics_enabled"]:
+        metrics_runner = await start_metrics_server(config["metrics_host"], config["metrics_port"] + 1 + index)
+
+    worker = ShardWorker(index, inbox, outbox, lambda data: feed_raw_update(dp, bot, data),
+                         chat_conversations, config["shard_replicas"], config["shard_shared_persistence"])
+    try:
+        await worker.run()
+    finally:
+        await stop_profiling()
+        await stop_summaries()
+        await stop_usage_flusher(usage_log_path)
+        await close_llm_client()
+        await bot.session.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        if chat_conversations.backend is not None:
+            chat_conversations.backend.close()
+        shutdown_logging()
+
+
+def run_worker(index, inbox, outbox):
+    """Точка входа процесса-воркера"""
+    # Ctrl+C и SIGTERM от systemd получает вся группа процессов; воркеры
+    # останавливает супервизор, дав им дообработать начатое
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    asyncio.run(worker_main(index, inbox, outbox))
+
+
+class ShardSupervisor:
+    """Запуск воркеров, раздача обновлений по кольцу, перебалансировка и перезапуск упавших"""
+
+    def __init__(self, worker_count, replicas, rebalance_timeout=60.0, context=None, target=run_worker):
+        self.context = context or multiprocessing.get_context("spawn")
+        self.target = target
+        self.worker_count = worker_count
+        self.replicas = replicas
+        self.rebalance_timeout = rebalance_timeout
+        self.ring = HashRing(worker_count, replicas)
+        self.outbox = self.context.Queue()
+        # index -> (процесс, очередь команд)
+        self.workers = {}
+        self.stats = {"routed": 0, "restarts": 0, "rebalances": 0, "handoffs": 0}
+        # Обновления, придержанные на время перебалансировки (None - раздача идет)
+        self._paused = None
+        self._pending_acks = set()
+        self._acks_done = None
+        self._moved = 0
+        self._resize_lock = asyncio.Lock()
+        self._stopping = False
+        self._reader_task = None
+        self._monitor_task = None
+
+    def start_worker(self, index):
+        inbox = self.context.Queue()
+        process = self.context.Process(target=self.target, args=(index, inbox, self.outbox),
+                                       name=f"shard-{index}")
+        process.start()
+        self.workers[index] = (process, inbox)
+
+    async def start(self):
+        for index in range(self.worker_count):
+            self.start_worker(index)
+        self._reader_task = asyncio.create_task(self._read_outbox())
+        self._monitor_task = asyncio.create_task(self._monitor())
+
+    async def route(self, data):
+        """Отправить обновление воркеру - владельцу чата (во время перебалансировки - придержать)"""
+        if self._paused is not None:
+            self._paused.append(data)
+            return
+        self._dispatch(data)
+
+    def _dispatch(self, data):
+        index = self.ring.get_worker(get_routing_key(data))
+        self.workers[index][1].put(("update", data))
+        self.stats["routed"] += 1
+
+    async def resize(self, worker_count):
+        """Сменить число воркеров с передачей переезжающих чатов"""
+        async with self._resize_lock:
+            old_count = self.worker_count
+            if worker_count < 1 or worker_count == old_count or self._stopping:
+                return
+            start_time = time.monotonic()
+            self._paused = []
+            old_indices = list(self.workers)
+
+            # Новые воркеры должны принимать чаты до начала передачи
+            for index in range(old_count, worker_count):
+                self.start_worker(index)
+
+            self._pending_acks = set(old_indices)
+            self._acks_done = asyncio.Event()
+            self._moved = 0
+            for index in old_indices:
+                self.workers[index][1].put(("rebalance", worker_count))
+            try:
+                await asyncio.wait_for(self._acks_done.wait(), timeout=self.rebalance_timeout)
+            except asyncio.TimeoutError:
+                pass
+
+            for index in old_indices:
+                if index >= worker_count:
+                    await self.stop_worker(index)
+
+            self.worker_count = worker_count
+            self.ring = HashRing(worker_count, self.replicas)
+            self.stats["rebalances"] += 1
+
+            # Придержанные обновления уходят в порядке получения, уже по новому кольцу
+            paused, self._paused = self._paused, None
+            for data in paused:
+                self._dispatch(data)
+            log_shard_rebalance(old_count, worker_count, self._moved, time.monotonic() - start_time)
+
+    def _ack(self, index):
+        self._pending_acks.discard(index)
+        if not self._pending_acks and self._acks_done is not None:
+            self._acks_done.set()
+
+    async def _read_outbox(self):
+        """Сообщения воркеров: передача чатов и подтверждения перебалансировки"""
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await loop.run_in_executor(None, self.outbox.get)
+            kind = message[0]
+            if kind == "handoff":
+                _, owner, chat_id, state = message
+                if owner in self.workers and state is not None:
+                    self.workers[owner][1].put(("import", chat_id, state))
+                    self.stats["handoffs"] += 1
+            elif kind == "rebalanced":
+                self._moved += message[2]
+                self._ack(message[1])
+            elif kind == "closed":
+                return
+
+    async def _monitor(self):
+        """Перезапускать упавшие воркеры (их чаты подгрузятся из общего backend, если он есть)"""
+        while True:
+            await asyncio.sleep(MONITOR_INTERVAL)
+            for index, (process, _) in list(self.workers.items()):
+                if self._stopping or process.is_alive():
+                    continue
+                log_shard_worker_exit(index, process.exitcode)
+                self.stats["restarts"] += 1
+                self.start_worker(index)
+                # Упавший воркер чатов уже не передаст
+                self._ack(index)
+
+    async def stop_worker(self, index):
+        """Остановить воркер: он дообработает начатое"""
+        process, inbox = self.workers.pop(index)
+        inbox.put(("stop",))
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, process.join, STOP_TIMEOUT)
+        if process.is_alive():
+            process.terminate()
+
+    async def stop(self):
+        """Остановить все воркеры и фоновые задачи супервизора"""
+        self._stopping = True
+        await asyncio.gather(*[self.stop_worker(index) for index in list(self.workers)])
+        self._monitor_task.cancel()
+        self.outbox.put(("closed",))
+        await asyncio.gather(self._reader_task, self._monitor_task, return_exceptions=True)
+
+    def send_signal(self, signum):
+        """Передать сигнал всем воркерам (например, SIGHUP для перезагрузки настроек)"""
+        for process, _ in self.workers.values():
+            if process.is_alive():
+                os.kill(process.pid, signum)
+
+    def get_stats(self):
+        """Счетчики раздачи и текущее число воркеров"""
+        return dict(self.stats, workers=len(self.workers))
+
+
+async def poll_updates(bot, supervisor, allowed_updates):
+    """Long polling в супервизоре: обновления не разбираются, а раздаются воркерам"""
+    offset = None
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=allowed_updates)
+        except Exception as e:
+            log_update_error(offset, str(e))
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            offset = update.update_id + 1
+            await supervisor.route(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+
+
+async def run_polling(bot, supervisor, allowed_updates):
+    """Опрос до SIGTERM / SIGINT; воркеры дообрабатывают начатое в supervisor.stop()"""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stop_event.set)
+
+    polling = asyncio.create_task(poll_updates(bot, supervisor, allowed_updates))
+    stopping = asyncio.create_task(stop_event.wait())
+    try:
+        await asyncio.wait([polling, stopping], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.remove_signal_handler(signum)
+        for task in (polling, stopping):
+            task.cancel()
+        await asyncio.gather(polling, stopping, return_exceptions=True)
+    if not polling.cancelled() and polling.exception() is not None:
+        raise polling.exception()
+
+
+async def run_sharded(dp, bot, config, webhook_url=None, webhook_secret=None):
+    """Режим шардов: супервизор принимает обновления, воркеры их обрабатывают"""
+    supervisor = ShardSupervisor(config["shard_workers"], config["shard_replicas"],
+                                 config["shard_rebalance_timeout"])
+    await supervisor.start()
+
+    register_callback("shard_workers", "Процессы-воркеры", lambda: supervisor.get_stats()["workers"])
+    register_callback("shard_routed_total", "Обновления, переданные воркерам",
+                      lambda: supervisor.stats["routed"], "counter")
+    register_callback("shard_handoffs_total", "Чаты, переданные между воркерами",
+                      lambda: supervisor.stats["handoffs"], "counter")
+    register_callback("shard_restarts_total", "Перезапуски упавших воркеров",
+                      lambda: supervisor.stats["restarts"], "counter")
+
+    def reload():
+        """SIGHUP: перечитать настройки здесь и в воркерах, подстроить число воркеров"""
+        if reload_settings() is None:
+            return
+        supervisor.send_signal(signal.SIGHUP)
+        asyncio.ensure_future(supervisor.resize(get_public_config()["shard_workers"]))
+
+    # SIGTTIN / SIGTTOU - добавить / убрать воркер, SIGHUP - перезагрузить настройки,
+    # SIGUSR1 - окно профилирования во всех воркерах
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGHUP, reload)
+    loop.add_signal_handler(signal.SIGUSR1, lambda: supervisor.send_signal(signal.SIGUSR1))
+    loop.add_signal_handler(signal.SIGTTIN, lambda: asyncio.ensure_future(
+        supervisor.resize(supervisor.worker_count + 1)))
+    loop.add_signal_handler(signal.SIGTTOU, lambda: asyncio.ensure_future(
+        supervisor.resize(supervisor.worker_count - 1)))
+
+    try:
+        if config["bot_mode"] == "webhook":
+            await run_webhook(dp, bot, webhook_url, webhook_secret, process_update=supervisor.route)
+        else:
+            await bot.delete_webhook()
+            await run_polling(bot, supervisor, dp.resolve_used_update_types())
+    finally:
+        loop.remove_signal_handler(signal.SIGHUP)
+        loop.remove_signal_handler(signal.SIGUSR1)
+        loop.remove_signal_handler(signal.SIGTTIN)
+        loop.remove_signal_handler(signal.SIGTTOU)
+        await supervisor.stop()
@@ -0,0 +1,117 @@
+"""
+Объединение одинаковых запросов к LLM, выполняющихся одновременно (single-flight)
+
+Первый запрос с данным ключом (лидер) делает вызов LLM, остальные
+присоединяются к нему и получают тот же результат или ту же ошибку.
+Отмена одного ожидающего не отменяет общий вызов, пока его ждет
+кто-то еще; вызов отменяется, когда ушел последний ожидающий.
+"""
+
+import asyncio
+import hashlib
+import json
+
+# Вызовы в полете: ключ -> запись с задачей и числом ожидающих
+_inflight = {}
+
+# Счетчики: leaders - реальные вызовы LLM, coalesced - сэкономленные вызовы
+_singleflight_stats = {"leaders": 0, "coalesced": 0}
+
+
+def make_request_key(request):
+    """Ключ запроса: хеш модели, параметров и всех сообщений промпта"""
+    payload = json.dumps(request, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _join(key, factory):
+    """Найти вызов в полете или запустить новый; вернуть его запись"""
+    entry = _inflight.get(key)
+    if entry is not None:
+        _singleflight_stats["coalesced"] += 1
+    else:
+        _singleflight_stats["leaders"] += 1
+        entry = {"key": key, "task": asyncio.ensure_future(factory()), "waiters": 0}
+        _inflight[key] = entry
+        entry["task"].add_done_callback(lambda _: _forget(entry))
+    entry["waiters"] += 1
+    return entry
+
+
+def _forget(entry):
+    if _inflight.get(entry["key"]) is entry:
+        del _inflight[entry["key"]]
+
+
+def _leave(entry):
+    """Ожидающий ушел; последний ушедший отменяет незавершенный вызов"""
+    entry["waiters"] -= 1
+    if entry["waiters"] == 0 and not entry["task"].done():
+        entry["task"].cancel()
+        # Новые запросы не должны присоединиться к отменяемому вызову
+        _forget(entry)
+
+
+async def coalesce(key, factory):
+    """Выполнить factory() один раз на все одновременные вызовы с ключом key"""
+    entry = _join(key, factory)
+    try:
+        return await asyncio.shield(entry["task"])
+    finally:
+        _leave(entry)
+
+
+async def coalesce_stream(key, factory):
+    """Потоковый вариант: один поток LLM раздается всем подписчикам
+
+    factory() - асинхронный генератор фрагментов ответа. Подписчик,
+    пришедший позже, сначала получает уже сгенерированные фрагменты.
+    """
+    chunks = []
+    state = {"changed": asyncio.Event()}
+
+    async def pump():
+        try:
+            async for chunk in factory():
+                chunks.append(chunk)
+                _notify(state)
+        finally:
+            _notify(state)
+
+    entry = _join(key, pump)
+    # Подписчик читает буфер и состояние потока лидера, а не свои
+    chunks, state = entry.setdefault("stream", (chunks, state))
+
+    try:
+        position = 0
+        while True:
+            if position < len(chunks):
+                position += 1
+                yield chunks[position - 1]
+                continue
+            task = entry["task"]
+            if task.done():
+                # Ошибка вызова достается каждому подписчику
+                task.result()
+                return
+            await state["changed"].wait()
+    finally:
+        _leave(entry)
+
+
+def _notify(state):
+    """Разбудить подписчиков потока"""
+    changed = state["changed"]
+    state["changed"] = asyncio.Event()
+    changed.set()
+
+
+def get_singleflight_stats():
+    """Счетчики объединения запросов и число вызовов в полете"""
+    return dict(_singleflight_stats, inflight=len(_inflight))
+
+
+def clear_singleflight():
+    """Сбросить счетчики (вызовы в полете не трогаем)"""
+    for name in _singleflight_stats:
+        _singleflight_stats[name] = 0
@@ -0,0 +1,229 @@
+"""
+Снимок истории диалогов для быстрого перезапуска
+
+При остановке бот дожидается сообщений в обработке и пишет историю всех
+чатов в один бинарный файл. При запуске файл отображается в память (mmap),
+читается только оглавление, а сам чат разбирается при первом обращении к
+нему - поэтому запуск занимает доли секунды и при 100 тысячах чатов.
+
+Снимок одноразовый: после открытия файл удаляется с диска (отображение
+остается рабочим), чтобы после аварийной остановки бот не поднял устаревшую
+историю поверх более свежей в backend. Чаты, к которым не обращались,
+переносятся в следующий снимок без разбора.
+
+Формат (little-endian):
+    заголовок   MAGIC, версия (H), число чатов (I), смещение оглавления (Q)
+    записи      zlib(краткое содержание + реплики) подряд
+    оглавление  для каждого чата: длина id (H), id, смещение (Q), длина (I), время сохранения (d)
+"""
+
+import mmap
+import os
+import struct
+import time
+import zlib
+from src.logging_config import log_snapshot, log_snapshot_error
+
+MAGIC = b"LTGS"
+VERSION = 1
+
+HEADER = struct.Struct("<4sHIQ")
+INDEX_ENTRY = struct.Struct("<QId")
+ID_LENGTH = struct.Struct("<H")
+COUNT = struct.Struct("<H")
+TEXT = struct.Struct("<BI")
+
+# Роль хранится одним байтом; 255 - нет краткого содержания
+ROLES = ("user", "assistant", "system")
+ROLE_CODES = {role: code for code, role in enumerate(ROLES)}
+NO_SUMMARY = 255
+
+
+class SnapshotError(Exception):
+    """Файл снимка поврежден или другой версии"""
+
+
+def encode_chat(state):
+    """Сжатая запись чата: краткое содержание и реплики"""
+    parts = []
+    summary = state["summary"]
+    if summary is None:
+        parts.append(TEXT.pack(NO_SUMMARY, 0))
+    else:
+        data = summary.encode("utf-8")
+        parts += [TEXT.pack(ROLE_CODES["system"], len(data)), data]
+
+    parts.append(COUNT.pack(len(state["turns"])))
+    for role, content in state["turns"]:
+        data = content.encode("utf-8")
+        parts += [TEXT.pack(ROLE_CODES[role], len(data)), data]
+    return zlib.compress(b"".join(parts), 1)
+
+
+def decode_chat(record):
+    """Состояние чата (как в ConversationStore.export_chat) из записи снимка"""
+    data = zlib.decompress(record)
+
+    def read_text(offset):
+        code, length = TEXT.unpack_from(data, offset)
+        offset += TEXT.size
+        return code, data[offset:offset + length].decode("utf-8"), offset + length
+
+    code, summary, offset = read_text(0)
+    (count,) = COUNT.unpack_from(data, offset)
+    offset += COUNT.size
+    turns = []
+    for _ in range(count):
+        code_turn, content, offset = read_text(offset)
+        turns.append((ROLES[code_turn], content))
+    return {"summary": summary if code != NO_SUMMARY else None, "turns": turns}
+
+
+class Snapshot:
+    """Открытый снимок: оглавление в памяти, записи читаются из mmap по запросу"""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._index = self._read_index()
+        except (struct.error, UnicodeDecodeError, SnapshotError) as e:
+            self._map.close()
+            raise SnapshotError(str(e)) from e
+
+    def _read_index(self):
+        if len(self._map) < HEADER.size:
+            raise SnapshotError("file is too short")
+        magic, version, count, offset = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise SnapshotError(f"unsupported format {magic!r} v{version}")
+
+        index = {}
+        for _ in range(count):
+            (length,) = ID_LENGTH.unpack_from(self._map, offset)
+            offset += ID_LENGTH.size
+            chat_id = self._map[offset:offset + length].decode("utf-8")
+            offset += length
+            index[chat_id] = INDEX_ENTRY.unpack_from(self._map, offset)
+            offset += INDEX_ENTRY.size
+        return index
+
+    def pop(self, chat_id):
+        """Забрать чат из снимка (разобрать запись); None если его нет"""
+        entry = self._index.pop(chat_id, None)
+        if entry is None:
+            return None
+        offset, length, _ = entry
+        try:
+            return decode_chat(self._map[offset:offset + length])
+        except (zlib.error, struct.error, UnicodeDecodeError, IndexError) as e:
+            # Поврежденная запись - чат подгрузится из backend, если он есть
+            log_snapshot_error("decode", f"chat_id={chat_id}: {e}")
+            return None
+
+    def discard(self, chat_id):
+        """Убрать чат из снимка без разбора; True если он там был"""
+        return self._index.pop(chat_id, None) is not None
+
+    def records(self):
+        """Неразобранные записи: (chat_id, запись, время сохранения)"""
+        for chat_id, (offset, length, saved_at) in self._index.items():
+            yield chat_id, self._map[offset:offset + length], saved_at
+
+    def close(self):
+        self._index.clear()
+        self._map.close()
+
+    def __contains__(self, chat_id):
+        return chat_id in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+
+def open_snapshot(path):
+    """Открыть снимок и удалить его файл; None если снимка нет
+
+    SnapshotError - файл поврежден (он тоже удаляется, чтобы не мешать запуску).
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        if os.path.getsize(path) == 0:
+            raise SnapshotError("file is empty")
+        return Snapshot(path)
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def write_snapshot(path, store, idle_ttl):
+    """Записать историю чатов из памяти и еще не разобранные чаты прежнего снимка
+
+    Файл пишется рядом и подменяется атомарно. Чаты, простаивающие дольше
+    idle_ttl, в снимок не попадают. Возвращает число записанных чатов.
+    """
+    now = time.time()
+    tmp_path = path + ".tmp"
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    index = []
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, 0))
+        offset = HEADER.size
+
+        def add(chat_id, record, saved_at):
+            nonlocal offset
+            f.write(record)
+            index.append((chat_id, offset, len(record), saved_at))
+            offset += len(record)
+
+        for chat_id in store.chat_ids():
+            state = store.export_chat(chat_id)
+            if state["idle"] < idle_ttl:
+                add(chat_id, encode_chat(state), now - state["idle"])
+        if store.snapshot is not None:
+            for chat_id, record, saved_at in store.snapshot.records():
+                if now - saved_at < idle_ttl and chat_id not in store:
+                    add(chat_id, record, saved_at)
+
+        index_offset = offset
+        for chat_id, record_offset, length, saved_at in index:
+            data = chat_id.encode("utf-8")
+            f.write(ID_LENGTH.pack(len(data)) + data + INDEX_ENTRY.pack(record_offset, length, saved_at))
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, len(index), index_offset))
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp_path, path)
+    return len(index)
+
+
+def restore_snapshot(store, path):
+    """Подключить к хранилищу снимок прошлого запуска; вернуть число чатов в нем"""
+    start_time = time.time()
+    try:
+        store.snapshot = open_snapshot(path)
+    except (OSError, SnapshotError) as e:
+        log_snapshot_error("load", str(e))
+        return 0
+    count = len(store.snapshot) if store.snapshot is not None else 0
+    log_snapshot("load", count, time.time() - start_time)
+    return count
+
+
+def save_snapshot(store, path, idle_ttl):
+    """Записать снимок при остановке; вернуть число чатов (None при ошибке)"""
+    start_time = time.time()
+    try:
+        count = write_snapshot(path, store, idle_ttl)
+    except OSError as e:
+        log_snapshot_error("save", str(e))
+        return None
+    log_snapshot("save", count, time.time() - start_time)
+    return count
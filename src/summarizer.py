@@ -0,0 +1,116 @@
+"""
+Сжатие длинных диалогов в краткое содержание
+
+Когда история чата превышает SUMMARY_TRIGGER_TOKENS, старые реплики
+(все, кроме SUMMARY_KEEP_TURNS последних) пересказываются дешевой моделью
+в фоне, вне обработки сообщения пользователя. Пересказ заменяет эти
+реплики в хранилище, и в промпт идут краткое содержание и свежие реплики.
+
+Краткое содержание хранится только в памяти: после перезапуска история
+подгружается с диска целиком и при необходимости сжимается заново.
+"""
+
+import asyncio
+import time
+from src.config import get_public_config
+from src.llm_client import get_llm_client, create_completion, classify_llm_error
+from src.logging_config import log_history_summary, log_llm_error
+from src.metrics import register_callback
+
+# Начало системного сообщения с кратким содержанием в промпте
+SUMMARY_PREFIX = "Краткое содержание предыдущей части диалога:\n"
+
+SUMMARY_INSTRUCTION = (
+    "Ты сжимаешь переписку консультанта компании по ИИ-разработке с клиентом. "
+    "Составь краткое содержание на русском языке: задача и потребности клиента, "
+    "названные факты (компания, сроки, бюджет, контакты), что уже предложено "
+    "и о чем договорились. Только факты, без оценок, не длиннее {words} слов."
+)
+
+ROLE_NAMES = {"user": "Клиент", "assistant": "Консультант"}
+
+# Фоновые сжатия: chat_id -> задача (не больше одной на чат)
+_summary_tasks = {}
+
+# Счетчики для мониторинга
+_summary_stats = {"runs": 0, "errors": 0, "turns_compacted": 0}
+
+
+def build_summary_request(config, previous_summary, turns):
+    """Запрос к модели сжатия: инструкция, прежнее содержание и старые реплики"""
+    transcript = "\n".join(f"{ROLE_NAMES.get(t.role, t.role)}: {t.content}" for t in turns)
+    if previous_summary:
+        transcript = f"{previous_summary}\n\nПродолжение диалога:\n{transcript}"
+
+    return {
+        "model": config["summary_model"],
+        "messages": [
+            {"role": "system", "content": SUMMARY_INSTRUCTION.format(words=config["summary_max_tokens"] // 2)},
+            {"role": "user", "content": transcript}
+        ],
+        "temperature": 0.2,
+        "max_tokens": config["summary_max_tokens"]
+    }
+
+
+def schedule_summary(store, chat_id):
+    """Запустить фоновое сжатие истории чата, если она выросла выше порога"""
+    config = get_public_config()
+    if not config["summary_enabled"] or chat_id in _summary_tasks:
+        return None
+    if store.get_tokens(chat_id) <= config["summary_trigger_tokens"]:
+        return None
+
+    task = asyncio.create_task(summarize_chat(store, chat_id))
+    _summary_tasks[chat_id] = task
+    task.add_done_callback(lambda _: _summary_tasks.pop(chat_id, None))
+    return task
+
+
+async def summarize_chat(store, chat_id):
+    """Пересказать старые реплики чата и заменить их кратким содержанием"""
+    config = get_public_config()
+    previous_summary, turns = store.get_compaction_input(chat_id, config["summary_keep_turns"])
+    if not turns:
+        return 0
+
+    # Берем текст без префикса, чтобы он не накапливался при повторных сжатиях
+    if previous_summary is not None:
+        previous_summary = previous_summary[len(SUMMARY_PREFIX):]
+
+    tokens_before = store.get_tokens(chat_id)
+    start_time = time.time()
+    _summary_stats["runs"] += 1
+    try:
+        request = build_summary_request(config, previous_summary, turns)
+        response = await create_completion(get_llm_client(), request, chat_id)
+        summary = (response.choices[0].message.content or "").strip()
+        if not summary:
+            raise ValueError("empty summary")
+    except Exception as e:
+        _summary_stats["errors"] += 1
+        error_type, _ = classify_llm_error(e)
+        log_llm_error(chat_id, f"summary_{error_type}", str(e))
+        return 0
+
+    removed = store.compact(chat_id, summary, turns, prefix=SUMMARY_PREFIX)
+    _summary_stats["turns_compacted"] += removed
+    log_history_summary(chat_id, removed, tokens_before, store.get_tokens(chat_id), time.time() - start_time)
+    return removed
+
+
+async def stop_summaries():
+    """Отменить незавершенные сжатия (при остановке бота)"""
+    tasks = list(_summary_tasks.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def get_summary_stats():
+    """Счетчики сжатия и число сжатий в работе"""
+    return dict(_summary_stats, running=len(_summary_tasks))
+
+
+register_callback("history_turns_compacted_total", "Реплики, замененные кратким содержанием",
+                  lambda: _summary_stats["turns_compacted"], "counter")
@@ -0,0 +1,40 @@
+"""
+Оценка количества токенов
+
+Без токенизатора: считаем по длине текста с запасом (для русского текста
+у моделей OpenAI выходит 3-4 символа на токен, берем 3 - оценка сверху)
+"""
+
+# Символов на токен (меньше - осторожнее оценка)
+CHARS_PER_TOKEN = 3
+
+# Служебные токены на каждое сообщение (роль, разделители)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Пометка в конце обрезанного текста
+TRUNCATION_MARK = " …[сообщение обрезано]"
+
+
+def count_tokens(text):
+    """Оценить количество токенов в тексте"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def count_message_tokens(content):
+    """Оценить токены сообщения вместе со служебными"""
+    return count_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Обрезать текст до max_tokens по границе слова, пометив обрезку"""
+    if count_tokens(text) <= max_tokens:
+        return text
+
+    limit = max(max_tokens * CHARS_PER_TOKEN - len(TRUNCATION_MARK), 0)
+    cut = text[:limit]
+
+    # Не рвем слово, если пробел недалеко от границы
+    space = cut.rfind(" ", int(limit * 0.8))
+    if space > 0:
+        cut = cut[:space]
+    return cut.rstrip() + TRUNCATION_MARK
@@ -0,0 +1,332 @@
+"""
+Трассировка обработки обновлений и профилирование по запросу
+
+Трасса - одно обновление Telegram: trace_id, update_id, chat_id и участки
+(span) с началом и длительностью: ожидание в очереди, история, сборка
+промпта, вызов LLM и каждая его попытка, отправка в Telegram. Текущая
+трасса хранится в contextvars, поэтому задачи, запущенные из обработчика
+(страховочные запросы, общий вызов single-flight), пишут участки в нее же.
+Вне трассы span() ничего не делает.
+
+Завершенная трасса:
+- пишется в лог (TRACE | ...), если она дольше TRACE_SLOW_THRESHOLD,
+  а из остальных - доля TRACE_SAMPLE_RATE;
+- попадает в кольцевой буфер последних TRACE_BUFFER_SIZE трасс, который
+  сервер метрик отдает по GET /traces в формате Chrome Trace Event
+  (открывается в https://ui.perfetto.dev или chrome://tracing).
+
+Профилирование включается на окно командой /profile (только из чатов
+ADMIN_CHAT_IDS) или сигналом SIGUSR1 и пишет в PROFILE_DIR:
+- cpu_<время>_<pid>.folded - стеки event loop, снятые каждые
+  PROFILE_INTERVAL секунд (формат flamegraph.pl и speedscope);
+- memory_<время>_<pid>.txt - где выросла память за окно (tracemalloc);
+- memory_<время>_<pid>.snapshot - снимок tracemalloc для tracemalloc.Snapshot.load.
+"""
+
+import asyncio
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from aiohttp import web
+from src.config import get_public_config
+from src.logging_config import log_trace, log_profile, log_profile_error
+from src.metrics import register_page
+
+# Сколько кадров стека хранит tracemalloc для каждого выделения памяти
+TRACEMALLOC_FRAMES = 10
+
+# Сколько строк в отчете о памяти
+MEMORY_TOP_LINES = 50
+
+# Трасса обновления, которое сейчас обрабатывается (None - вне трассы)
+_current_trace = ContextVar("trace", default=None)
+
+# Последние завершенные трассы
+_traces = deque(maxlen=1000)
+
+# Счетчики для мониторинга
+_trace_stats = {"traces": 0, "logged": 0}
+
+# Текущее окно профилирования
+_profiler = None
+_profile_timer = None
+_profile_on_done = None
+
+
+class Trace:
+    """Трасса одного обновления: участки - (имя, начало от старта трассы, длительность, атрибуты)"""
+
+    __slots__ = ("trace_id", "update_id", "chat_id", "started_at", "start", "duration", "spans")
+
+    def __init__(self, update_id=None, chat_id=None):
+        self.trace_id = uuid.uuid4().hex
+        self.update_id = update_id
+        self.chat_id = chat_id
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.duration = None
+        self.spans = []
+
+
+def get_current_trace():
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name, **attrs):
+    """Замерить участок обработки текущего обновления (вне трассы ничего не делает)"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        attrs["error"] = type(e).__name__
+        raise
+    finally:
+        trace.spans.append((name, start - trace.start, time.perf_counter() - start, attrs))
+
+
+def record_span(name, duration, **attrs):
+    """Добавить участок, который уже замерен и заканчивается сейчас"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.spans.append((name, time.perf_counter() - duration - trace.start, duration, attrs))
+
+
+def finish_trace(trace):
+    """Закрыть трассу: в буфер последних трасс, медленные и выборка - в лог"""
+    global _traces
+    trace.duration = time.perf_counter() - trace.start
+    config = get_public_config()
+    if _traces.maxlen != config["trace_buffer_size"]:
+        _traces = deque(_traces, maxlen=config["trace_buffer_size"])
+    _traces.append(trace)
+    _trace_stats["traces"] += 1
+
+    if trace.duration >= config["trace_slow_threshold"] or random.random() < config["trace_sample_rate"]:
+        _trace_stats["logged"] += 1
+        log_trace(trace.trace_id, trace.update_id, trace.chat_id, trace.duration,
+                  [(name, duration) for name, _, duration, _ in trace.spans])
+
+
+async def trace_middleware(handler, event, data):
+    """Внешний middleware диспетчера: обработка каждого обновления - одна трасса"""
+    if not get_public_config()["trace_enabled"]:
+        return await handler(event, data)
+
+    chat = data.get("event_chat")
+    trace = Trace(event.update_id, str(chat.id) if chat is not None else None)
+    token = _current_trace.set(trace)
+    try:
+        return await handler(event, data)
+    finally:
+        _current_trace.reset(token)
+        finish_trace(trace)
+
+
+def get_traces(chat_id=None, min_duration=0.0, limit=None):
+    """Последние трассы (новые в конце) с отбором по чату и длительности"""
+    traces = [trace for trace in _traces
+              if (chat_id is None or trace.chat_id == chat_id) and trace.duration >= min_duration]
+    return traces[-limit:] if limit else traces
+
+
+def export_traces(traces):
+    """Трассы в формате Chrome Trace Event
+
+    Каждое обновление - своя строка (tid = update_id): событие "update" на всю
+    обработку и вложенные в него участки. Время - в микросекундах.
+    """
+    pid = os.getpid()
+    events = []
+    for trace in traces:
+        base = trace.started_at * 1e6
+        tid = trace.update_id or 0
+        events.append({
+            "name": "update", "cat": "update", "ph": "X", "pid": pid, "tid": tid,
+            "ts": round(base), "dur": round(trace.duration * 1e6),
+            "args": {"trace_id": trace.trace_id, "update_id": trace.update_id, "chat_id": trace.chat_id}
+        })
+        for name, offset, duration, attrs in trace.spans:
+            events.append({
+                "name": name, "cat": "span", "ph": "X", "pid": pid, "tid": tid,
+                "ts": round(base + offset * 1e6), "dur": round(duration * 1e6),
+                "args": dict(attrs, trace_id=trace.trace_id)
+            })
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+async def handle_traces(request):
+    """GET /traces?chat_id=...&min_duration=<сек>&limit=<число>"""
+    try:
+        min_duration = float(request.query.get("min_duration", 0))
+        limit = int(request.query.get("limit", 0))
+    except ValueError:
+        raise web.HTTPBadRequest(text="min_duration and limit must be numbers")
+    traces = get_traces(request.query.get("chat_id"), min_duration, limit)
+    return web.json_response(export_traces(traces))
+
+
+def get_trace_stats():
+    """Счетчики трасс и число трасс в буфере"""
+    return dict(_trace_stats, buffered=len(_traces))
+
+
+def clear_traces():
+    """Забыть трассы (для тестов)"""
+    _traces.clear()
+    for name in _trace_stats:
+        _trace_stats[name] = 0
+
+
+register_page("/traces", handle_traces)
+
+
+def format_stack(frame):
+    """Стек от корня к текущей функции в формате collapsed stacks: "a (file:line);b (...)" """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Profiler:
+    """Окно профилирования: поток, снимающий стек event loop, и tracemalloc
+
+    Стек снимается из другого потока (sys._current_frames), поэтому
+    профилировщик не замедляет сам event loop, в отличие от cProfile.
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.started_at = time.time()
+        self.samples = {}
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._owns_tracemalloc = False
+        self._baseline = None
+
+    def start(self):
+        # Если tracemalloc уже включен (PYTHONTRACEMALLOC), не выключаем его в конце
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self._owns_tracemalloc = True
+        self._baseline = tracemalloc.take_snapshot()
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                stack = format_stack(frame)
+                self.samples[stack] = self.samples.get(stack, 0) + 1
+
+    def stop(self, directory):
+        """Остановить и записать результаты в directory; вернуть пути файлов"""
+        self._stopped.set()
+        self._thread.join()
+        snapshot = tracemalloc.take_snapshot()
+        if self._owns_tracemalloc:
+            tracemalloc.stop()
+        snapshot = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+
+        os.makedirs(directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime(self.started_at))
+        prefix = os.path.join(directory, f"{{}}_{stamp}_{os.getpid()}")
+
+        cpu_path = prefix.format("cpu") + ".folded"
+        with open(cpu_path, "w", encoding="utf-8") as f:
+            for stack, count in sorted(self.samples.items(), key=lambda item: item[1], reverse=True):
+                f.write(f"{stack} {count}\n")
+
+        memory_path = prefix.format("memory") + ".txt"
+        with open(memory_path, "w", encoding="utf-8") as f:
+            window = time.time() - self.started_at
+            f.write(f"Окно {window:.1f}s, снимков стека: {sum(self.samples.values())}\n\n")
+            f.write("Рост памяти за окно:\n")
+            for stat in snapshot.compare_to(self._baseline, "lineno")[:MEMORY_TOP_LINES]:
+                f.write(f"{stat}\n")
+            f.write("\nБольше всего памяти сейчас:\n")
+            for stat in snapshot.statistics("lineno")[:MEMORY_TOP_LINES]:
+                f.write(f"{stat}\n")
+
+        snapshot_path = prefix.format("memory") + ".snapshot"
+        snapshot.dump(snapshot_path)
+        return [cpu_path, memory_path, snapshot_path]
+
+
+def is_profiling():
+    return _profiler is not None
+
+
+def start_profiling(duration=None, on_done=None):
+    """Начать окно профилирования (вызывать из event loop)
+
+    duration - длина окна в секундах (по умолчанию PROFILE_DURATION),
+    on_done(paths) - корутина, которой по окончании передаются файлы результатов.
+    Возвращает длину окна или None, если профилирование уже идет.
+    """
+    global _profiler, _profile_timer, _profile_on_done
+    if _profiler is not None:
+        return None
+
+    config = get_public_config()
+    duration = config["profile_duration"] if duration is None else duration
+    _profiler = Profiler(threading.get_ident(), config["profile_interval"])
+    _profiler.start()
+    _profile_on_done = on_done
+    _profile_timer = asyncio.get_running_loop().call_later(
+        duration, lambda: asyncio.ensure_future(stop_profiling()))
+    log_profile("start", duration)
+    return duration
+
+
+async def stop_profiling():
+    """Закончить окно профилирования и записать результаты (в отдельном потоке)
+
+    Возвращает пути файлов ([] при ошибке записи) или None, если профилирование не шло.
+    """
+    global _profiler, _profile_timer, _profile_on_done
+    if _profiler is None:
+        return None
+    profiler, on_done = _profiler, _profile_on_done
+    _profiler = _profile_on_done = None
+    _profile_timer.cancel()
+    _profile_timer = None
+
+    try:
+        paths = await asyncio.to_thread(profiler.stop, get_public_config()["profile_dir"])
+    except OSError as e:
+        log_profile_error(str(e))
+        paths = []
+    else:
+        log_profile("stop", files=paths)
+
+    if on_done is not None:
+        try:
+            await on_done(paths)
+        except Exception as e:
+            log_profile_error(str(e))
+    return paths
+
+
+def toggle_profiling():
+    """SIGUSR1: начать окно профилирования или досрочно закончить текущее"""
+    if _profiler is None:
+        start_profiling()
+    else:
+        asyncio.ensure_future(stop_profiling())
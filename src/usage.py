@@ -0,0 +1,223 @@
+"""
+Учет расхода токенов по чатам и дневные бюджеты
+
+Каждый вызов LLM сообщает, сколько токенов ушло на промпт и ответ и
+сколько промпта прочитано из кеша провайдера (response.usage). Расход
+копится в памяти двумя способами:
+- за текущие сутки (UTC) по чату - для бюджета;
+- за окно USAGE_FLUSH_INTERVAL по паре (чат, модель) - для отчета.
+
+Окно периодически сбрасывается в USAGE_LOG_PATH (JSON Lines, строка на
+пару чат/модель) и в лог - сводкой с самыми затратными чатами.
+
+Бюджет: когда чат израсходовал TOKEN_BUDGET_DOWNSHIFT от
+CHAT_DAILY_TOKEN_BUDGET, длина его ответов ограничивается
+TOKEN_BUDGET_MAX_TOKENS; после исчерпания бюджета запросы чата идут
+к дешевой TOKEN_BUDGET_MODEL. Расход за сутки хранится только в памяти
+и обнуляется при перезапуске.
+"""
+
+import asyncio
+import json
+import os
+import time
+from src.config import get_public_config
+from src.logging_config import log_token_usage, log_token_budget, log_usage_error
+from src.metrics import register_callback
+
+SECONDS_PER_DAY = 86400
+
+# Уровни бюджета чата
+BUDGET_OK = "ok"
+BUDGET_REDUCED = "reduced"
+BUDGET_EXHAUSTED = "exhausted"
+
+# Сколько самых затратных чатов показывать в сводке
+TOP_CHATS = 5
+
+
+class ChatUsage:
+    """Расход чата за сутки и последний примененный уровень бюджета"""
+
+    __slots__ = ("day", "tokens", "level")
+
+    def __init__(self, day):
+        self.day = day
+        self.tokens = 0
+        self.level = BUDGET_OK
+
+
+# chat_id -> расход за текущие сутки
+_daily = {}
+
+# (chat_id, model) -> [prompt, completion, cached, calls] за текущее окно
+_window = {}
+_window_start = time.time()
+
+# Задача периодического сброса окна
+_flush_task = None
+
+# Счетчики для мониторинга
+_usage_stats = {"calls": 0, "prompt": 0, "completion": 0, "cached": 0, "downshifts": 0}
+
+
+def get_day(now):
+    return int(now // SECONDS_PER_DAY)
+
+
+def record_usage(chat_id, model, prompt_tokens, completion_tokens, cached_tokens=0):
+    """Учесть токены одного вызова LLM"""
+    row = _window.get((chat_id, model))
+    if row is None:
+        row = _window[(chat_id, model)] = [0, 0, 0, 0]
+    row[0] += prompt_tokens
+    row[1] += completion_tokens
+    row[2] += cached_tokens
+    row[3] += 1
+
+    _usage_stats["calls"] += 1
+    _usage_stats["prompt"] += prompt_tokens
+    _usage_stats["completion"] += completion_tokens
+    _usage_stats["cached"] += cached_tokens
+
+    day = get_day(time.time())
+    usage = _daily.get(chat_id)
+    if usage is None or usage.day != day:
+        usage = _daily[chat_id] = ChatUsage(day)
+    usage.tokens += prompt_tokens + completion_tokens
+
+
+def get_chat_tokens(chat_id):
+    """Токены (промпт + ответ), потраченные чатом за текущие сутки"""
+    usage = _daily.get(chat_id)
+    if usage is None or usage.day != get_day(time.time()):
+        return 0
+    return usage.tokens
+
+
+def get_budget_level(chat_id, config):
+    """Уровень бюджета чата: ok, reduced (близко к лимиту) или exhausted"""
+    if not config["token_budget_enabled"]:
+        return BUDGET_OK
+    used = get_chat_tokens(chat_id)
+    budget = config["chat_daily_token_budget"]
+    if used >= budget:
+        return BUDGET_EXHAUSTED
+    if used >= budget * config["token_budget_downshift"]:
+        return BUDGET_REDUCED
+    return BUDGET_OK
+
+
+def apply_chat_budget(chat_id, request, config):
+    """Ограничить запрос чата по его бюджету (меняет request); вернуть уровень"""
+    level = get_budget_level(chat_id, config)
+    if level != BUDGET_OK:
+        request["max_tokens"] = min(request["max_tokens"], config["token_budget_max_tokens"])
+    if level == BUDGET_EXHAUSTED and config["token_budget_model"]:
+        request["model"] = config["token_budget_model"]
+
+    # Переход на новый уровень логируем один раз
+    usage = _daily.get(chat_id)
+    if usage is not None and usage.level != level:
+        usage.level = level
+        if level != BUDGET_OK:
+            _usage_stats["downshifts"] += 1
+            log_token_budget(chat_id, level, usage.tokens, config["chat_daily_token_budget"])
+    return level
+
+
+def take_usage_window():
+    """Забрать накопленное окно строками отчета и начать новое окно"""
+    global _window, _window_start
+    window, start = _window, _window_start
+    _window, _window_start = {}, time.time()
+
+    # Заодно забываем расход за прошлые сутки
+    day = get_day(_window_start)
+    for chat_id in [chat_id for chat_id, usage in _daily.items() if usage.day != day]:
+        del _daily[chat_id]
+
+    rows = [
+        {
+            "window_start": round(start, 3), "window_end": round(_window_start, 3),
+            "chat_id": chat_id, "model": model,
+            "prompt_tokens": prompt, "completion_tokens": completion, "cached_tokens": cached, "calls": calls
+        }
+        for (chat_id, model), (prompt, completion, cached, calls) in window.items()
+    ]
+    return rows
+
+
+def write_usage_rows(path, rows):
+    """Дописать строки отчета в файл JSON Lines"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.writelines(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+
+
+async def flush_usage(path):
+    """Сбросить окно расхода в лог и в файл (запись файла - в отдельном потоке)"""
+    rows = take_usage_window()
+    if not rows:
+        return 0
+
+    per_chat = {}
+    for row in rows:
+        per_chat[row["chat_id"]] = per_chat.get(row["chat_id"], 0) + row["prompt_tokens"] + row["completion_tokens"]
+    top = sorted(per_chat.items(), key=lambda item: item[1], reverse=True)[:TOP_CHATS]
+    log_token_usage(
+        rows[0]["window_end"] - rows[0]["window_start"], len(per_chat),
+        sum(row["prompt_tokens"] for row in rows), sum(row["completion_tokens"] for row in rows),
+        sum(row["cached_tokens"] for row in rows), top
+    )
+
+    if path:
+        try:
+            await asyncio.to_thread(write_usage_rows, path, rows)
+        except OSError as e:
+            log_usage_error(str(e))
+    return len(rows)
+
+
+async def run_usage_flusher(path):
+    """Сбрасывать окно расхода каждые USAGE_FLUSH_INTERVAL секунд"""
+    while True:
+        await asyncio.sleep(get_public_config()["usage_flush_interval"])
+        await flush_usage(path)
+
+
+def start_usage_flusher(path):
+    """Запустить периодический сброс расхода (при старте бота)"""
+    global _flush_task
+    _flush_task = asyncio.create_task(run_usage_flusher(path))
+
+
+async def stop_usage_flusher(path):
+    """Остановить периодический сброс и сбросить остаток окна"""
+    global _flush_task
+    if _flush_task is not None:
+        _flush_task.cancel()
+        await asyncio.gather(_flush_task, return_exceptions=True)
+        _flush_task = None
+    await flush_usage(path)
+
+
+def get_usage_stats():
+    """Счетчики расхода токенов и число чатов с расходом за сутки"""
+    return dict(_usage_stats, chats_today=len(_daily))
+
+
+def clear_usage():
+    """Забыть накопленный расход (для тестов)"""
+    global _window_start
+    _daily.clear()
+    _window.clear()
+    _window_start = time.time()
+    for name in _usage_stats:
+        _usage_stats[name] = 0
+
+
+register_callback("llm_budget_downshifts_total", "Переходы чатов на сокращенные ответы или дешевую модель",
+                  lambda: _usage_stats["downshifts"], "counter")
@@ -0,0 +1,158 @@
+"""
+Прием обновлений Telegram через webhook
+
+aiohttp сервер принимает обновление, проверяет секретный токен, сразу
+отвечает 200 и передает обработку ограниченному пулу воркеров
+"""
+
+import asyncio
+import hmac
+import signal
+from functools import partial
+from aiohttp import web
+from aiogram.types import Update
+from src.config import get_public_config
+from src.logging_config import log_webhook_start, log_update_error
+from src.metrics import register_callback
+
+# Заголовок, в котором Telegram передает secret_token из setWebhook
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# Ключи состояния приложения
+DISPATCHER_KEY = web.AppKey("dispatcher")
+BOT_KEY = web.AppKey("bot")
+SECRET_KEY = web.AppKey("secret", str)
+PROCESS_UPDATE_KEY = web.AppKey("process_update")
+WORKER_COUNT_KEY = web.AppKey("worker_count", int)
+QUEUE_KEY = web.AppKey("queue", asyncio.Queue)
+STATS_KEY = web.AppKey("stats", dict)
+WORKERS_KEY = web.AppKey("workers", list)
+
+
+async def handle_webhook_update(request):
+    """Принять обновление: проверить секрет и поставить в очередь"""
+    app = request.app
+    token = request.headers.get(SECRET_HEADER, "")
+    if not hmac.compare_digest(token, app[SECRET_KEY]):
+        return web.Response(status=403)
+
+    try:
+        data = await request.json()
+    except ValueError:
+        return web.Response(status=400)
+
+    try:
+        app[QUEUE_KEY].put_nowait(data)
+    except asyncio.QueueFull:
+        # Telegram повторит доставку позже - это и есть backpressure
+        app[STATS_KEY]["rejected"] += 1
+        return web.Response(status=503)
+
+    app[STATS_KEY]["received"] += 1
+    return web.Response()
+
+
+async def feed_raw_update(dp, bot, data):
+    """Разобрать обновление и передать диспетчеру"""
+    update = Update.model_validate(data, context={"bot": bot})
+    await dp.feed_update(bot, update)
+
+
+async def process_updates(app):
+    """Воркер: обрабатывать обновления из очереди (по умолчанию через диспетчер)"""
+    queue = app[QUEUE_KEY]
+    process_update = app[PROCESS_UPDATE_KEY]
+
+    while True:
+        data = await queue.get()
+        try:
+            await process_update(data)
+            app[STATS_KEY]["processed"] += 1
+        except Exception as e:
+            app[STATS_KEY]["errors"] += 1
+            log_update_error(data.get("update_id"), str(e))
+        finally:
+            queue.task_done()
+
+
+async def start_workers(app):
+    """Запустить пул воркеров при старте сервера"""
+    app[WORKERS_KEY].extend(
+        asyncio.create_task(process_updates(app)) for _ in range(app[WORKER_COUNT_KEY])
+    )
+
+
+async def stop_workers(app):
+    """Дообработать очередь (не дольше shutdown_timeout) и остановить воркеры"""
+    try:
+        await asyncio.wait_for(app[QUEUE_KEY].join(), timeout=get_public_config()["shutdown_timeout"])
+    except asyncio.TimeoutError:
+        pass
+
+    for worker in app[WORKERS_KEY]:
+        worker.cancel()
+    await asyncio.gather(*app[WORKERS_KEY], return_exceptions=True)
+
+
+def create_webhook_app(dp, bot, secret, process_update=None):
+    """Создать aiohttp приложение для приема обновлений
+
+    process_update(data) - что делать с обновлением; по умолчанию оно
+    обрабатывается диспетчером в этом процессе (в режиме шардов -
+    передается процессу-воркеру, см. src/sharding.py).
+    """
+    config = get_public_config()
+
+    app = web.Application()
+    app[DISPATCHER_KEY] = dp
+    app[BOT_KEY] = bot
+    app[SECRET_KEY] = secret
+    app[PROCESS_UPDATE_KEY] = process_update or partial(feed_raw_update, dp, bot)
+    app[WORKER_COUNT_KEY] = config["webhook_workers"]
+    app[QUEUE_KEY] = asyncio.Queue(maxsize=config["webhook_queue_size"])
+    app[STATS_KEY] = {"received": 0, "processed": 0, "rejected": 0, "errors": 0}
+    app[WORKERS_KEY] = []
+
+    register_callback("webhook_queue_size", "Обновления в очереди webhook", app[QUEUE_KEY].qsize)
+    register_callback("webhook_rejected_total", "Обновления, отклоненные с 503",
+                      lambda: app[STATS_KEY]["rejected"], "counter")
+
+    app.router.add_post(config["webhook_path"], handle_webhook_update)
+    app.on_startup.append(start_workers)
+    app.on_cleanup.append(stop_workers)
+    return app
+
+
+async def run_webhook(dp, bot, webhook_url, secret, process_update=None):
+    """Запустить webhook сервер, зарегистрировать URL в Telegram и работать до остановки"""
+    config = get_public_config()
+    app = create_webhook_app(dp, bot, secret, process_update)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, config["webhook_host"], config["webhook_port"])
+    await site.start()
+
+    full_url = webhook_url.rstrip("/") + config["webhook_path"]
+    await dp.emit_startup(bot=bot)
+    await bot.set_webhook(
+        full_url,
+        secret_token=secret,
+        allowed_updates=dp.resolve_used_update_types()
+    )
+    log_webhook_start(full_url, config["webhook_workers"])
+
+    # SIGTERM / SIGINT - остановка: сервер перестает принимать обновления,
+    # очередь дообрабатывается в stop_workers
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stop_event.set)
+
+    try:
+        await stop_event.wait()
+    finally:
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.remove_signal_handler(signum)
+        await runner.cleanup()
+        await dp.emit_shutdown(bot=bot)
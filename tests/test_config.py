@@ -2,8 +2,11 @@
 Тесты для модуля конфигурации
 """
 
+import os
 import pytest
-from src.config import get_public_config
+from dataclasses import FrozenInstanceError
+import src.config
+from src.config import get_public_config, reload_config, add_reload_listener, load_env_file
 
 
 def test_get_public_config():
@@ -54,4 +57,82 @@ def test_config_constants():
     # Проверяем что константы не пустые
     assert MODEL_NAME.strip() != ""
     assert MAX_TOKENS > 0
-    assert MAX_HISTORY_LENGTH > 0
\ No newline at end of file
+    assert MAX_HISTORY_LENGTH > 0
+
+
+@pytest.fixture
+def restore_config():
+    yield
+    reload_config()
+
+
+def test_config_is_built_once_and_frozen(restore_config):
+    """Тест что настройки - один неизменяемый объект до перезагрузки"""
+    config = get_public_config()
+
+    assert get_public_config() is config
+    assert config.max_tokens == config["max_tokens"]
+    with pytest.raises(FrozenInstanceError):
+        config.max_tokens = 1
+    with pytest.raises(KeyError):
+        config["unknown"]
+
+
+def test_env_overrides(restore_config):
+    """Тест переопределения настроек переменными окружения"""
+    config, changed = reload_config({
+        "TEMPERATURE": "0.2",
+        "MAX_TOKENS": "500",
+        "STREAM_RESPONSES": "off",
+        "FALLBACK_MODELS": "a/model, b/model",
+        "LOG_SAMPLE_RATES": '{"QUEUE_WAIT": 0.1}'
+    })
+
+    assert get_public_config() is config
+    assert config.temperature == 0.2
+    assert config.max_tokens == 500
+    assert config.stream_responses is False
+    assert config.fallback_models == ("a/model", "b/model")
+    assert config.log_sample_rates == {"QUEUE_WAIT": 0.1}
+    assert set(changed) >= {"temperature", "max_tokens", "stream_responses"}
+
+
+def test_invalid_reload_keeps_previous(restore_config):
+    """Тест что неверные значения отклоняются, а действуют прежние настройки"""
+    previous = get_public_config()
+
+    for environ in ({"TEMPERATURE": "5"}, {"MAX_TOKENS": "много"}, {"BOT_MODE": "push"}):
+        with pytest.raises(ValueError):
+            reload_config(environ)
+
+    assert get_public_config() is previous
+
+
+def test_reload_notifies_listeners(restore_config):
+    """Тест что после перезагрузки подписчики получают новые настройки"""
+    received = []
+    add_reload_listener(received.append)
+    try:
+        reload_config({"LLM_MAX_CONCURRENCY": "7"})
+    finally:
+        src.config._reload_listeners.remove(received.append)
+
+    assert received[0].llm_max_concurrency == 7
+
+
+def test_env_file_does_not_override_process_environment(tmp_path, monkeypatch):
+    """Тест что окружение процесса важнее .env и при перезагрузке, а правки .env применяются"""
+    env_file = tmp_path / ".env"
+    monkeypatch.setenv("TEMPERATURE", "0.1")
+    # Значение из .env ставится в обход monkeypatch - так оно будет убрано после теста
+    monkeypatch.setenv("MAX_TOKENS", "1")
+    monkeypatch.delenv("MAX_TOKENS")
+    monkeypatch.setattr(src.config, "_env_file_values", {})
+
+    env_file.write_text("TEMPERATURE=0.9\nMAX_TOKENS=500\n")
+    load_env_file(env_file)
+    env_file.write_text("TEMPERATURE=0.8\nMAX_TOKENS=600\n")
+    load_env_file(env_file)
+
+    assert os.environ["TEMPERATURE"] == "0.1"
+    assert os.environ["MAX_TOKENS"] == "600"
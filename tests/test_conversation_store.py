@@ -0,0 +1,144 @@
+"""
+Тесты для хранилища истории диалогов
+"""
+
+from unittest.mock import patch
+from src.conversation_store import ConversationStore
+
+
+def test_ring_buffer_keeps_last_messages():
+    """Тест кольцевого буфера: хранятся только последние max_messages реплик"""
+    store = ConversationStore(max_messages=3, max_chats=10, idle_ttl=3600)
+
+    for i in range(5):
+        store.append("chat", "user", f"msg{i}")
+
+    messages = store.get_messages("chat")
+    assert [m["content"] for m in messages] == ["msg2", "msg3", "msg4"]
+    assert messages[0] == {"role": "user", "content": "msg2"}
+
+
+def test_lru_eviction():
+    """Тест вытеснения давно не использованного чата при превышении лимита"""
+    store = ConversationStore(max_messages=4, max_chats=2, idle_ttl=3600)
+
+    store.append("a", "user", "1")
+    store.append("b", "user", "2")
+    store.get_messages("a")          # "a" теперь свежее "b"
+    store.append("c", "user", "3")
+
+    assert "a" in store
+    assert "b" not in store
+    assert "c" in store
+    assert store.evicted == 1
+
+
+def test_idle_ttl_eviction():
+    """Тест вытеснения чатов, простаивающих дольше idle_ttl"""
+    store = ConversationStore(max_messages=4, max_chats=10, idle_ttl=60)
+
+    with patch('src.conversation_store.time.monotonic', return_value=0):
+        store.append("old", "user", "1")
+    with patch('src.conversation_store.time.monotonic', return_value=100):
+        store.append("new", "user", "2")
+        store.evict_idle()
+
+    assert "old" not in store
+    assert "new" in store
+    assert store.evicted == 1
+
+
+def test_size_bytes_tracks_content():
+    """Тест учета памяти: растет при добавлении и возвращается при удалении"""
+    store = ConversationStore(max_messages=2, max_chats=10, idle_ttl=3600)
+    empty_size = store.size_bytes()
+
+    store.append("chat", "user", "x" * 1000)
+    with_message = store.size_bytes()
+    store.append("chat", "assistant", "y")
+    store.append("chat", "user", "z")      # вытесняет реплику из 1000 символов
+
+    assert with_message > empty_size + 1000
+    assert store.size_bytes() < with_message
+
+    store.delete("chat")
+    assert store.size_bytes() < with_message - 1000
+
+
+def test_dict_like_access():
+    """Тест dict-подобного доступа к хранилищу"""
+    store = ConversationStore(max_messages=4, max_chats=10, idle_ttl=3600)
+
+    store["chat"] = [{"role": "user", "content": "Привет"}]
+
+    assert "chat" in store
+    assert len(store) == 1
+    assert store["chat"] == [{"role": "user", "content": "Привет"}]
+
+    del store["chat"]
+    assert "chat" not in store
+    assert store.get_messages("chat") == []
+
+
+def test_get_messages_with_token_budget():
+    """Тест обрезки истории по бюджету токенов из сохраненных счетчиков"""
+    store = ConversationStore(max_messages=10, max_chats=10, idle_ttl=3600)
+    for i in range(5):
+        store.append("chat", "user", f"{i}" * 30)   # 10 + 4 служебных = 14 токенов
+
+    assert len(store.get_messages("chat", token_budget=28)) == 2
+    assert store.get_messages("chat", token_budget=28)[-1]["content"] == "4" * 30
+    assert len(store.get_messages("chat", token_budget=1000)) == 5
+    assert store.get_messages("chat", token_budget=0) == []
+
+
+def test_get_messages_trims_in_chunks():
+    """Тест что старые реплики отбрасываются пачками и начало истории стабильно"""
+    store = ConversationStore(max_messages=6, max_chats=10, idle_ttl=3600)
+    firsts = []
+    for i in range(12):
+        store.append("chat", "user", f"{i}" * 30)
+        messages = store.get_messages("chat", token_budget=1000, trim_chunk=4)
+        assert messages[-1]["content"] == f"{i}" * 30
+        firsts.append(messages[0]["content"][0])
+
+    # Буфер переполнен с 7-й реплики, но начало сдвигается раз в 4 реплики
+    assert firsts == ["0"] * 6 + ["4"] * 4 + ["8"] * 2
+    # Бюджет по-прежнему соблюдается, последняя реплика не отбрасывается ради выравнивания
+    assert store.get_messages("chat", token_budget=40, trim_chunk=4) == [{"role": "user", "content": "11" * 30}]
+
+
+def test_compact_replaces_old_turns_with_summary():
+    """Тест замены старых реплик кратким содержанием"""
+    store = ConversationStore(max_messages=10, max_chats=10, idle_ttl=3600)
+    for i in range(6):
+        store.append("chat", "user" if i % 2 == 0 else "assistant", f"Реплика {i} " + "текст " * 20)
+    tokens_before = store.get_tokens("chat")
+
+    summary, turns = store.get_compaction_input("chat", keep_turns=2)
+    assert summary is None
+    assert len(turns) == 4
+
+    # Пока шло сжатие, пришла новая реплика
+    store.append("chat", "user", "Новая реплика")
+    assert store.compact("chat", "Клиент интересуется ботом", turns, prefix="Содержание: ") == 4
+
+    messages = store.get_messages("chat")
+    assert messages[0] == {"role": "system", "content": "Содержание: Клиент интересуется ботом"}
+    assert [m["content"] for m in messages[1:]][-1] == "Новая реплика"
+    assert len(messages) == 4
+    assert store.get_tokens("chat") < tokens_before
+
+
+def test_compact_after_clear_is_ignored():
+    """Тест что содержание удаленного диалога не попадает в новый"""
+    store = ConversationStore(max_messages=10, max_chats=10, idle_ttl=3600)
+    for i in range(4):
+        store.append("chat", "user", f"Реплика {i}")
+    _, turns = store.get_compaction_input("chat", keep_turns=1)
+
+    store.delete("chat")
+    store.append("chat", "user", "Новый диалог")
+
+    assert store.compact("chat", "Старое содержание", turns) == 0
+    assert store.get_messages("chat") == [{"role": "user", "content": "Новый диалог"}]
@@ -2,13 +2,59 @@
 Тесты для обработчиков сообщений
 """
 
+import asyncio
 import pytest
 from unittest.mock import Mock, patch, AsyncMock
+from src.conversation_store import ConversationStore
+from src.scheduler import SchedulerOverloaded
 from src.handlers import (
     save_to_history, get_conversation_history, chat_conversations,
-    handle_start, handle_help, handle_clear, handle_stop, handle_message
+    handle_start, handle_help, handle_clear, handle_stop, handle_message,
+    send_streaming_response, find_split_point, send_scheduler, get_merge_stats, TELEGRAM_MESSAGE_LIMIT, OVERLOAD_TEXT
 )
 
+# Конфигурация без потоковой отправки ответов и без объединения сообщений
+NO_STREAM_CONFIG = {
+    "stream_responses": False, "max_history_length": 20, "history_trim_chunk": 1, "message_debounce_window": 0
+}
+
+# Конфигурация потоковой отправки без пауз между правками
+STREAM_CONFIG = {
+    "stream_responses": True,
+    "stream_edit_interval": 0,
+    "stream_group_edit_interval": 0,
+    "stream_max_edit_interval": 0,
+    "max_history_length": 20,
+    "history_trim_chunk": 1,
+    "message_debounce_window": 0
+}
+
+
+@pytest.fixture(autouse=True)
+def reset_send_scheduler():
+    """Темп отправки одного тестового чата не переносится между тестами"""
+    send_scheduler.clear()
+    yield
+    send_scheduler.clear()
+
+
+async def fake_stream(*parts):
+    """Имитация потока фрагментов ответа LLM"""
+    for part in parts:
+        yield part
+
+
+def make_stream_message():
+    """Мок сообщения, у которого answer возвращает редактируемое сообщение"""
+    mock_message = Mock()
+    mock_message.chat.id = 12345
+    mock_message.chat.type = "private"
+    mock_message.text = "Тестовое сообщение"
+    sent = Mock()
+    sent.edit_text = AsyncMock()
+    mock_message.answer = AsyncMock(return_value=sent)
+    return mock_message, sent
+
 
 def test_save_to_history_new_chat():
     """Тест сохранения истории для нового чата"""
@@ -45,25 +91,24 @@ def test_save_to_history_existing_chat():
     assert chat_conversations[chat_id][3]["content"] == "Ответ2"
 
 
-@patch('src.handlers.get_public_config')
-def test_save_to_history_limit(mock_config):
+def test_save_to_history_limit():
     """Тест ограничения длины истории"""
-    chat_conversations.clear()
-    mock_config.return_value = {"max_history_length": 4}
+    store = ConversationStore(max_messages=4, max_chats=100, idle_ttl=3600)
     
     chat_id = "test_chat_limit"
     
-    # Добавляем больше сообщений чем лимит
-    save_to_history(chat_id, "Msg1", "Resp1")  # 2 записи
-    save_to_history(chat_id, "Msg2", "Resp2")  # 4 записи (лимит)
-    save_to_history(chat_id, "Msg3", "Resp3")  # должно обрезать до 4
+    with patch('src.handlers.chat_conversations', store):
+        # Добавляем больше сообщений чем лимит
+        save_to_history(chat_id, "Msg1", "Resp1")  # 2 записи
+        save_to_history(chat_id, "Msg2", "Resp2")  # 4 записи (лимит)
+        save_to_history(chat_id, "Msg3", "Resp3")  # должно обрезать до 4
     
-    assert len(chat_conversations[chat_id]) == 4
+    assert len(store[chat_id]) == 4
     # Проверяем что старые сообщения удалились, остались последние 4
-    assert chat_conversations[chat_id][0]["content"] == "Msg2"
-    assert chat_conversations[chat_id][1]["content"] == "Resp2" 
-    assert chat_conversations[chat_id][2]["content"] == "Msg3"
-    assert chat_conversations[chat_id][3]["content"] == "Resp3"
+    assert store[chat_id][0]["content"] == "Msg2"
+    assert store[chat_id][1]["content"] == "Resp2" 
+    assert store[chat_id][2]["content"] == "Msg3"
+    assert store[chat_id][3]["content"] == "Resp3"
 
 
 def test_get_conversation_history_exists():
@@ -200,9 +245,10 @@ async def test_handle_stop(mock_log):
 
 
 @pytest.mark.asyncio
+@patch('src.handlers.get_public_config', return_value=NO_STREAM_CONFIG)
 @patch('src.handlers.send_to_llm')
 @patch('src.handlers.get_conversation_history')
-async def test_handle_message_success(mock_get_history, mock_send_llm):
+async def test_handle_message_success(mock_get_history, mock_send_llm, mock_config):
     """Тест успешной обработки сообщения"""
     chat_conversations.clear()
     
@@ -242,9 +288,10 @@ async def test_handle_message_no_text():
 
 
 @pytest.mark.asyncio
+@patch('src.handlers.get_public_config', return_value=NO_STREAM_CONFIG)
 @patch('src.handlers.send_to_llm')
 @patch('src.handlers.get_conversation_history')
-async def test_handle_message_llm_error(mock_get_history, mock_send_llm):
+async def test_handle_message_llm_error(mock_get_history, mock_send_llm, mock_config):
     """Тест обработки ошибки LLM"""
     chat_conversations.clear()
     
@@ -278,4 +325,216 @@ async def test_handle_start_no_username():
         
         # Проверяем что username = None обрабатывается корректно
         mock_log.assert_called_once_with("12345", "/start", None)
-        mock_message.answer.assert_called_once()
\ No newline at end of file
+        mock_message.answer.assert_called_once()
+
+
+@pytest.mark.asyncio
+@patch('src.handlers.log_llm_response')
+@patch('src.handlers.get_public_config', return_value=STREAM_CONFIG)
+@patch('src.handlers.stream_llm')
+async def test_handle_message_streaming(mock_stream_llm, mock_config, mock_log_response):
+    """Тест потоковой отправки: плейсхолдер, правки и сохранение финального текста"""
+    chat_conversations.clear()
+    mock_stream_llm.return_value = fake_stream("Ответ ", "по ", "частям")
+    mock_message, sent = make_stream_message()
+    
+    await handle_message(mock_message)
+    
+    # Отправлено одно сообщение-плейсхолдер, дальше только правки
+    mock_message.answer.assert_called_once()
+    assert sent.edit_text.call_args[0][0] == "Ответ по частям"
+    
+    # В историю попал только финальный текст
+    assert chat_conversations["12345"][1]["content"] == "Ответ по частям"
+    
+    # Время до первого видимого фрагмента залогировано
+    assert mock_log_response.call_args[0][3] is not None
+
+
+@pytest.mark.asyncio
+@patch('src.handlers.log_llm_response')
+@patch('src.handlers.get_public_config', return_value=STREAM_CONFIG)
+async def test_send_streaming_response_long_text(mock_config, mock_log_response):
+    """Тест продолжения ответа в новом сообщении после 4096 символов"""
+    mock_message, sent = make_stream_message()
+    long_text = "слово " * 1000
+    
+    result = await send_streaming_response(mock_message, fake_stream(long_text[:3000], long_text[3000:]))
+    
+    assert result == long_text
+    # Плейсхолдер + продолжение
+    assert mock_message.answer.call_count == 2
+    for call in sent.edit_text.call_args_list:
+        assert len(call[0][0]) <= TELEGRAM_MESSAGE_LIMIT
+
+
+@pytest.mark.asyncio
+@patch('src.handlers.log_llm_response')
+@patch('src.handlers.get_public_config', return_value=STREAM_CONFIG)
+async def test_send_streaming_response_empty(mock_config, mock_log_response):
+    """Тест пустого ответа LLM в потоковом режиме"""
+    mock_message, sent = make_stream_message()
+    
+    result = await send_streaming_response(mock_message, fake_stream())
+    
+    assert "Не удалось получить ответ" in result
+    sent.edit_text.assert_called_once_with(result)
+
+
+def test_find_split_point():
+    """Тест разбиения длинного текста по границе слова"""
+    text = "а" * 4000 + " " + "б" * 200
+    
+    assert find_split_point("короткий текст") == len("короткий текст")
+    assert find_split_point(text) == 4001
+    assert find_split_point("а" * 5000) == TELEGRAM_MESSAGE_LIMIT
+
+
+@pytest.mark.asyncio
+@patch('src.handlers.get_public_config', return_value=NO_STREAM_CONFIG)
+@patch('src.handlers.send_to_llm')
+async def test_handle_message_keeps_chat_order(mock_send_llm, mock_config):
+    """Тест что два быстрых сообщения чата не перемешивают историю"""
+    chat_conversations.clear()
+    
+    async def slow_llm(text, chat_id, history):
+        # Первое сообщение отвечается дольше второго
+        await asyncio.sleep(0.02 if text == "Первый" else 0)
+        return f"Ответ на {text.lower()}"
+    
+    mock_send_llm.side_effect = slow_llm
+    
+    def make_message(text):
+        message = Mock()
+        message.chat.id = 777
+        message.text = text
+        message.answer = AsyncMock()
+        return message
+    
+    await asyncio.gather(handle_message(make_message("Первый")), handle_message(make_message("Второй")))
+    
+    contents = [m["content"] for m in chat_conversations.get_messages("777")]
+    assert contents == ["Первый", "Ответ на первый", "Второй", "Ответ на второй"]
+    # Второе сообщение увидело историю первого
+    assert len(mock_send_llm.call_args_list[1][0][2]) == 2
+
+
+@pytest.mark.asyncio
+@patch('src.handlers.request_scheduler')
+async def test_handle_message_overload(mock_scheduler):
+    """Тест ответа при переполненной очереди"""
+    mock_scheduler.slot.side_effect = SchedulerOverloaded("queue_depth=1000")
+    mock_scheduler.waiting = 1000
+    
+    mock_message = Mock()
+    mock_message.chat.id = 12345
+    mock_message.text = "Тестовое сообщение"
+    mock_message.answer = AsyncMock()
+    
+    await handle_message(mock_message)
+    
+    mock_message.answer.assert_called_once_with(OVERLOAD_TEXT)
+
+
+@pytest.mark.asyncio
+@patch('src.handlers.get_public_config', return_value=dict(NO_STREAM_CONFIG, message_debounce_window=0.02))
+@patch('src.handlers.send_to_llm')
+async def test_rapid_messages_are_merged(mock_send_llm, mock_config):
+    """Тест что сообщения подряд и сообщения во время ответа уходят в LLM одной репликой"""
+    chat_conversations.clear()
+    merged_before = get_merge_stats()["merged"]
+    
+    async def slow_llm(text, chat_id, history):
+        await asyncio.sleep(0.05 if text.startswith("Привет") else 0)
+        return "Ответ"
+    
+    mock_send_llm.side_effect = slow_llm
+    
+    def make_message(text):
+        message = Mock()
+        message.chat.id = 888
+        message.text = text
+        message.answer = AsyncMock()
+        return message
+    
+    async def send_later(text, delay):
+        await asyncio.sleep(delay)
+        await handle_message(make_message(text))
+    
+    await asyncio.gather(
+        handle_message(make_message("Привет")),
+        send_later("хочу бота", 0.005),
+        # Пока генерируется ответ на первую реплику
+        send_later("для магазина", 0.04),
+        send_later("с оплатой", 0.045)
+    )
+    
+    assert [c[0][0] for c in mock_send_llm.call_args_list] == ["Привет\nхочу бота", "для магазина\nс оплатой"]
+    assert get_merge_stats()["merged"] - merged_before == 2
+    assert get_merge_stats()["pending"] == 0
+    contents = [m["content"] for m in chat_conversations.get_messages("888")]
+    assert contents == ["Привет\nхочу бота", "Ответ", "для магазина\nс оплатой", "Ответ"]
+
+
+@pytest.mark.asyncio
+@patch('src.handlers.get_public_config', return_value=NO_STREAM_CONFIG)
+@patch('src.handlers.send_to_llm')
+async def test_messages_merge_only_while_reply_is_running(mock_send_llm, mock_config):
+    """Тест что без окна ожидания одиночное сообщение идет сразу, а пришедшие во время ответа - вместе"""
+    chat_conversations.clear()
+    calls = []
+    
+    async def slow_llm(text, chat_id, history):
+        calls.append(text)
+        await asyncio.sleep(0.05 if len(calls) == 1 else 0)
+        return "Ответ"
+    
+    mock_send_llm.side_effect = slow_llm
+    
+    def make_message(text):
+        message = Mock()
+        message.chat.id = 889
+        message.text = text
+        message.answer = AsyncMock()
+        return message
+    
+    async def send_later(text, delay):
+        await asyncio.sleep(delay)
+        await handle_message(make_message(text))
+    
+    first = asyncio.ensure_future(handle_message(make_message("Привет")))
+    await asyncio.sleep(0)
+    # Одиночное сообщение не ждет окна: LLM вызвана сразу
+    assert calls == ["Привет"]
+    await asyncio.gather(first, send_later("хочу бота", 0.01), send_later("для магазина", 0.02))
+    
+    assert calls == ["Привет", "хочу бота\nдля магазина"]
+    assert get_merge_stats()["pending"] == 0
+
+
+@pytest.mark.asyncio
+@patch('src.handlers.get_public_config', return_value=NO_STREAM_CONFIG)
+@patch('src.handlers.send_to_llm')
+@patch('src.handlers.find_direct_answer', return_value="Готовый ответ из базы знаний")
+async def test_handle_message_answers_from_knowledge(mock_answer, mock_send_llm, mock_config):
+    """Тест что на вопрос из базы готовых ответов бот отвечает без вызова LLM"""
+    chat_conversations.clear()
+    
+    mock_message = Mock()
+    mock_message.chat.id = 12345
+    mock_message.text = "Сколько стоит чат-бот?"
+    mock_message.answer = AsyncMock()
+    
+    await handle_message(mock_message)
+    
+    mock_send_llm.assert_not_called()
+    mock_message.answer.assert_called_once_with("Готовый ответ из базы знаний")
+    assert chat_conversations.get_messages("12345")[1]["content"] == "Готовый ответ из базы знаний"
+    
+    # Посреди диалога вопрос зависит от контекста - отвечает LLM
+    mock_send_llm.return_value = "Ответ с учетом диалога"
+    mock_message.answer.reset_mock()
+    await handle_message(mock_message)
+    
+    mock_send_llm.assert_called_once()
+    mock_message.answer.assert_called_once_with("Ответ с учетом диалога")
@@ -2,9 +2,41 @@
 Тесты для LLM клиента
 """
 
+import asyncio
 import pytest
-from unittest.mock import Mock, patch, mock_open
-from src.llm_client import load_system_prompt, build_prompt, get_llm_client, send_to_llm
+from unittest.mock import Mock, AsyncMock, patch, mock_open, ANY
+import src.llm_client
+from src.llm_client import (
+    load_system_prompt, build_prompt, get_llm_client, send_to_llm,
+    init_llm_client, warmup_llm_client, close_llm_client, stream_llm,
+    get_system_prompt
+)
+from src.response_cache import clear_response_cache, get_cache_stats
+from src.singleflight import clear_singleflight, get_singleflight_stats
+from src.rate_limiter import reset_rate_limiters, get_rate_limiter_stats
+from src.metrics import LLM_TOKENS_TOTAL, LLM_ERRORS_TOTAL, LLM_REQUESTS_TOTAL, LLM_RESPONSE_SECONDS
+from src.config import get_public_config
+from openai.types import CompletionUsage
+from src.tokens import truncate_to_tokens, TRUNCATION_MARK
+
+
+# Настройки, нужные для загрузки системного промпта при замоканном get_public_config (бюджеты чатов выключены)
+PROMPT_CONFIG = {"system_prompt_file": "src/system_prompt.md", "prompt_check_interval": 1.0,
+                 "token_budget_enabled": False}
+
+
+@pytest.fixture(autouse=True)
+def reset_llm_client():
+    """Сбрасываем общий клиент между тестами"""
+    src.llm_client._llm_client = None
+    src.llm_client._http_client = None
+    src.llm_client._prompt_cache = None
+    clear_response_cache()
+    reset_rate_limiters()
+    yield
+    src.llm_client._llm_client = None
+    src.llm_client._http_client = None
+    src.llm_client._prompt_cache = None
 
 
 def test_load_system_prompt_success():
@@ -58,18 +90,144 @@ def test_build_prompt_with_history():
         assert result[3]["content"] == test_message
 
 
+def test_build_prompt_keeps_chat_prefix_stable():
+    """Тест что начало промпта чата совпадает с прошлым, пока история только растет"""
+    first_history = [{"role": "user", "content": "Привет!"}, {"role": "assistant", "content": "Здравствуйте!"}]
+    second_history = first_history + [{"role": "user", "content": "Как дела?"}, {"role": "assistant", "content": "Хорошо"}]
+    
+    with patch('src.llm_client.load_system_prompt', return_value="Системный промпт"):
+        first = build_prompt("chat", "Как дела?", first_history)
+        second = build_prompt("chat", "Что умеете?", second_history)
+    
+    assert second[:3] == first[:3]
+    assert second[0] is first[0]
+    assert second[3:5] == second_history[2:]
+
+
+def test_build_prompt_marks_cache_control():
+    """Тест меток кеша промпта для моделей, которым они нужны"""
+    history = [{"role": "user", "content": "Привет!"}, {"role": "assistant", "content": "Здравствуйте!"}]
+    config = dict(get_public_config(), model_name="anthropic/claude-3.5-haiku")
+    
+    with patch('src.llm_client.load_system_prompt', return_value="Системный промпт"), \
+         patch('src.llm_client.get_public_config', return_value=config):
+        result = build_prompt("chat", "Как дела?", history)
+    
+    assert result[0]["content"][0] == {"type": "text", "text": "Системный промпт", "cache_control": {"type": "ephemeral"}}
+    assert result[1] == history[0]
+    assert result[2]["content"][0]["cache_control"] == {"type": "ephemeral"}
+    assert result[3] == {"role": "user", "content": "Как дела?"}
+    # Сохраненная история остается без меток
+    assert history[1] == {"role": "assistant", "content": "Здравствуйте!"}
+
+
+def test_get_system_prompt_cached():
+    """Тест что промпт читается с диска один раз, пока файл не изменился"""
+    with patch('src.llm_client.load_system_prompt', return_value="Промпт") as mock_load:
+        first = get_system_prompt()
+        second = get_system_prompt()
+    
+    assert first is second
+    assert first["message"] == {"role": "system", "content": "Промпт"}
+    assert len(first["hash"]) == 16
+    mock_load.assert_called_once()
+
+
+def test_get_system_prompt_reload_on_change(tmp_path):
+    """Тест горячей перезагрузки промпта при изменении файла"""
+    prompt_file = tmp_path / "prompt.md"
+    prompt_file.write_text("Старый промпт", encoding="utf-8")
+    config = {"system_prompt_file": str(prompt_file), "prompt_check_interval": 0}
+    
+    with patch('src.llm_client.get_public_config', return_value=config):
+        old = get_system_prompt()
+        prompt_file.write_text("Новый, более длинный промпт", encoding="utf-8")
+        new = get_system_prompt()
+    
+    assert old["text"] == "Старый промпт"
+    assert new["text"] == "Новый, более длинный промпт"
+    assert old["hash"] != new["hash"]
+
+
+def test_build_prompt_does_not_recount_history():
+    """Тест что build_prompt берет историю как есть: она уже обрезана хранилищем по сохраненным токенам"""
+    history = [{"role": "user", "content": "слово " * 1000} for _ in range(20)]
+    
+    with patch('src.llm_client.load_system_prompt', return_value="Системный промпт"):
+        get_system_prompt()
+        with patch('src.llm_client.count_message_tokens') as mock_count:
+            result = build_prompt("test_chat", "Вопрос", history)
+    
+    mock_count.assert_not_called()
+    assert result[1:-1] == history
+
+
+def test_truncate_long_user_message():
+    """Тест безопасной обрезки слишком длинного сообщения"""
+    text = "слово " * 5000
+    
+    result = truncate_to_tokens(text, 100)
+    
+    assert result.endswith(TRUNCATION_MARK)
+    assert len(result) <= 100 * 3
+    assert not result[:-len(TRUNCATION_MARK)].endswith("сло")
+    assert truncate_to_tokens("коротко", 100) == "коротко"
+
+
 @patch.dict('os.environ', {'OPENROUTER_API_KEY': 'test_key'})
-@patch('src.llm_client.OpenAI')
+@patch('src.llm_client.AsyncOpenAI')
 def test_get_llm_client_success(mock_openai):
     """Тест успешного создания LLM клиента"""
     result = get_llm_client()
     
     mock_openai.assert_called_once_with(
         base_url="https://openrouter.ai/api/v1",
-        api_key="test_key"
+        api_key="test_key",
+        http_client=ANY,
+        max_retries=0
     )
 
 
+@patch.dict('os.environ', {'OPENROUTER_API_KEY': 'test_key'})
+@patch('src.llm_client.AsyncOpenAI')
+def test_get_llm_client_reuses_instance(mock_openai):
+    """Тест что клиент создается один раз на процесс"""
+    first = get_llm_client()
+    second = get_llm_client()
+    
+    assert first is second
+    mock_openai.assert_called_once()
+
+
+@pytest.mark.asyncio
+@patch.dict('os.environ', {'OPENROUTER_API_KEY': 'test_key'})
+async def test_init_llm_client_pool_settings():
+    """Тест настроек пула соединений и закрытия клиента"""
+    init_llm_client(base_url="http://127.0.0.1:1/v1")
+    http_client = src.llm_client._http_client
+    
+    assert http_client.timeout.connect == 5.0
+    assert http_client.timeout.read == 60.0
+    
+    await close_llm_client()
+    assert http_client.is_closed
+    assert src.llm_client._llm_client is None
+
+
+@pytest.mark.asyncio
+@patch.dict('os.environ', {'OPENROUTER_API_KEY': 'test_key'})
+@patch('src.llm_client.log_llm_warmup')
+async def test_warmup_llm_client_failure(mock_log_warmup):
+    """Тест что ошибка прогрева не роняет запуск"""
+    init_llm_client(base_url="http://127.0.0.1:1/v1")
+    
+    result = await warmup_llm_client()
+    
+    assert result is False
+    assert mock_log_warmup.call_args.kwargs["success"] is False
+    await close_llm_client()
+
+
 @patch.dict('os.environ', {}, clear=True)
 def test_get_llm_client_no_api_key():
     """Тест создания клиента без API ключа"""
@@ -86,11 +244,12 @@ def test_get_llm_client_no_api_key():
 async def test_send_to_llm_success(mock_log_response, mock_log_request, mock_config, mock_build_prompt, mock_get_client):
     """Тест успешной отправки в LLM"""
     # Настройка моков
-    mock_config.return_value = {
-        "model_name": "test-model",
-        "temperature": 0.7,
-        "max_tokens": 1000
-    }
+    mock_config.return_value = dict(
+        PROMPT_CONFIG,
+        model_name="test-model",
+        temperature=0.7,
+        max_tokens=1000
+    )
     
     mock_build_prompt.return_value = [{"role": "user", "content": "test"}]
     
@@ -99,7 +258,7 @@ async def test_send_to_llm_success(mock_log_response, mock_log_request, mock_con
     mock_response.choices[0].message.content = "Тестовый ответ"
     
     mock_client = Mock()
-    mock_client.chat.completions.create.return_value = mock_response
+    mock_client.chat.completions.create = AsyncMock(return_value=mock_response)
     mock_get_client.return_value = mock_client
     
     # Выполнение теста
@@ -120,7 +279,7 @@ async def test_send_to_llm_success(mock_log_response, mock_log_request, mock_con
 async def test_send_to_llm_timeout_error(mock_log_error, mock_log_request, mock_config, mock_build_prompt, mock_get_client):
     """Тест обработки timeout ошибки"""
     # Настройка моков
-    mock_config.return_value = {"model_name": "test-model"}
+    mock_config.return_value = dict(PROMPT_CONFIG, model_name="test-model")
     mock_build_prompt.return_value = []
     mock_get_client.side_effect = Exception("timeout error")
     
@@ -141,7 +300,7 @@ async def test_send_to_llm_timeout_error(mock_log_error, mock_log_request, mock_
 async def test_send_to_llm_rate_limit_error(mock_log_error, mock_log_request, mock_config, mock_build_prompt, mock_get_client):
     """Тест обработки rate limit ошибки"""
     # Настройка моков
-    mock_config.return_value = {"model_name": "test-model"}
+    mock_config.return_value = dict(PROMPT_CONFIG, model_name="test-model")
     mock_build_prompt.return_value = []
     mock_get_client.side_effect = Exception("rate limit exceeded")
     
@@ -150,4 +309,218 @@ async def test_send_to_llm_rate_limit_error(mock_log_error, mock_log_request, mo
     
     # Проверки
     assert "Слишком много запросов" in result
-    mock_log_error.assert_called_once()
\ No newline at end of file
+    mock_log_error.assert_called_once()
+
+
+def make_chunk(content):
+    """Фрагмент потокового ответа chat.completions"""
+    chunk = Mock()
+    chunk.choices = [Mock()]
+    chunk.choices[0].delta.content = content
+    return chunk
+
+
+class FakeStream:
+    """Имитация AsyncStream из openai"""
+    
+    def __init__(self, chunks, error=None):
+        self.chunks = chunks
+        self.error = error
+        self.close = AsyncMock()
+    
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+        if self.error:
+            raise self.error
+
+
+@pytest.mark.asyncio
+@patch('src.llm_client.get_llm_client')
+@patch('src.llm_client.build_prompt', return_value=[])
+@patch('src.llm_client.log_llm_request')
+async def test_stream_llm_success(mock_log_request, mock_build_prompt, mock_get_client):
+    """Тест потокового получения ответа"""
+    stream = FakeStream([make_chunk("При"), make_chunk(None), make_chunk("вет")])
+    mock_client = Mock()
+    mock_client.chat.completions.create = AsyncMock(return_value=stream)
+    mock_get_client.return_value = mock_client
+    
+    parts = [part async for part in stream_llm("test", "test_chat")]
+    
+    assert parts == ["При", "вет"]
+    assert mock_client.chat.completions.create.call_args.kwargs["stream"] is True
+    stream.close.assert_called_once()
+
+
+@pytest.mark.asyncio
+@patch('src.llm_client.get_llm_client')
+@patch('src.llm_client.build_prompt', return_value=[])
+@patch('src.llm_client.log_llm_request')
+@patch('src.llm_client.log_llm_error')
+async def test_stream_llm_error_mid_stream(mock_log_error, mock_log_request, mock_build_prompt, mock_get_client):
+    """Тест ошибки посреди потока: показанная часть сохраняется, ошибка дописывается"""
+    stream = FakeStream([make_chunk("Начало")], error=Exception("timeout error"))
+    mock_client = Mock()
+    mock_client.chat.completions.create = AsyncMock(return_value=stream)
+    mock_get_client.return_value = mock_client
+    
+    parts = [part async for part in stream_llm("test", "test_chat")]
+    
+    assert parts[0] == "Начало"
+    assert parts[1].startswith("\n\n")
+    assert "временно недоступен" in parts[1]
+    mock_log_error.assert_called_once()
+
+
+@pytest.mark.asyncio
+@patch('src.llm_client.get_llm_client')
+@patch('src.llm_client.log_llm_request')
+@patch('src.llm_client.log_llm_response')
+async def test_send_to_llm_uses_response_cache(mock_log_response, mock_log_request, mock_get_client):
+    """Тест что повторный вопрос отвечается из кеша без вызова LLM"""
+    mock_response = Mock()
+    mock_response.choices = [Mock()]
+    mock_response.choices[0].message.content = "Интеграция стоит от 100 000 ₽"
+    mock_client = Mock()
+    mock_client.chat.completions.create = AsyncMock(return_value=mock_response)
+    mock_get_client.return_value = mock_client
+    
+    first = await send_to_llm("Сколько стоит интеграция ИИ в CRM?", "chat_1")
+    second = await send_to_llm("сколько стоит интеграция ии в crm", "chat_2")
+    
+    assert first == second == "Интеграция стоит от 100 000 ₽"
+    mock_client.chat.completions.create.assert_called_once()
+    assert get_cache_stats()["hits"] == 1
+
+
+@pytest.mark.asyncio
+@patch('src.llm_client.get_llm_client')
+@patch('src.llm_client.log_llm_request')
+@patch('src.llm_client.log_llm_error')
+async def test_send_to_llm_does_not_cache_errors(mock_log_error, mock_log_request, mock_get_client):
+    """Тест что ответы об ошибках не попадают в кеш"""
+    mock_get_client.side_effect = Exception("timeout error")
+    
+    await send_to_llm("Вопрос", "chat_1")
+    
+    assert get_cache_stats()["stores"] == 0
+
+
+@pytest.mark.asyncio
+@patch('src.llm_client.get_llm_client')
+@patch('src.llm_client.log_llm_request')
+@patch('src.llm_client.log_llm_response')
+async def test_response_time_is_labeled_with_answering_model(mock_log_response, mock_log_request, mock_get_client):
+    """Тест что время ответа пишется по модели, которая ответила (резервной)"""
+    async def fallback(call, request):
+        # Основная модель не ответила, ответила резервная
+        return await call(dict(request, model="backup/model"))
+    
+    mock_response = Mock()
+    mock_response.choices = [Mock()]
+    mock_response.choices[0].message.content = "Ответ резервной модели"
+    mock_client = Mock()
+    mock_client.chat.completions.create = AsyncMock(return_value=mock_response)
+    mock_get_client.return_value = mock_client
+    main_model = (get_public_config()["model_name"],)
+    before = LLM_RESPONSE_SECONDS.values.get(("backup/model",), [None, 0.0, 0])[2]
+    main_before = LLM_RESPONSE_SECONDS.values.get(main_model, [None, 0.0, 0])[2]
+    
+    with patch('src.llm_client.call_with_resilience', side_effect=fallback):
+        result = await send_to_llm("Вопрос без кеша", "chat_fallback", [{"role": "assistant", "content": "Привет"}])
+    
+    assert result == "Ответ резервной модели"
+    assert LLM_RESPONSE_SECONDS.values[("backup/model",)][2] == before + 1
+    assert LLM_RESPONSE_SECONDS.values.get(main_model, [None, 0.0, 0])[2] == main_before
+
+
+@pytest.mark.asyncio
+@patch('src.llm_client.get_llm_client')
+@patch('src.llm_client.log_llm_request')
+@patch('src.llm_client.log_llm_response')
+async def test_send_to_llm_coalesces_identical_requests(mock_log_response, mock_log_request, mock_get_client):
+    """Тест что одинаковые одновременные запросы делят один вызов LLM"""
+    async def slow_create(**kwargs):
+        await asyncio.sleep(0.01)
+        return mock_response
+    
+    mock_response = Mock()
+    mock_response.choices = [Mock()]
+    mock_response.choices[0].message.content = "Общий ответ"
+    mock_client = Mock()
+    mock_client.chat.completions.create = AsyncMock(side_effect=slow_create)
+    mock_get_client.return_value = mock_client
+    clear_singleflight()
+    
+    # История исключает кеш ответов: объединение работает и без него
+    history = [{"role": "assistant", "content": "Здравствуйте!"}]
+    requests_before = LLM_REQUESTS_TOTAL.get(get_public_config()["model_name"])
+    results = await asyncio.gather(*[
+        send_to_llm("Что вы умеете?", f"chat_{i}", history) for i in range(5)
+    ])
+    
+    assert results == ["Общий ответ"] * 5
+    mock_client.chat.completions.create.assert_called_once()
+    assert get_singleflight_stats()["coalesced"] == 4
+    # Запрос к LLM логируется и считается один раз - только у лидера
+    mock_log_request.assert_called_once()
+    assert LLM_REQUESTS_TOTAL.get(get_public_config()["model_name"]) == requests_before + 1
+
+
+@pytest.mark.asyncio
+@patch('src.llm_client.get_llm_client')
+@patch('src.llm_client.log_llm_request')
+@patch('src.llm_client.log_llm_error')
+@patch('src.rate_limiter.log_rate_limit_backoff')
+@patch('src.resilience.log_llm_attempt')
+@patch('asyncio.sleep', new_callable=AsyncMock)
+async def test_send_to_llm_429_slows_down_limiter(mock_sleep, mock_log_attempt, mock_log_backoff, mock_log_error, mock_log_request, mock_get_client):
+    """Тест что 429 от upstream замедляет общий ограничитель, а повторы ждут Retry-After"""
+    error = Exception("Error code: 429")
+    error.status_code = 429
+    error.response = Mock(headers={"retry-after": "2"})
+    mock_client = Mock()
+    mock_client.chat.completions.create = AsyncMock(side_effect=error)
+    mock_get_client.return_value = mock_client
+    
+    result = await send_to_llm("Вопрос", "chat_1")
+    
+    assert "Слишком много запросов" in result
+    mock_log_error.assert_called_once_with("chat_1", "rate_limit", ANY)
+    mock_log_backoff.assert_called_once_with(ANY, 2.0)
+    assert get_rate_limiter_stats()["backoffs"] == 1
+    # Первая попытка и два повтора, каждый после паузы не меньше Retry-After
+    assert mock_client.chat.completions.create.call_count == 3
+    assert mock_sleep.await_args_list[0][0][0] >= 2.0
+
+
+@pytest.mark.asyncio
+@patch('src.llm_client.get_llm_client')
+@patch('src.llm_client.log_llm_request')
+@patch('src.llm_client.log_llm_response')
+async def test_send_to_llm_records_metrics(mock_log_response, mock_log_request, mock_get_client):
+    """Тест учета запросов, токенов и ошибок в метриках"""
+    mock_response = Mock()
+    mock_response.choices = [Mock()]
+    mock_response.choices[0].message.content = "Ответ"
+    mock_response.usage = CompletionUsage(prompt_tokens=120, completion_tokens=30, total_tokens=150,
+                                          prompt_tokens_details={"cached_tokens": 100})
+    mock_client = Mock()
+    mock_client.chat.completions.create = AsyncMock(return_value=mock_response)
+    mock_get_client.return_value = mock_client
+    model = get_public_config()["model_name"]
+    tokens_before = LLM_TOKENS_TOTAL.get(model, "prompt")
+    cached_before = LLM_TOKENS_TOTAL.get(model, "cached")
+    timeouts_before = LLM_ERRORS_TOTAL.get("timeout")
+    
+    await send_to_llm("Вопрос для метрик", "chat_1", [{"role": "user", "content": "Привет"}])
+    
+    assert LLM_TOKENS_TOTAL.get(model, "prompt") == tokens_before + 120
+    assert LLM_TOKENS_TOTAL.get(model, "cached") == cached_before + 100
+    
+    mock_client.chat.completions.create.side_effect = Exception("timeout error")
+    with patch('src.llm_client.log_llm_error'):
+        await send_to_llm("Другой вопрос", "chat_1", [{"role": "user", "content": "Привет"}])
+    
+    assert LLM_ERRORS_TOTAL.get("timeout") == timeouts_before + 1
@@ -0,0 +1,82 @@
+"""
+Тесты для конфигурации логирования
+"""
+
+import gzip
+import json
+import logging
+import pytest
+from unittest.mock import patch
+from src.config import get_public_config
+from src.logging_config import (
+    setup_logging, shutdown_logging, get_logger, JsonFormatter, SamplingFilter, GzipRotatingFileHandler
+)
+
+
+def make_record(message, level=logging.INFO):
+    return logging.LogRecord("llm_bot", level, __file__, 1, message, None, None)
+
+
+@pytest.fixture
+def log_config(tmp_path):
+    """Логирование только в файл во временной директории"""
+    config = dict(get_public_config(), log_to_console=False, log_file_path=str(tmp_path / "bot.log"))
+    with patch('src.logging_config.get_public_config', return_value=config):
+        yield config
+    shutdown_logging()
+    get_logger().handlers.clear()
+
+
+def test_records_are_flushed_on_shutdown(log_config):
+    """Тест что записи из очереди дописываются в файл при остановке"""
+    setup_logging()
+    for i in range(1000):
+        get_logger().info(f"LLM_REQUEST | chat_id={i}")
+    shutdown_logging()
+
+    with open(log_config["log_file_path"], encoding="utf-8") as f:
+        lines = f.readlines()
+    assert len(lines) == 1000
+    assert lines[-1].endswith("LLM_REQUEST | chat_id=999\n")
+
+
+def test_json_lines_format(log_config):
+    """Тест формата JSON lines с разбором полей события"""
+    log_config["log_format"] = "json"
+    setup_logging()
+    get_logger().error('LLM_ERROR | chat_id=42 | error=timeout | message="Request timed out"')
+    get_logger().info("Бот остановлен")
+    shutdown_logging()
+
+    with open(log_config["log_file_path"], encoding="utf-8") as f:
+        entries = [json.loads(line) for line in f]
+    assert entries[0]["event"] == "LLM_ERROR"
+    assert entries[0]["level"] == "ERROR"
+    assert entries[0]["chat_id"] == "42"
+    assert entries[0]["message"] == "Request timed out"
+    assert entries[1]["message"] == "Бот остановлен"
+
+
+def test_sampling_filter():
+    """Тест что частые события прореживаются, а предупреждения - нет"""
+    sampling = SamplingFilter({"QUEUE_WAIT": 0.0})
+
+    assert not sampling.filter(make_record("QUEUE_WAIT | chat_id=1"))
+    assert sampling.filter(make_record("QUEUE_WAIT | chat_id=1", logging.WARNING))
+    assert sampling.filter(make_record("LLM_REQUEST | chat_id=1"))
+
+
+def test_rotated_files_are_gzipped(tmp_path):
+    """Тест что старые сегменты сжимаются и нумеруются по порядку"""
+    path = str(tmp_path / "bot.log")
+    handler = GzipRotatingFileHandler(path, maxBytes=100, backupCount=2, encoding="utf-8")
+    handler.setFormatter(JsonFormatter())
+    for i in range(3):
+        handler.emit(make_record(f"Сегмент {i} " + "x" * 100))
+    handler.close()
+
+    with gzip.open(path + ".1.gz", "rt", encoding="utf-8") as f:
+        assert "Сегмент 1" in f.read()
+    with gzip.open(path + ".2.gz", "rt", encoding="utf-8") as f:
+        assert "Сегмент 0" in f.read()
+    assert not (tmp_path / "bot.log.rotated").exists()
@@ -0,0 +1,65 @@
+"""
+Тесты для метрик Prometheus
+"""
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer, TestClient
+from src.metrics import Counter, Histogram, Callback, handle_metrics
+
+
+def test_counter_with_labels():
+    """Тест счетчика с метками"""
+    errors = Counter("llm_errors_total", "Ошибки", ("error_type",))
+    errors.inc("timeout")
+    errors.inc("timeout")
+    errors.inc("rate_limit", amount=3)
+
+    assert errors.get("timeout") == 2
+    assert errors.render() == [
+        'llm_errors_total{error_type="timeout"} 2',
+        'llm_errors_total{error_type="rate_limit"} 3'
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    """Тест кумулятивных корзин, суммы и количества"""
+    latency = Histogram("llm_seconds", "Задержка", ("model",), buckets=(0.5, 1.0))
+    for value in (0.1, 0.7, 0.9, 5.0):
+        latency.observe(value, "gpt")
+
+    assert latency.render() == [
+        'llm_seconds_bucket{model="gpt",le="0.5"} 1',
+        'llm_seconds_bucket{model="gpt",le="1.0"} 3',
+        'llm_seconds_bucket{model="gpt",le="+Inf"} 4',
+        'llm_seconds_sum{model="gpt"} 6.7',
+        'llm_seconds_count{model="gpt"} 4'
+    ]
+
+
+def test_callback_reads_live_value():
+    """Тест что значение из источника читается в момент вывода"""
+    queue = []
+    queued = Callback("scheduler_queued", "Очередь", lambda: len(queue))
+    queue.append(1)
+
+    assert queued.render() == ["scheduler_queued 1"]
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint():
+    """Тест HTTP ответа /metrics в текстовом формате Prometheus"""
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    client = TestClient(TestServer(app))
+    await client.start_server()
+    try:
+        response = await client.get("/metrics")
+        text = await response.text()
+    finally:
+        await client.close()
+
+    assert response.status == 200
+    assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+    assert "# TYPE llm_response_seconds histogram" in text
+    assert "# TYPE scheduler_queued gauge" in text
@@ -0,0 +1,106 @@
+"""
+Тесты для постоянного хранения истории диалогов
+"""
+
+import asyncio
+import pytest
+from unittest.mock import patch
+from src.conversation_store import ConversationStore
+from src.persistence import SQLiteBackend
+
+
+def make_store(path, max_messages=4):
+    """Хранилище с SQLite backend во временном файле"""
+    backend = SQLiteBackend(str(path), max_messages=max_messages)
+    return ConversationStore(max_messages=max_messages, max_chats=100, idle_ttl=3600, backend=backend)
+
+
+def test_history_survives_restart(tmp_path):
+    """Тест что история восстанавливается после перезапуска"""
+    db_path = tmp_path / "history.db"
+    store = make_store(db_path)
+    store.append("chat", "user", "Привет")
+    store.append("chat", "assistant", "Здравствуйте!")
+    store.backend.close()
+
+    restarted = make_store(db_path)
+    assert restarted.get_messages("chat") == [
+        {"role": "user", "content": "Привет"},
+        {"role": "assistant", "content": "Здравствуйте!"}
+    ]
+    restarted.backend.close()
+
+
+def test_writes_are_batched_and_trimmed(tmp_path):
+    """Тест пакетной записи и обрезки истории на диске до лимита"""
+    store = make_store(tmp_path / "history.db", max_messages=4)
+    for i in range(50):
+        store.append("chat", "user", f"msg{i}")
+    store.backend.flush()
+
+    rows = store.backend.load("chat", 100)
+    assert [content for _, content in rows] == ["msg46", "msg47", "msg48", "msg49"]
+    # 50 операций записаны заметно меньшим числом транзакций
+    assert store.backend.batches_written < 50
+    store.backend.close()
+
+
+def test_delete_is_persisted(tmp_path):
+    """Тест что /clear удаляет историю и на диске"""
+    db_path = tmp_path / "history.db"
+    store = make_store(db_path)
+    store.append("chat", "user", "Привет")
+
+    assert store.delete("chat") is True
+    # Сразу после удаления история не подгружается обратно с диска
+    assert store.get_messages("chat") == []
+    store.backend.close()
+
+    restarted = make_store(db_path)
+    assert "chat" not in restarted
+    assert restarted.get_messages("chat") == []
+    restarted.backend.close()
+
+
+def test_evicted_chat_is_loaded_from_disk(tmp_path):
+    """Тест что вытесненный из памяти чат подгружается с диска"""
+    backend = SQLiteBackend(str(tmp_path / "history.db"), max_messages=4)
+    store = ConversationStore(max_messages=4, max_chats=1, idle_ttl=3600, backend=backend)
+    store.append("a", "user", "Первый чат")
+    store.append("b", "user", "Второй чат")     # вытесняет "a" из памяти
+
+    assert "a" not in store
+    assert store.get_messages("a") == [{"role": "user", "content": "Первый чат"}]
+    backend.close()
+
+
+def test_load_sees_unwritten_operations_without_flush(tmp_path):
+    """Тест что чтение берет еще не записанные операции из очереди, а не ждет записи"""
+    backend = SQLiteBackend(str(tmp_path / "history.db"), max_messages=3, flush_interval=10)
+    backend.enqueue_append("chat", "user", "Старое")
+    backend.flush()
+    backend.enqueue_delete("chat")
+    for i in range(4):
+        backend.enqueue_append("chat", "user", f"msg{i}")
+
+    with patch.object(backend, "flush", side_effect=AssertionError("flush из load")):
+        assert backend.load("chat", 3) == [("user", "msg1"), ("user", "msg2"), ("user", "msg3")]
+    backend.flush()
+    assert backend.load("chat", 3) == [("user", "msg1"), ("user", "msg2"), ("user", "msg3")]
+    backend.close()
+
+
+@pytest.mark.asyncio
+async def test_load_chat_reads_backend_in_thread(tmp_path):
+    """Тест что load_chat подгружает чат с диска через поток"""
+    backend = SQLiteBackend(str(tmp_path / "history.db"), max_messages=4)
+    store = ConversationStore(max_messages=4, max_chats=1, idle_ttl=3600, backend=backend)
+    store.append("a", "user", "Первый чат")
+    store.append("b", "user", "Второй чат")     # вытесняет "a" из памяти
+
+    with patch("src.conversation_store.asyncio.to_thread", wraps=asyncio.to_thread) as mock_thread:
+        await store.load_chat("a")
+    mock_thread.assert_called_once_with(backend.load, "a", 4)
+    assert "a" in store
+    assert store.delete("a") is True
+    backend.close()
@@ -0,0 +1,82 @@
+"""
+Тесты для ограничения частоты запросов
+"""
+
+import pytest
+from unittest.mock import patch
+from src.rate_limiter import (
+    TokenBucket, RateLimitExceeded, acquire_chat, acquire_global, report_rate_limited,
+    report_success, get_global_bucket, get_rate_limiter_stats, reset_rate_limiters
+)
+
+LIMIT_CONFIG = {
+    "rate_limit_enabled": True,
+    "rate_limit_global_rps": 10.0,
+    "rate_limit_global_burst": 2,
+    "rate_limit_chat_per_minute": 60,
+    "rate_limit_chat_burst": 1,
+    "rate_limit_max_wait": 0.5,
+    "rate_limit_backoff": 0.5,
+    "rate_limit_min_rps": 1.0,
+    "rate_limit_recovery": 1.0
+}
+
+
+@pytest.fixture(autouse=True)
+def limiter_config():
+    """Свежие ведра с маленькими лимитами для каждого теста"""
+    reset_rate_limiters()
+    with patch('src.rate_limiter.get_public_config', return_value=LIMIT_CONFIG):
+        yield
+    reset_rate_limiters()
+
+
+def test_token_bucket_reserve():
+    """Тест что ведро отдает запас сразу, а дальше - с ожиданием"""
+    bucket = TokenBucket(rate=10.0, capacity=2)
+
+    assert bucket.reserve(max_wait=1.0) == 0
+    assert bucket.reserve(max_wait=1.0) == 0
+    assert bucket.reserve(max_wait=1.0) == pytest.approx(0.1, abs=0.01)
+    assert bucket.reserve(max_wait=0.1) is None
+
+
+@pytest.mark.asyncio
+async def test_chat_limit_rejects_long_wait():
+    """Тест что чат сверх лимита получает отказ, а другие чаты - нет"""
+    await acquire_chat("spammer")
+
+    with pytest.raises(RateLimitExceeded) as error:
+        await acquire_chat("spammer")
+    assert error.value.scope == "chat"
+
+    await acquire_chat("other")
+    assert get_rate_limiter_stats()["rejected"] == 1
+
+
+@pytest.mark.asyncio
+@patch('src.rate_limiter.asyncio.sleep')
+async def test_global_limit_delays_requests(mock_sleep):
+    """Тест что сверх запаса запросы ждут своего токена"""
+    for _ in range(3):
+        await acquire_global()
+
+    mock_sleep.assert_called_once()
+    assert mock_sleep.call_args[0][0] == pytest.approx(0.1, abs=0.01)
+
+
+@patch('src.rate_limiter.log_rate_limit_backoff')
+def test_backoff_on_429_and_recovery(mock_log):
+    """Тест снижения скорости после 429 и постепенного восстановления"""
+    bucket = get_global_bucket()
+
+    report_rate_limited(retry_after=3.0)
+    report_rate_limited(retry_after=3.0)     # та же волна 429 - скорость снижается один раз
+
+    assert bucket.rate == 5.0
+    assert bucket.wait_time(bucket.updated) == pytest.approx(3.0)
+    mock_log.assert_called_once()
+
+    for _ in range(10):
+        report_success()
+    assert bucket.rate == 10.0
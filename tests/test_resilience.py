@@ -0,0 +1,104 @@
+"""
+Тесты для повторов, страховочных запросов и резервных моделей
+"""
+
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, patch
+from src.resilience import (
+    call_with_resilience, is_retryable_error, get_retry_after, get_resilience_stats, clear_resilience
+)
+
+RESILIENCE_CONFIG = {
+    "fallback_models": ["backup/model"],
+    "llm_max_retries": 2,
+    "llm_retry_base_delay": 0.001,
+    "llm_retry_max_delay": 0.01,
+    "llm_hedge_enabled": False,
+    "llm_hedge_delay": 0.0
+}
+
+
+class StatusError(Exception):
+    """Ошибка API с HTTP статусом"""
+
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"Error code: {status_code}")
+        self.status_code = status_code
+        self.response = type("Response", (), {"headers": headers or {}})()
+
+
+@pytest.fixture(autouse=True)
+def resilience_config():
+    clear_resilience()
+    with patch('src.resilience.get_public_config', return_value=dict(RESILIENCE_CONFIG)) as mock_config, \
+            patch('src.resilience.log_llm_attempt') as mock_log:
+        yield mock_config, mock_log
+    clear_resilience()
+
+
+def test_retryable_errors():
+    """Тест разделения временных и постоянных ошибок"""
+    assert is_retryable_error(StatusError(503))
+    assert is_retryable_error(StatusError(429))
+    assert is_retryable_error(asyncio.TimeoutError())
+    assert not is_retryable_error(StatusError(400))
+    assert not is_retryable_error(ValueError("bad"))
+    assert get_retry_after(StatusError(429, {"retry-after": "3"})) == 3.0
+
+
+@pytest.mark.asyncio
+async def test_retry_then_success(resilience_config):
+    """Тест повтора временной ошибки с логированием каждой попытки"""
+    _, mock_log = resilience_config
+    call = AsyncMock(side_effect=[StatusError(502), "ответ"])
+
+    assert await call_with_resilience(call, {"model": "main/model"}) == "ответ"
+
+    assert call.call_count == 2
+    outcomes = [c[0][3] for c in mock_log.call_args_list]
+    assert outcomes == ["error_502", "success"]
+    assert get_resilience_stats()["retries"] == 1
+
+
+@pytest.mark.asyncio
+async def test_permanent_error_is_not_retried():
+    """Тест что ошибка запроса не повторяется и не уходит на другую модель"""
+    call = AsyncMock(side_effect=StatusError(400))
+
+    with pytest.raises(StatusError):
+        await call_with_resilience(call, {"model": "main/model"})
+    assert call.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_fallback_model_after_retries():
+    """Тест перехода на резервную модель, когда повторы исчерпаны"""
+    async def call(request):
+        if request["model"] == "main/model":
+            raise StatusError(503)
+        return f"ответ {request['model']}"
+
+    assert await call_with_resilience(call, {"model": "main/model"}) == "ответ backup/model"
+    stats = get_resilience_stats()
+    assert stats["retries"] == 2
+    assert stats["fallbacks"] == 1
+
+
+@pytest.mark.asyncio
+async def test_hedged_request_wins_and_cancels_loser(resilience_config):
+    """Тест что страховочный запрос побеждает медленный, а медленный отменяется"""
+    mock_config, mock_log = resilience_config
+    mock_config.return_value.update(llm_hedge_enabled=True, llm_hedge_delay=0.01)
+    delays = iter([1.0, 0.0])
+
+    async def call(request):
+        await asyncio.sleep(next(delays))
+        return "ответ"
+
+    assert await call_with_resilience(call, {"model": "main/model"}) == "ответ"
+    await asyncio.sleep(0)
+
+    outcomes = {c[0][2]: c[0][3] for c in mock_log.call_args_list}
+    assert outcomes == {"hedge": "success", "primary": "cancelled"}
+    assert get_resilience_stats()["hedge_wins"] == 1
@@ -0,0 +1,73 @@
+"""
+Тесты для кеша ответов
+"""
+
+import json
+import pytest
+from unittest.mock import patch
+from src.response_cache import (
+    normalize_question, make_cache_key, get_cached_response, store_response,
+    load_cache_seed, get_cache_stats, clear_response_cache
+)
+
+CACHE_CONFIG = {
+    "response_cache_enabled": True,
+    "response_cache_size": 2,
+    "response_cache_ttl": 60,
+    "response_cache_context_messages": 0
+}
+
+
+@pytest.fixture(autouse=True)
+def cache_config():
+    """Чистый кеш с маленьким лимитом для каждого теста"""
+    clear_response_cache()
+    with patch('src.response_cache.get_public_config', return_value=CACHE_CONFIG):
+        yield
+    clear_response_cache()
+
+
+def test_normalize_question():
+    """Тест нормализации: регистр, ё, пунктуация и пробелы не влияют на ключ"""
+    assert normalize_question("  Сколько стоит интеграция ИИ в CRM?! ") == "сколько стоит интеграция ии в crm"
+    assert normalize_question("Всё ещё") == normalize_question("все еще")
+
+
+def test_context_dependent_question_is_skipped():
+    """Тест что вопрос с историей длиннее окна не кешируется"""
+    history = [{"role": "user", "content": "Расскажите про чат-ботов"}]
+
+    assert make_cache_key("hash", "А сколько это стоит?", history) is None
+    assert make_cache_key("hash", "Сколько стоит чат-бот?") is not None
+    assert get_cache_stats()["skipped"] == 1
+
+
+def test_lru_and_ttl():
+    """Тест вытеснения по LRU и истечения по TTL"""
+    store_response("a", "ответ A")
+    store_response("b", "ответ B")
+    get_cached_response("a")                 # "a" свежее "b"
+    store_response("c", "ответ C")           # вытесняет "b"
+
+    assert get_cached_response("b") is None
+    assert get_cached_response("a") == "ответ A"
+
+    with patch('src.response_cache.time.time', return_value=10 ** 12):
+        assert get_cached_response("c") is None
+
+    stats = get_cache_stats()
+    assert stats["evictions"] == 1
+    assert stats["hits"] == 2
+
+
+def test_load_cache_seed(tmp_path):
+    """Тест предзаполнения кеша из файла"""
+    seed_file = tmp_path / "seed.json"
+    seed_file.write_text(json.dumps([
+        {"question": "Сколько стоит интеграция ИИ в CRM?", "answer": "От 100 000 ₽"}
+    ], ensure_ascii=False), encoding="utf-8")
+
+    assert load_cache_seed(str(seed_file), "hash") == 1
+
+    key = make_cache_key("hash", "сколько стоит интеграция ии в crm")
+    assert get_cached_response(key) == "От 100 000 ₽"
@@ -0,0 +1,85 @@
+"""
+Тесты для поиска по базе знаний
+"""
+
+import json
+import pytest
+from unittest.mock import patch
+from src.retrieval import (
+    build_index, load_index, init_knowledge_index, find_direct_answer, build_knowledge_message,
+    get_retrieval_stats, KNOWLEDGE_PREFIX
+)
+
+np = pytest.importorskip("numpy")
+
+SERVICES_MD = """# Услуги
+
+## Обучение команд
+Стоимость - от 80 000 руб. Практические семинары и воркшопы для сотрудников.
+
+## Прогнозирование спроса
+Модели прогноза продаж и закупок для розницы и производства.
+"""
+
+FAQ = [
+    {"question": "Сколько стоит разработка чат-бота?", "answer": "От 150 000 руб."},
+    {"question": "Обучаете ли вы команды?", "answer": "Да, от 80 000 руб."}
+]
+
+
+@pytest.fixture
+def knowledge_config(tmp_path):
+    knowledge = tmp_path / "knowledge"
+    knowledge.mkdir()
+    (knowledge / "services.md").write_text(SERVICES_MD, encoding="utf-8")
+    (knowledge / "faq.json").write_text(json.dumps(FAQ, ensure_ascii=False), encoding="utf-8")
+    config = {
+        "retrieval_enabled": True,
+        "knowledge_dir": str(knowledge),
+        "knowledge_index_dir": str(tmp_path / "index"),
+        "retrieval_top_k": 3,
+        "retrieval_min_score": 0.2,
+        "retrieval_answer_score": 0.85,
+        "retrieval_context_tokens": 600
+    }
+    build_index(config["knowledge_dir"], config["knowledge_index_dir"], dim=4096)
+    with patch("src.retrieval.get_public_config", return_value=config):
+        yield config
+    init_knowledge_index(dict(config, retrieval_enabled=False))
+
+
+def test_index_is_memory_mapped_and_ranks_snippets(knowledge_config):
+    """Тест что индекс открывается через mmap и ближайший фрагмент идет первым"""
+    index = load_index(knowledge_config["knowledge_index_dir"])
+
+    assert isinstance(index.vectors, np.memmap)
+    assert len(index.snippets) == 4
+    first, second = index.search(["прогноз продаж для магазина", "сколько стоит чат бот"], top_k=2)
+    assert first[0][1]["title"] == "Прогнозирование спроса"
+    assert second[0][1]["title"] == "Сколько стоит разработка чат-бота?"
+    assert first[0][0] >= first[1][0]
+
+
+def test_direct_answer_only_for_close_questions(knowledge_config):
+    """Тест что без LLM отвечаем только на почти тот же вопрос из готовых ответов"""
+    assert init_knowledge_index(knowledge_config) == 4
+
+    assert find_direct_answer("сколько стоит разработка чат бота") == "От 150 000 руб."
+    assert find_direct_answer("Нужен прогноз спроса для сети магазинов") is None
+    assert get_retrieval_stats()["answers"] >= 1
+
+
+def test_knowledge_message_has_relevant_snippets(knowledge_config):
+    """Тест что в промпт идут только относящиеся к вопросу фрагменты в пределах бюджета"""
+    init_knowledge_index(knowledge_config)
+
+    message = build_knowledge_message("Нужен прогноз спроса для сети магазинов")
+    assert message["role"] == "system"
+    assert message["content"].startswith(KNOWLEDGE_PREFIX)
+    assert "Модели прогноза продаж" in message["content"]
+    assert "чат-бота" not in message["content"]
+
+    assert build_knowledge_message("Добрый вечер") is None
+
+    with patch("src.retrieval.get_public_config", return_value=dict(knowledge_config, retrieval_context_tokens=1)):
+        assert build_knowledge_message("Нужен прогноз спроса для сети магазинов") is None
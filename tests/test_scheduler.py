@@ -0,0 +1,208 @@
+"""
+Тесты для планировщика сообщений
+"""
+
+import asyncio
+import pytest
+from src.scheduler import RequestScheduler, SchedulerOverloaded
+
+
+@pytest.mark.asyncio
+async def test_chat_messages_are_processed_in_order():
+    """Тест что сообщения одного чата обрабатываются строго по очереди"""
+    scheduler = RequestScheduler(max_concurrency=10, max_queue=100, max_chat_queue=10)
+    events = []
+
+    async def process(i):
+        async with scheduler.slot("chat"):
+            events.append(("start", i))
+            await asyncio.sleep(0.005 * (3 - i))
+            events.append(("end", i))
+
+    await asyncio.gather(*[process(i) for i in range(3)])
+
+    assert events == [("start", 0), ("end", 0), ("start", 1), ("end", 1), ("start", 2), ("end", 2)]
+    assert scheduler.get_stats()["chats"] == 0
+
+
+@pytest.mark.asyncio
+async def test_global_concurrency_limit():
+    """Тест что разные чаты идут параллельно, но не больше лимита"""
+    scheduler = RequestScheduler(max_concurrency=2, max_queue=100, max_chat_queue=10)
+    running = []
+    peak = []
+
+    async def process(chat_id):
+        async with scheduler.slot(chat_id) as wait_time:
+            running.append(chat_id)
+            peak.append(len(running))
+            await asyncio.sleep(0.01)
+            running.remove(chat_id)
+            return wait_time
+
+    waits = await asyncio.gather(*[process(f"chat_{i}") for i in range(6)])
+
+    assert max(peak) == 2
+    assert max(waits) >= 0.01
+    stats = scheduler.get_stats()
+    assert stats["scheduled"] == 6
+    assert stats["active"] == 0
+    assert stats["waiting"] == 0
+
+
+@pytest.mark.asyncio
+async def test_overload_is_rejected():
+    """Тест отказа при переполненной очереди чата и общей очереди"""
+    scheduler = RequestScheduler(max_concurrency=1, max_queue=2, max_chat_queue=1)
+    release = asyncio.Event()
+
+    async def hold(chat_id):
+        async with scheduler.slot(chat_id):
+            await release.wait()
+
+    tasks = [asyncio.create_task(hold("a")), asyncio.create_task(hold("b"))]
+    await asyncio.sleep(0)
+
+    # В чате "a" уже есть сообщение
+    with pytest.raises(SchedulerOverloaded):
+        async with scheduler.slot("a"):
+            pass
+
+    tasks.append(asyncio.create_task(hold("c")))
+    await asyncio.sleep(0)
+
+    # "b" и "c" ждут - общая очередь заполнена
+    with pytest.raises(SchedulerOverloaded):
+        async with scheduler.slot("d"):
+            pass
+
+    release.set()
+    await asyncio.gather(*tasks)
+    assert scheduler.get_stats()["rejected"] == 2
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_frees_its_place():
+    """Тест что отмененное ожидание не занимает место навсегда"""
+    scheduler = RequestScheduler(max_concurrency=1, max_queue=10, max_chat_queue=10)
+    release = asyncio.Event()
+
+    async def hold(chat_id):
+        async with scheduler.slot(chat_id):
+            await release.wait()
+
+    holder = asyncio.create_task(hold("a"))
+    waiter = asyncio.create_task(hold("b"))
+    await asyncio.sleep(0)
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+
+    release.set()
+    await holder
+    async with scheduler.slot("c"):
+        pass
+
+    stats = scheduler.get_stats()
+    assert stats["active"] == 0
+    assert stats["waiting"] == 0
+    assert stats["chats"] == 0
+
+
+@pytest.mark.asyncio
+async def test_resize_applies_new_limit():
+    """Тест смены лимита на ходу: рост сразу пускает ожидающих, уменьшение - по мере освобождения"""
+    scheduler = RequestScheduler(max_concurrency=1, max_queue=10, max_chat_queue=10)
+    release = asyncio.Event()
+    peak = []
+
+    async def hold(chat_id):
+        async with scheduler.slot(chat_id):
+            peak.append(scheduler.active)
+            await release.wait()
+
+    tasks = [asyncio.create_task(hold(str(i))) for i in range(3)]
+    await asyncio.sleep(0)
+    assert scheduler.active == 1
+
+    scheduler.resize(3, 10, 10)
+    await asyncio.sleep(0)
+    assert scheduler.active == 3
+    assert scheduler.waiting == 0
+
+    scheduler.resize(1, 10, 10)
+    release.set()
+    await asyncio.gather(*tasks)
+    assert scheduler.active == 0
+    assert max(peak) == 3
+
+
+@pytest.mark.asyncio
+async def test_wait_idle_waits_for_queued_messages():
+    """Тест что wait_idle дожидается и обрабатываемых, и ожидающих в очереди сообщений"""
+    scheduler = RequestScheduler(max_concurrency=1, max_queue=10, max_chat_queue=10)
+    done = []
+
+    async def process(chat_id):
+        async with scheduler.slot(chat_id):
+            await asyncio.sleep(0.02)
+            done.append(chat_id)
+
+    tasks = [asyncio.create_task(process(chat_id)) for chat_id in ("a", "b")]
+    await asyncio.sleep(0)
+
+    assert await scheduler.wait_idle(timeout=0.01) is False
+    assert await scheduler.wait_idle(timeout=1.0) is True
+    assert done == ["a", "b"]
+    await asyncio.gather(*tasks)
+    assert await scheduler.wait_idle(timeout=0) is True
+
+
+@pytest.mark.asyncio
+async def test_delayed_slot_is_visible_to_wait_idle():
+    """Тест что сообщение в окне ожидания уже в очереди: wait_idle его дожидается"""
+    scheduler = RequestScheduler(max_concurrency=1, max_queue=10, max_chat_queue=10)
+    waits = []
+
+    async def process():
+        async with scheduler.slot("a", delay=0.03) as wait_time:
+            waits.append(wait_time)
+
+    task = asyncio.create_task(process())
+    await asyncio.sleep(0)
+
+    assert scheduler.get_stats()["waiting"] == 1
+    assert await scheduler.wait_idle(timeout=1.0) is True
+    # Окно ожидания не считается временем в очереди
+    assert waits and waits[0] < 0.03
+    await task
+
+
+@pytest.mark.asyncio
+async def test_released_place_goes_to_other_chat():
+    """Тест что после release_place место получает другой чат, а чат остается занятым"""
+    scheduler = RequestScheduler(max_concurrency=1, max_queue=10, max_chat_queue=5)
+    sending = asyncio.Event()
+    order = []
+
+    async def answer(chat_id):
+        async with scheduler.slot(chat_id):
+            order.append(f"{chat_id}:llm")
+            scheduler.release_place(chat_id)
+            if chat_id == "a":
+                # Отправка в Telegram ждет темпа, место вызова LLM уже свободно
+                await sending.wait()
+            order.append(f"{chat_id}:sent")
+
+    first = asyncio.create_task(answer("a"))
+    await asyncio.sleep(0)
+    second = asyncio.create_task(answer("b"))
+    third = asyncio.create_task(answer("a"))
+    await second
+    assert order == ["a:llm", "b:llm", "b:sent"]
+    assert scheduler.active == 0
+
+    sending.set()
+    await asyncio.gather(first, third)
+    assert order[3:] == ["a:sent", "a:llm", "a:sent"]
+    assert scheduler.active == 0 and scheduler.get_stats()["chats"] == 0
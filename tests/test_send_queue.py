@@ -0,0 +1,100 @@
+"""
+Тесты для очереди исходящих сообщений Telegram
+"""
+
+import asyncio
+import time
+import pytest
+from unittest.mock import Mock
+from aiogram.exceptions import TelegramRetryAfter
+from src.send_queue import SendScheduler, PRIORITY_COMMAND, PRIORITY_ANSWER
+
+
+def make_scheduler(chat_rps=100.0, chat_burst=3, max_attempts=3):
+    return SendScheduler(global_rps=100.0, chat_rps=chat_rps, group_per_minute=60,
+                         chat_burst=chat_burst, max_attempts=max_attempts)
+
+
+def retry_after(seconds):
+    return TelegramRetryAfter(method=Mock(), message="Flood control exceeded", retry_after=seconds)
+
+
+@pytest.mark.asyncio
+async def test_command_overtakes_queued_answers():
+    """Тест что ответ на команду обгоняет ожидающие ответы LLM в том же чате"""
+    scheduler = make_scheduler()
+    sent = []
+    release = asyncio.Event()
+
+    async def slow_send():
+        await release.wait()
+        sent.append("first")
+
+    def make_call(name):
+        async def call():
+            sent.append(name)
+        return call
+
+    first = asyncio.create_task(scheduler.send("1", slow_send))
+    await asyncio.sleep(0)
+    answers = [asyncio.create_task(scheduler.send("1", make_call(f"answer{i}"), PRIORITY_ANSWER)) for i in range(2)]
+    await asyncio.sleep(0)
+    command = asyncio.create_task(scheduler.send("1", make_call("command"), PRIORITY_COMMAND))
+    await asyncio.sleep(0)
+
+    release.set()
+    await asyncio.gather(first, command, *answers)
+
+    assert sent == ["first", "command", "answer0", "answer1"]
+    assert scheduler.stats["sent"] == 4
+
+
+@pytest.mark.asyncio
+async def test_retry_after_resends_message():
+    """Тест что после flood control то же сообщение отправляется повторно"""
+    scheduler = make_scheduler()
+    attempts = []
+
+    async def call():
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise retry_after(0.05)
+        return "ok"
+
+    assert await scheduler.send("1", call) == "ok"
+    assert len(attempts) == 2
+    assert attempts[1] - attempts[0] >= 0.05
+    assert scheduler.stats == {"sent": 1, "retry_after": 1, "failed": 0}
+
+
+@pytest.mark.asyncio
+async def test_retry_after_gives_up_after_max_attempts():
+    """Тест что после max_attempts ответов flood control ошибка передается вызывающему"""
+    scheduler = make_scheduler(max_attempts=2)
+
+    async def call():
+        raise retry_after(0)
+
+    with pytest.raises(TelegramRetryAfter):
+        await scheduler.send("1", call)
+    assert scheduler.stats == {"sent": 0, "retry_after": 2, "failed": 1}
+
+
+@pytest.mark.asyncio
+async def test_chat_pacing_after_burst():
+    """Тест что сверх запаса сообщения в чат идут с темпом chat_rps, а другие чаты не ждут"""
+    scheduler = make_scheduler(chat_rps=20.0, chat_burst=2)
+    times = {}
+
+    def make_call(key):
+        async def call():
+            times[key] = time.monotonic()
+        return call
+
+    start = time.monotonic()
+    await asyncio.gather(*[scheduler.send("1", make_call(i)) for i in range(4)],
+                         scheduler.send("2", make_call("other")))
+
+    assert times[1] - start < 0.04
+    assert times[3] - start >= 0.09
+    assert times["other"] - start < 0.04
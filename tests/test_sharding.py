@@ -0,0 +1,179 @@
+"""
+Тесты для шардирования обновлений по процессам-воркерам
+"""
+
+import asyncio
+import os
+import queue
+import signal
+import threading
+import pytest
+from types import SimpleNamespace
+from src.conversation_store import ConversationStore
+from src.persistence import SQLiteBackend
+from unittest.mock import patch
+from src.sharding import (
+    HashRing, ShardSupervisor, ShardWorker, get_routing_key, get_shard_log_path, run_polling
+)
+
+REPLICAS = 50
+
+
+def make_update(update_id, chat_id, text="Привет"):
+    return {
+        "update_id": update_id,
+        "message": {"message_id": update_id, "date": 0, "chat": {"id": chat_id, "type": "private"}, "text": text}
+    }
+
+
+class ThreadProcess:
+    """Воркер в потоке вместо процесса: тот же протокол очередей"""
+
+    def __init__(self, target, args, name):
+        self._thread = threading.Thread(target=target, args=args, name=name, daemon=True)
+        self.exitcode = None
+
+    def start(self):
+        self._thread.start()
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    def is_alive(self):
+        return self._thread.is_alive()
+
+    def terminate(self):
+        pass
+
+
+def test_hash_ring_moves_few_chats():
+    """Тест что при добавлении воркера переезжает небольшая часть чатов и только на новый"""
+    keys = [str(100000 + i) for i in range(2000)]
+    before = HashRing(3, REPLICAS)
+    after = HashRing(4, REPLICAS)
+
+    moved = [key for key in keys if before.get_worker(key) != after.get_worker(key)]
+
+    assert all(after.get_worker(key) == 3 for key in moved)
+    assert 0.1 < len(moved) / len(keys) < 0.4
+    counts = [sum(1 for key in keys if before.get_worker(key) == index) for index in range(3)]
+    assert min(counts) > len(keys) / 3 * 0.6
+
+
+def test_get_routing_key():
+    """Тест ключа шардирования для разных типов обновлений"""
+    assert get_routing_key(make_update(1, 12345)) == "12345"
+    callback = {"update_id": 2, "callback_query": {"id": "1", "message": {"chat": {"id": -100}}}}
+    assert get_routing_key(callback) == "-100"
+    assert get_routing_key({"update_id": 3, "inline_query": {"id": "1"}}) == "update-3"
+
+
+def test_get_shard_log_path():
+    assert get_shard_log_path("logs/llm_bot.log", 2) == "logs/llm_bot.shard2.log"
+
+
+@pytest.mark.asyncio
+async def test_worker_hands_off_foreign_chats():
+    """Тест что при перебалансировке воркер отдает чужие чаты и оставляет свои"""
+    store = ConversationStore(max_messages=10, max_chats=100, idle_ttl=3600)
+    for i in range(20):
+        store.append(str(i), "user", f"Вопрос {i}")
+        store.append(str(i), "assistant", f"Ответ {i}")
+    inbox, outbox = queue.Queue(), queue.Queue()
+    inbox.put(("rebalance", 2))
+    inbox.put(("stop",))
+
+    await ShardWorker(0, inbox, outbox, None, store, REPLICAS).run()
+
+    messages = [outbox.get_nowait() for _ in range(outbox.qsize())]
+    handoffs = [m for m in messages if m[0] == "handoff"]
+    ring = HashRing(2, REPLICAS)
+    assert messages[-1] == ("rebalanced", 0, len(handoffs))
+    assert {m[2] for m in handoffs} == {str(i) for i in range(20) if ring.get_worker(str(i)) == 1}
+    assert all(ring.get_worker(chat_id) == 0 for chat_id in store.chat_ids())
+
+    _, owner, chat_id, state = handoffs[0]
+    other = ConversationStore(max_messages=10, max_chats=100, idle_ttl=3600)
+    other.import_chat(chat_id, state)
+    assert owner == 1
+    assert other.get_messages(chat_id) == [
+        {"role": "user", "content": f"Вопрос {chat_id}"},
+        {"role": "assistant", "content": f"Ответ {chat_id}"}
+    ]
+
+
+@pytest.mark.asyncio
+async def test_worker_with_own_file_moves_chats_between_files(tmp_path):
+    """Тест что без общего backend переехавший чат переписывается в файл нового владельца"""
+    old_store = ConversationStore(max_messages=10, max_chats=100, idle_ttl=3600)
+    old_store.backend = SQLiteBackend(str(tmp_path / "h.shard0.db"), max_messages=10)
+    for i in range(10):
+        old_store.append(str(i), "user", f"Вопрос {i}")
+    inbox, outbox = queue.Queue(), queue.Queue()
+    inbox.put(("rebalance", 2))
+    inbox.put(("stop",))
+    await ShardWorker(0, inbox, outbox, None, old_store, REPLICAS).run()
+    _, _, chat_id, state = next(m for m in outbox.queue if m[0] == "handoff")
+
+    new_store = ConversationStore(max_messages=10, max_chats=100, idle_ttl=3600)
+    new_store.backend = SQLiteBackend(str(tmp_path / "h.shard1.db"), max_messages=10)
+    inbox, outbox = queue.Queue(), queue.Queue()
+    inbox.put(("import", chat_id, state))
+    inbox.put(("stop",))
+    await ShardWorker(1, inbox, outbox, None, new_store, REPLICAS).run()
+
+    assert new_store.backend.load(chat_id, 10) == [("user", f"Вопрос {chat_id}")]
+    assert old_store.backend.load(chat_id, 10) == []
+    old_store.backend.close()
+    new_store.backend.close()
+
+
+@pytest.mark.asyncio
+async def test_supervisor_rebalance_keeps_history_with_owner():
+    """Тест что после добавления воркера история каждого чата у его нового владельца"""
+    stores = {}
+
+    def run_worker(index, inbox, outbox):
+        store = stores.setdefault(index, ConversationStore(max_messages=10, max_chats=100, idle_ttl=3600))
+
+        async def process_update(data):
+            store.append(get_routing_key(data), "user", data["message"]["text"])
+
+        asyncio.run(ShardWorker(index, inbox, outbox, process_update, store, REPLICAS).run())
+
+    context = SimpleNamespace(Queue=queue.Queue, Process=ThreadProcess)
+    supervisor = ShardSupervisor(2, REPLICAS, rebalance_timeout=5.0, context=context, target=run_worker)
+    await supervisor.start()
+
+    chats = [1000 + i for i in range(30)]
+    for chat_id in chats:
+        await supervisor.route(make_update(chat_id, chat_id, "первое"))
+    await supervisor.resize(3)
+    for chat_id in chats:
+        await supervisor.route(make_update(chat_id + 10000, chat_id, "второе"))
+    await supervisor.stop()
+
+    ring = HashRing(3, REPLICAS)
+    for chat_id in chats:
+        owner = ring.get_worker(str(chat_id))
+        assert [m["content"] for m in stores[owner].get_messages(str(chat_id))] == ["первое", "второе"]
+        assert all(str(chat_id) not in stores[index] for index in stores if index != owner)
+    assert supervisor.stats["handoffs"] > 0
+    assert supervisor.stats["routed"] == 60
+
+
+@pytest.mark.asyncio
+async def test_polling_stops_on_sigterm():
+    """Тест что SIGTERM останавливает опрос в режиме шардов (дальше - supervisor.stop())"""
+    polled = asyncio.Event()
+
+    async def poll_forever(bot, supervisor, allowed_updates):
+        polled.set()
+        await asyncio.Event().wait()
+
+    async def send_sigterm():
+        await polled.wait()
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    with patch("src.sharding.poll_updates", poll_forever):
+        await asyncio.wait_for(asyncio.gather(run_polling(None, None, []), send_sigterm()), timeout=2)
@@ -0,0 +1,117 @@
+"""
+Тесты для объединения одинаковых запросов к LLM
+"""
+
+import asyncio
+import pytest
+from src.singleflight import (
+    make_request_key, coalesce, coalesce_stream, get_singleflight_stats, clear_singleflight
+)
+
+
+@pytest.fixture(autouse=True)
+def clean_stats():
+    clear_singleflight()
+    yield
+    clear_singleflight()
+
+
+def test_make_request_key():
+    """Тест что ключ зависит от всего промпта и параметров"""
+    request = {"model": "m", "messages": [{"role": "user", "content": "Привет"}], "temperature": 0.7}
+
+    assert make_request_key(request) == make_request_key(dict(request))
+    assert make_request_key(request) != make_request_key(dict(request, temperature=0.1))
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_share_one_upstream_call():
+    """Тест что одновременные одинаковые запросы делают один вызов"""
+    calls = []
+
+    async def factory():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "ответ"
+
+    results = await asyncio.gather(*[coalesce("key", factory) for _ in range(10)])
+
+    assert results == ["ответ"] * 10
+    assert len(calls) == 1
+    stats = get_singleflight_stats()
+    assert stats["leaders"] == 1
+    assert stats["coalesced"] == 9
+    assert stats["inflight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_error_is_propagated_to_every_waiter():
+    """Тест что ошибка вызова достается всем ожидающим"""
+    async def factory():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("API error")
+
+    results = await asyncio.gather(*[coalesce("key", factory) for _ in range(3)], return_exceptions=True)
+
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert get_singleflight_stats()["inflight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelling_one_waiter_keeps_the_call():
+    """Тест что отмена одного ожидающего не отменяет общий вызов, а отмена всех - отменяет"""
+    release = asyncio.Event()
+    cancelled = []
+
+    async def factory():
+        try:
+            await release.wait()
+            return "ответ"
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+
+    first = asyncio.create_task(coalesce("key", factory))
+    second = asyncio.create_task(coalesce("key", factory))
+    await asyncio.sleep(0)
+
+    first.cancel()
+    await asyncio.sleep(0)
+    release.set()
+    assert await second == "ответ"
+    assert not cancelled
+
+    release.clear()
+    lonely = asyncio.create_task(coalesce("other", factory))
+    await asyncio.sleep(0)
+    lonely.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await lonely
+    await asyncio.sleep(0)
+    assert cancelled == [1]
+    assert get_singleflight_stats()["inflight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_stream_is_shared_between_subscribers():
+    """Тест что один поток раздается всем подписчикам, включая опоздавших"""
+    opened = []
+
+    async def factory():
+        opened.append(1)
+        for part in ("Пер", "вый ", "ответ"):
+            await asyncio.sleep(0.005)
+            yield part
+
+    async def read():
+        return "".join([part async for part in coalesce_stream("key", factory)])
+
+    async def read_late():
+        await asyncio.sleep(0.007)
+        return await read()
+
+    results = await asyncio.gather(read(), read(), read_late())
+
+    assert results == ["Первый ответ"] * 3
+    assert len(opened) == 1
+    assert get_singleflight_stats()["coalesced"] == 2
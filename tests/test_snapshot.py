@@ -0,0 +1,72 @@
+"""
+Тесты для снимка истории диалогов
+"""
+
+import os
+from src.conversation_store import ConversationStore
+from src.snapshot import restore_snapshot, save_snapshot
+
+TTL = 3600
+
+
+def make_store():
+    return ConversationStore(max_messages=10, max_chats=100, idle_ttl=TTL)
+
+
+def test_snapshot_restores_history_lazily(tmp_path):
+    """Тест что после перезапуска история и краткое содержание берутся из снимка при обращении"""
+    path = str(tmp_path / "conversations.snapshot")
+    store = make_store()
+    for i in range(3):
+        store.append("1", "user", f"Вопрос {i}")
+        store.append("1", "assistant", f"Ответ {i} 😊")
+    _, turns = store.get_compaction_input("1", keep_turns=2)
+    store.compact("1", "Клиент задал два вопроса", turns)
+    store.append("2", "user", "Привет")
+    expected = store.get_messages("1")
+
+    assert save_snapshot(store, path, TTL) == 2
+
+    restored = make_store()
+    assert restore_snapshot(restored, path) == 2
+    assert not os.path.exists(path)
+    assert len(restored) == 0
+
+    assert restored.get_messages("1") == expected
+    assert restored.get_tokens("1") == store.get_tokens("1")
+    assert len(restored.snapshot) == 1
+    assert "1" not in restored.snapshot
+
+
+def test_untouched_chats_move_to_next_snapshot(tmp_path):
+    """Тест что неразобранные чаты переходят в следующий снимок, а удаленные - нет"""
+    path = str(tmp_path / "conversations.snapshot")
+    store = make_store()
+    for chat_id in ("1", "2", "3"):
+        store.append(chat_id, "user", f"Вопрос из чата {chat_id}")
+    save_snapshot(store, path, TTL)
+
+    restored = make_store()
+    restore_snapshot(restored, path)
+    assert restored.delete("2") is True
+    restored.append("3", "assistant", "Ответ")
+
+    assert save_snapshot(restored, path, TTL) == 2
+
+    final = make_store()
+    restore_snapshot(final, path)
+    assert final.get_messages("1") == [{"role": "user", "content": "Вопрос из чата 1"}]
+    assert final.get_messages("2") == []
+    assert [m["content"] for m in final.get_messages("3")] == ["Вопрос из чата 3", "Ответ"]
+
+
+def test_broken_snapshot_is_ignored(tmp_path):
+    """Тест что поврежденный снимок не мешает запуску"""
+    path = tmp_path / "conversations.snapshot"
+    path.write_bytes(b"not a snapshot at all")
+    store = make_store()
+
+    assert restore_snapshot(store, str(path)) == 0
+    assert store.snapshot is None
+    assert not path.exists()
+    assert store.get_messages("1") == []
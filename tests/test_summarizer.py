@@ -0,0 +1,79 @@
+"""
+Тесты для сжатия длинных диалогов
+"""
+
+import pytest
+from unittest.mock import Mock, patch
+from src.conversation_store import ConversationStore
+from src.summarizer import schedule_summary, summarize_chat, SUMMARY_PREFIX
+
+SUMMARY_CONFIG = {
+    "summary_enabled": True,
+    "summary_model": "cheap/model",
+    "summary_trigger_tokens": 50,
+    "summary_keep_turns": 2,
+    "summary_max_tokens": 200
+}
+
+
+def make_store(turns=6):
+    store = ConversationStore(max_messages=20, max_chats=10, idle_ttl=3600)
+    for i in range(turns):
+        store.append("chat", "user" if i % 2 == 0 else "assistant", f"Реплика {i} о проекте чат-бота для CRM")
+    return store
+
+
+def make_response(text):
+    response = Mock()
+    response.choices = [Mock()]
+    response.choices[0].message.content = text
+    return response
+
+
+@pytest.mark.asyncio
+@patch('src.summarizer.get_public_config', return_value=SUMMARY_CONFIG)
+@patch('src.summarizer.get_llm_client')
+@patch('src.summarizer.create_completion')
+@patch('src.summarizer.log_history_summary')
+async def test_summary_runs_in_background(mock_log, mock_create, mock_client, mock_config):
+    """Тест что длинная история сжимается фоновой задачей дешевой моделью"""
+    mock_create.return_value = make_response("Клиенту нужен чат-бот для CRM")
+    store = make_store()
+
+    task = schedule_summary(store, "chat")
+    assert task is not None
+    # Повторный вызов, пока сжатие идет, новую задачу не создает
+    assert schedule_summary(store, "chat") is None
+    assert await task == 4
+
+    request = mock_create.call_args[0][1]
+    assert request["model"] == "cheap/model"
+    assert "Реплика 0" in request["messages"][1]["content"]
+
+    messages = store.get_messages("chat")
+    assert messages[0]["content"] == SUMMARY_PREFIX + "Клиенту нужен чат-бот для CRM"
+    assert len(messages) == 3
+    mock_log.assert_called_once()
+
+
+@pytest.mark.asyncio
+@patch('src.summarizer.get_public_config', return_value=SUMMARY_CONFIG)
+async def test_short_history_is_not_summarized(mock_config):
+    """Тест что короткая история не сжимается"""
+    assert schedule_summary(make_store(turns=1), "chat") is None
+
+
+@pytest.mark.asyncio
+@patch('src.summarizer.get_public_config', return_value=SUMMARY_CONFIG)
+@patch('src.summarizer.get_llm_client')
+@patch('src.summarizer.create_completion', side_effect=Exception("timeout error"))
+@patch('src.summarizer.log_llm_error')
+async def test_summary_error_keeps_history(mock_log_error, mock_create, mock_client, mock_config):
+    """Тест что ошибка модели сжатия не трогает историю"""
+    store = make_store()
+    before = store.get_messages("chat")
+
+    assert await summarize_chat(store, "chat") == 0
+
+    assert store.get_messages("chat") == before
+    mock_log_error.assert_called_once_with("chat", "summary_timeout", "timeout error")
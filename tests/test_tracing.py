@@ -0,0 +1,127 @@
+"""
+Тесты для трассировки обновлений и профилирования по запросу
+"""
+
+import asyncio
+import json
+import pytest
+from types import SimpleNamespace
+from unittest.mock import patch, AsyncMock
+from src.tracing import (
+    span, record_span, trace_middleware, get_traces, export_traces, get_trace_stats, clear_traces,
+    start_profiling, stop_profiling, is_profiling
+)
+
+TRACE_CONFIG = {
+    "trace_enabled": True,
+    "trace_sample_rate": 0.0,
+    "trace_slow_threshold": 0.05,
+    "trace_buffer_size": 2,
+    "profile_duration": 30.0,
+    "profile_interval": 0.001
+}
+
+
+@pytest.fixture(autouse=True)
+def reset_traces():
+    clear_traces()
+    yield
+    clear_traces()
+
+
+async def feed(handler, update_id, chat_id="42"):
+    """Пропустить обновление через middleware трассировки"""
+    data = {"event_chat": SimpleNamespace(id=chat_id)}
+    return await trace_middleware(handler, SimpleNamespace(update_id=update_id), data)
+
+
+@pytest.mark.asyncio
+async def test_spans_are_collected_per_update():
+    """Тест что участки обработчика и его задач попадают в трассу своего обновления"""
+    async def call_llm():
+        with span("llm_attempt", attempt=1):
+            await asyncio.sleep(0)
+
+    async def handler(event, data):
+        await asyncio.sleep(0.02)
+        record_span("queue_wait", 0.01)
+        with span("history"):
+            pass
+        # Задача из обработчика (как страховочный запрос) пишет в ту же трассу
+        await asyncio.ensure_future(call_llm())
+        with pytest.raises(ValueError):
+            with span("llm_call"):
+                raise ValueError("boom")
+        return "done"
+
+    with patch("src.tracing.get_public_config", return_value=TRACE_CONFIG):
+        assert await feed(handler, 1) == "done"
+
+    # Вне трассы участки ничего не делают
+    with span("outside"):
+        pass
+
+    (trace,) = get_traces()
+    assert trace.update_id == 1 and trace.chat_id == "42"
+    names = [name for name, _, _, _ in trace.spans]
+    assert names == ["queue_wait", "history", "llm_attempt", "llm_call"]
+    assert trace.spans[3][3] == {"error": "ValueError"}
+    assert all(offset >= 0 for _, offset, _, _ in trace.spans)
+
+    exported = json.loads(json.dumps(export_traces([trace])))
+    events = exported["traceEvents"]
+    assert [event["name"] for event in events] == ["update"] + names
+    assert all(event["ph"] == "X" and event["tid"] == 1 for event in events)
+    assert events[0]["args"]["trace_id"] == trace.trace_id
+    assert events[3]["args"] == {"attempt": 1, "trace_id": trace.trace_id}
+    # Участки лежат внутри обработки обновления
+    assert all(events[0]["ts"] <= event["ts"] <= events[0]["ts"] + events[0]["dur"] for event in events)
+
+
+@pytest.mark.asyncio
+async def test_slow_traces_are_logged_and_buffer_is_bounded():
+    """Тест что в лог попадают только медленные трассы, а в буфере - последние"""
+    async def fast(event, data):
+        return None
+
+    async def slow(event, data):
+        with span("llm_call"):
+            await asyncio.sleep(0.06)
+
+    with patch("src.tracing.get_public_config", return_value=TRACE_CONFIG), \
+         patch("src.tracing.log_trace") as mock_log:
+        await feed(fast, 1)
+        await feed(slow, 2, chat_id="7")
+        await feed(fast, 3)
+
+    mock_log.assert_called_once()
+    assert mock_log.call_args[0][1:3] == (2, "7")
+    assert mock_log.call_args[0][4][0][0] == "llm_call"
+    assert [trace.update_id for trace in get_traces()] == [2, 3]
+    assert [trace.update_id for trace in get_traces(min_duration=0.05)] == [2]
+    assert get_trace_stats() == {"traces": 3, "logged": 1, "buffered": 2}
+
+
+@pytest.mark.asyncio
+async def test_profiling_window_writes_results(tmp_path):
+    """Тест что окно профилирования пишет стеки и отчет о памяти и сообщает о файлах"""
+    config = dict(TRACE_CONFIG, profile_dir=str(tmp_path))
+    on_done = AsyncMock()
+
+    with patch("src.tracing.get_public_config", return_value=config):
+        assert start_profiling(30, on_done) == 30
+        assert start_profiling() is None
+        data = [list(range(1000)) for _ in range(100)]
+        for _ in range(20):
+            sum(sum(row) for row in data)
+            await asyncio.sleep(0.005)
+        paths = await stop_profiling()
+        assert await stop_profiling() is None
+
+    assert not is_profiling()
+    on_done.assert_awaited_once_with(paths)
+    cpu, memory, snapshot = paths
+    assert cpu.endswith(".folded") and snapshot.endswith(".snapshot")
+    stacks = (tmp_path / cpu.split("/")[-1]).read_text(encoding="utf-8").splitlines()
+    assert stacks and all(line.rsplit(" ", 1)[1].isdigit() for line in stacks)
+    assert "Рост памяти за окно" in (tmp_path / memory.split("/")[-1]).read_text(encoding="utf-8")
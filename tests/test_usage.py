@@ -0,0 +1,93 @@
+"""
+Тесты для учета расхода токенов и бюджетов чатов
+"""
+
+import json
+import pytest
+from unittest.mock import Mock, AsyncMock
+from openai.types import CompletionUsage
+from src.llm_client import create_completion
+from src.usage import (
+    record_usage, get_chat_tokens, apply_chat_budget, take_usage_window, flush_usage,
+    get_usage_stats, clear_usage, BUDGET_OK, BUDGET_REDUCED, BUDGET_EXHAUSTED
+)
+
+BUDGET_CONFIG = {
+    "token_budget_enabled": True,
+    "chat_daily_token_budget": 1000,
+    "token_budget_downshift": 0.8,
+    "token_budget_max_tokens": 100,
+    "token_budget_model": "cheap/model"
+}
+
+
+@pytest.fixture(autouse=True)
+def reset_usage():
+    clear_usage()
+    yield
+    clear_usage()
+
+
+def make_request():
+    return {"model": "main/model", "messages": [], "max_tokens": 1000}
+
+
+def test_usage_is_aggregated_per_chat_and_model():
+    """Тест что расход копится по паре чат/модель за окно и по чату за сутки"""
+    record_usage("1", "main/model", 100, 20, cached_tokens=80)
+    record_usage("1", "main/model", 150, 30)
+    record_usage("1", "cheap/model", 10, 5)
+    record_usage("2", "main/model", 40, 10)
+
+    assert get_chat_tokens("1") == 315
+    rows = {(row["chat_id"], row["model"]): row for row in take_usage_window()}
+    assert rows[("1", "main/model")]["prompt_tokens"] == 250
+    assert rows[("1", "main/model")]["cached_tokens"] == 80
+    assert rows[("1", "main/model")]["calls"] == 2
+    assert len(rows) == 3
+
+    # Новое окно пустое, а дневной расход сохраняется
+    assert take_usage_window() == []
+    assert get_chat_tokens("1") == 315
+
+
+def test_budget_downshifts_chat_near_limit():
+    """Тест что близко к лимиту ответ сокращается, а после лимита меняется модель"""
+    request = make_request()
+    assert apply_chat_budget("1", request, BUDGET_CONFIG) == BUDGET_OK
+    assert request == make_request()
+
+    record_usage("1", "main/model", 700, 100)
+    request = make_request()
+    assert apply_chat_budget("1", request, BUDGET_CONFIG) == BUDGET_REDUCED
+    assert request["max_tokens"] == 100
+    assert request["model"] == "main/model"
+
+    record_usage("1", "main/model", 150, 50)
+    request = make_request()
+    assert apply_chat_budget("1", request, BUDGET_CONFIG) == BUDGET_EXHAUSTED
+    assert request["model"] == "cheap/model"
+    apply_chat_budget("1", make_request(), BUDGET_CONFIG)
+
+    # Другие чаты не затронуты, переход на уровень считается один раз
+    assert apply_chat_budget("2", make_request(), BUDGET_CONFIG) == BUDGET_OK
+    assert get_usage_stats()["downshifts"] == 2
+    assert apply_chat_budget("1", make_request(), dict(BUDGET_CONFIG, token_budget_enabled=False)) == BUDGET_OK
+
+
+@pytest.mark.asyncio
+async def test_completion_usage_is_recorded_for_chat(tmp_path):
+    """Тест что usage ответа LLM попадает в расход чата и в отчет"""
+    response = Mock()
+    response.usage = CompletionUsage(prompt_tokens=120, completion_tokens=30, total_tokens=150,
+                                     prompt_tokens_details={"cached_tokens": 100})
+    client = Mock()
+    client.chat.completions.create = AsyncMock(return_value=response)
+
+    await create_completion(client, make_request(), chat_id="42")
+
+    assert get_chat_tokens("42") == 150
+    path = tmp_path / "usage.jsonl"
+    assert await flush_usage(str(path)) == 1
+    row = json.loads(path.read_text(encoding="utf-8"))
+    assert (row["chat_id"], row["model"], row["cached_tokens"]) == ("42", "main/model", 100)
@@ -0,0 +1,83 @@
+"""
+Тесты для webhook приема обновлений
+"""
+
+import asyncio
+import pytest
+from unittest.mock import Mock, AsyncMock, patch
+from aiohttp.test_utils import TestServer, TestClient
+from src.webhook import create_webhook_app, SECRET_HEADER, QUEUE_KEY, STATS_KEY
+
+WEBHOOK_CONFIG = {
+    "webhook_path": "/webhook",
+    "webhook_workers": 2,
+    "webhook_queue_size": 1
+}
+
+UPDATE = {
+    "update_id": 1,
+    "message": {
+        "message_id": 1,
+        "date": 0,
+        "chat": {"id": 12345, "type": "private"},
+        "text": "Привет"
+    }
+}
+
+
+async def make_client(dp):
+    """Поднять тестовый сервер с webhook приложением"""
+    with patch('src.webhook.get_public_config', return_value=WEBHOOK_CONFIG):
+        app = create_webhook_app(dp, Mock(), "secret")
+    client = TestClient(TestServer(app))
+    await client.start_server()
+    return client, app
+
+
+@pytest.mark.asyncio
+async def test_webhook_rejects_wrong_secret():
+    """Тест отказа при неверном секретном токене"""
+    dp = Mock()
+    dp.feed_update = AsyncMock()
+    client, app = await make_client(dp)
+
+    response = await client.post("/webhook", json=UPDATE, headers={SECRET_HEADER: "wrong"})
+
+    assert response.status == 403
+    assert app[STATS_KEY]["received"] == 0
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_webhook_accepts_and_processes_update():
+    """Тест приема обновления и передачи в диспетчер"""
+    dp = Mock()
+    dp.feed_update = AsyncMock()
+    client, app = await make_client(dp)
+
+    response = await client.post("/webhook", json=UPDATE, headers={SECRET_HEADER: "secret"})
+    await app[QUEUE_KEY].join()
+
+    assert response.status == 200
+    dp.feed_update.assert_called_once()
+    assert dp.feed_update.call_args[0][1].update_id == 1
+    assert app[STATS_KEY]["processed"] == 1
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_webhook_queue_full():
+    """Тест backpressure: при полной очереди сервер отвечает 503"""
+    dp = Mock()
+    dp.feed_update = AsyncMock()
+    client, app = await make_client(dp)
+
+    # Заполняем очередь напрямую, чтобы не зависеть от скорости воркеров
+    app[QUEUE_KEY].put_nowait(UPDATE)
+    app[QUEUE_KEY].put_nowait = Mock(side_effect=asyncio.QueueFull)
+
+    response = await client.post("/webhook", json=UPDATE, headers={SECRET_HEADER: "secret"})
+
+    assert response.status == 503
+    assert app[STATS_KEY]["rejected"] == 1
+    await client.close()